@@ -0,0 +1,211 @@
+"""
+Benchmarks for the vault's hot paths on synthetic vaults.
+
+    python -m benchmarks.bench run --sizes 1k,10k --dist mixed --out results.json
+    python -m benchmarks.bench compare baseline.json results.json --threshold 0.2
+
+`run` writes one JSON document of timings; `compare` lines two of them up and exits 1 if any
+operation got slower than the threshold allows.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Callable
+
+from benchmarks.synth import DISTRIBUTIONS, make_sources, parse_count, populate
+
+REPO = Path(__file__).resolve().parent.parent
+# Per-entry operations are timed on a random sample this big rather than the whole vault
+DEFAULT_SAMPLE = 200
+# Below this many seconds a difference is noise, whatever the ratio says
+MIN_SIGNIFICANT_SECONDS = 0.005
+
+
+class StubMessages:
+    # Stands in for the Anthropic client: fixed latency, canned text (JSON for batched prompts), no network
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.calls = 0
+
+    async def create(self, model, max_tokens, messages):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        names = re.findall(r'<file name="(.*?)">', messages[0]["content"])
+        text = json.dumps({n: "A synthetic description." for n in names}) if names else "A synthetic description."
+        block = type("Block", (), {"text": text})()
+        return type("Message", (), {"content": [block]})()
+
+
+class StubClient:
+    def __init__(self, latency: float = 0.05) -> None:
+        self.messages = StubMessages(latency)
+
+
+def timed(fn: Callable[[], object]) -> float:
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def result(size: int, dist: str, op: str, seconds: float, n: int = 1) -> dict:
+    return {
+        "size": size,
+        "dist": dist,
+        "op": op,
+        "n": n,
+        "seconds": round(seconds, 6),
+        "per_op_ms": round(seconds / n * 1000, 4) if n else None,
+    }
+
+
+def bench_vault(size: int, dist: str, sample: int, latency: float, seed: int) -> list[dict]:
+    # Everything for one (size, distribution) pair, in a throwaway directory
+    from cli import cmd_list
+    from core.describer import describe_many
+    from core.metadata import MetaStore
+    from core.preview import render
+    from core.vault import add_file, add_many, paste_files, remove_files
+    from core.ai_desc import describe_file_baseline
+
+    out = []
+    with tempfile.TemporaryDirectory(prefix="locky-bench-") as tmp:
+        root = Path(tmp)
+        vault = populate(root, size, dist, seed=seed)
+        cfg = vault.cfg
+        out.append(result(size, dist, "populate", vault.seconds, size))
+        rng = random.Random(seed)
+        picked = rng.sample(vault.names, min(sample, len(vault.names)))
+        sources = make_sources(root / "src", len(picked), dist, seed=seed)
+
+        meta = MetaStore(cfg.db_path)
+        try:
+            out.append(result(size, dist, "list_files", timed(meta.list_files)))
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                out.append(result(size, dist, "cmd_list", timed(lambda: cmd_list(cfg, meta, []))))
+
+            half = len(sources) // 2
+            out.append(result(size, dist, "add_file", timed(lambda: [add_file(cfg, meta, p) for p in sources[:half]]), half))
+            rest = [(p, f"bulk/{p.name}") for p in sources[half:]]
+            out.append(result(size, dist, "add_many", timed(lambda: add_many(cfg, meta, rest)), len(rest)))
+
+            out.append(result(size, dist, "preview_render", timed(
+                lambda: [render(meta, cfg.vault_dir, name, ["cat"], width=80, max_lines=1000) for name in picked]
+            ), len(picked)))
+            out.append(result(size, dist, "paste_files", timed(
+                lambda: paste_files(cfg, meta, picked, root / "paste")
+            ), len(picked)))
+
+            described = [(p, p.name) for p in sources[:half]]
+            out.append(result(size, dist, "describe_baseline", timed(
+                lambda: [describe_file_baseline(p) for p, _ in described]
+            ), len(described)))
+            client = StubClient(latency)
+            out.append(result(size, dist, "describe_many_stub", timed(
+                lambda: describe_many(meta, described, client=client)
+            ), len(described)))
+
+            out.append(result(size, dist, "remove_files", timed(lambda: remove_files(cfg, meta, picked)), len(picked)))
+        finally:
+            meta.close()
+
+        # Cold start included: what a user typing `locky list` actually waits for
+        env = dict(os.environ, TEMPVAULT_DIR=str(cfg.vault_dir), PYTHONPATH=str(REPO))
+        env.pop("ANTHROPIC_API_KEY", None)
+        out.append(result(size, dist, "locky_list_cold", timed(lambda: subprocess.run(
+            [sys.executable, str(REPO / "cli.py"), "list"],
+            env=env, stdout=subprocess.DEVNULL, check=True,
+        ))))
+    return out
+
+
+def run(args: argparse.Namespace) -> int:
+    results = []
+    for size in (parse_count(s) for s in args.sizes.split(",")):
+        for dist in args.dist.split(","):
+            print(f"benchmarking {size} entries ({dist})...", file=sys.stderr)
+            results.extend(bench_vault(size, dist, args.sample, args.latency, args.seed))
+    doc = {
+        "created_at": int(time.time()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sample": args.sample,
+        "stub_latency": args.latency,
+        "results": results,
+    }
+    text = json.dumps(doc, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+def compare_results(baseline: dict, current: dict, threshold: float) -> list[dict]:
+    """
+    One row per (size, dist, op) present in both documents, flagged when current is slower
+    than baseline by more than threshold (0.2 = 20%) and by a measurable amount.
+    """
+    base = {(r["size"], r["dist"], r["op"]): r for r in baseline["results"]}
+    rows = []
+    for r in current["results"]:
+        old = base.get((r["size"], r["dist"], r["op"]))
+        if old is None:
+            continue
+        # Compare per-operation times so different sample sizes still line up
+        before, after = old["seconds"] / old["n"], r["seconds"] / r["n"]
+        ratio = after / before if before > 0 else float("inf")
+        regressed = ratio > 1 + threshold and (r["seconds"] - old["seconds"]) > MIN_SIGNIFICANT_SECONDS
+        rows.append({"size": r["size"], "dist": r["dist"], "op": r["op"],
+                     "before": before, "after": after, "ratio": ratio, "regressed": regressed})
+    return rows
+
+
+def compare(args: argparse.Namespace) -> int:
+    baseline = json.loads(Path(args.baseline).read_text())
+    current = json.loads(Path(args.current).read_text())
+    rows = compare_results(baseline, current, args.threshold)
+    for row in rows:
+        flag = "REGRESSION" if row["regressed"] else ""
+        print(f"{row['size']:>8} {row['dist']:<6} {row['op']:<20} "
+              f"{row['before'] * 1000:>10.3f} ms -> {row['after'] * 1000:>10.3f} ms  x{row['ratio']:.2f}  {flag}")
+    regressions = sum(row["regressed"] for row in rows)
+    print(f"{regressions} regression(s) over {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="benchmark synthetic vaults and write JSON")
+    p_run.add_argument("--sizes", default="1k,10k", help="comma-separated entry counts, e.g. 1k,10k,100k,1m")
+    p_run.add_argument("--dist", default="small", help=f"comma-separated size distributions: {', '.join(DISTRIBUTIONS)}")
+    p_run.add_argument("--sample", type=int, default=DEFAULT_SAMPLE, help="entries used for per-file operations")
+    p_run.add_argument("--latency", type=float, default=0.05, help="stub AI client latency in seconds")
+    p_run.add_argument("--seed", type=int, default=0)
+    p_run.add_argument("--out", help="write results here instead of stdout")
+    p_run.set_defaults(func=run)
+
+    p_cmp = sub.add_parser("compare", help="flag regressions against a stored baseline")
+    p_cmp.add_argument("baseline")
+    p_cmp.add_argument("current")
+    p_cmp.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown, 0.2 = 20%%")
+    p_cmp.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,138 @@
+from __future__ import annotations
+import hashlib
+import math
+import random
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from config import Config
+from core.metadata import MetaStore
+from core.vault import blob_store, init_vault
+
+# name -> (median bytes, lognormal sigma, cap); sizes are drawn per file from a lognormal
+DISTRIBUTIONS = {
+    # notes, snippets, small configs
+    "small": (2_000, 0.6, 64_000),
+    # a typical mix of source files, docs and the odd data file
+    "mixed": (8_000, 1.5, 8_000_000),
+    # logs, CSVs and SQL dumps
+    "large": (1_000_000, 1.0, 64_000_000),
+}
+EXTENSIONS = (".txt", ".py", ".md", ".csv", ".log", ".json", ".sql", ".sh")
+WORDS = (
+    "vault config deploy server client request response cache index query table column "
+    "import export parse build test fixture module function return value error retry "
+    "timeout backup restore migrate schema record stream buffer socket thread worker"
+).split()
+# Entries per metadata transaction while populating
+BATCH = 5_000
+
+
+@dataclass
+class SyntheticVault:
+    cfg: Config
+    names: list[str]
+    bytes_total: int
+    seconds: float
+
+
+def parse_count(text: str) -> int:
+    # "1k" -> 1000, "1m" -> 1000000, "250" -> 250
+    text = text.strip().lower()
+    scale = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * scale)
+
+
+def draw_sizes(n: int, dist: str, rng: random.Random) -> list[int]:
+    median, sigma, cap = DISTRIBUTIONS[dist]
+    mu = math.log(median)
+    return [max(1, min(cap, int(rng.lognormvariate(mu, sigma)))) for _ in range(n)]
+
+
+def text_pool(rng: random.Random, size: int = 1 << 16) -> bytes:
+    # One block of word soup that every synthetic file is cut from
+    lines = []
+    total = 0
+    while total < size:
+        line = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 14))) + "\n"
+        lines.append(line)
+        total += len(line)
+    return "".join(lines).encode()
+
+
+def content(i: int, size: int, pool: bytes) -> bytes:
+    # A unique first line (so digests differ) followed by pool text wrapped to length
+    head = f"# synthetic file {i}\n".encode()
+    body = pool[i % len(pool):] + pool
+    reps = (size // len(pool)) + 2
+    return (head + body * reps)[:max(size, len(head))]
+
+
+def make_cfg(root: Path) -> Config:
+    vault_dir = root / "vault"
+    return Config(vault_dir=vault_dir, db_path=vault_dir / "metadata.sqlite3", paste_dir=root / "paste")
+
+
+def make_sources(root: Path, n: int, dist: str = "small", seed: int = 0) -> list[Path]:
+    """
+    Write n files under root (outside any vault), for timing the add path itself.
+    """
+    rng = random.Random(seed)
+    pool = text_pool(rng)
+    paths = []
+    for i, size in enumerate(draw_sizes(n, dist, rng)):
+        path = root / f"src{i:07d}{EXTENSIONS[i % len(EXTENSIONS)]}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content(1_000_000_000 + i, size, pool))
+        paths.append(path)
+    return paths
+
+
+def populate(root: Path, n: int, dist: str = "small", dup_ratio: float = 0.0, seed: int = 0) -> SyntheticVault:
+    """
+    Build a vault of n entries directly (blobs written in place, metadata in big batches),
+    which is far faster than going through add_many and gives the same on-disk state.
+    dup_ratio is the fraction of entries that reuse an earlier entry's contents.
+    """
+    started = time.perf_counter()
+    cfg = make_cfg(root)
+    meta = init_vault(cfg)
+    blobs = blob_store(cfg, meta)
+    rng = random.Random(seed)
+    pool = text_pool(rng)
+    sizes = draw_sizes(n, dist, rng)
+    names: list[str] = []
+    digests: list[tuple[str, int]] = []
+    rows, new_blobs, descs = [], [], []
+    total = 0
+    for i, size in enumerate(sizes):
+        ext = EXTENSIONS[i % len(EXTENSIONS)]
+        name = f"dir{i // 1000:04d}/file{i:07d}{ext}"
+        if digests and rng.random() < dup_ratio:
+            digest, size = rng.choice(digests)
+        else:
+            data = content(i, size, pool)
+            digest = hashlib.sha256(data).hexdigest()
+            path = blobs.path(digest)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+            digests.append((digest, size))
+            new_blobs.append((digest, size, blobs.relpath(digest), None, size))
+        total += size
+        names.append(name)
+        rows.append((name, size, digest))
+        descs.append((name, f"Synthetic {ext[1:]} file number {i} about {rng.choice(WORDS)}"))
+        if len(rows) >= BATCH:
+            _flush(meta, rows, new_blobs, descs)
+    _flush(meta, rows, new_blobs, descs)
+    meta.close()
+    return SyntheticVault(cfg, names, total, time.perf_counter() - started)
+
+
+def _flush(meta: MetaStore, rows: list, new_blobs: list, descs: list) -> None:
+    meta.upsert_many(rows, new_blobs)
+    meta.set_descriptions(descs)
+    rows.clear()
+    new_blobs.clear()
+    descs.clear()
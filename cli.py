@@ -1,14 +1,23 @@
 from __future__ import annotations
 import sys
+import time
 from pathlib import Path
 
-from config import load_config
-from core.vault import init_vault, add_file, paste_files, remove_files
-from core.describer import describe_and_store
-from ui.fzf_ui import pick_files, pick_file_to_add
+from config import Config, load_config
+from core.metadata import MetaStore
+from core.vault import init_vault
+from utils import trace
+
+# Each command imports what it needs inside its handler, so e.g. `locky list` never
+# loads the Anthropic SDK, fzf helpers or numpy. tests/test_startup.py holds us to it.
 
 
 def main():
+    # --trace / --trace=FILE (or LOCKY_TRACE) reports where the command spent its time
+    trace.enable_from_env()
+    for arg in [a for a in sys.argv[1:] if a == "--trace" or a.startswith("--trace=")]:
+        sys.argv.remove(arg)
+        trace.enable(arg.partition("=")[2] or "1")
     cfg = load_config()
     meta = init_vault(cfg)
 
@@ -17,73 +26,553 @@ def main():
         print("")
         print("Commands:")
         print("  locky add              Browse and pick a file to add to the vault")
-        print("  locky add <filepath>   Add a specific file to the vault")
+        print("  locky add <path...>    Add files, directories (recursively) or glob patterns")
+        print("                         [--on-conflict ask|skip|overwrite|rename] [--jobs N]")
+        print("                         [--compress off|auto|zlib|lzma]")
         print("  locky paste            Pick files from the vault and paste them to ~/Locky-files")
+        print("                         [--link | --symlink] [--match QUERY [--limit N]] [--pack FILE]")
+        print("                         [--to DIR] [--on-conflict ask|skip|overwrite|rename|newer] [--jobs N]")
         print("  locky list             List all files in the vault with descriptions")
+        print("                         [--sort name|size|added] [--since WHEN] [--type KIND]")
+        print("                         [--larger-than SIZE] [--limit N] [--offset N] [--json]")
+        print("  locky search <words>   Full-text search over names, descriptions and contents")
+        print("  locky search --semantic <words>   Offline similarity search over descriptions")
         print("  locky remove           Browse the vault and remove selected files")
+        print("  locky migrate          Move old flat vault files into the blob store [--fanout N]")
+        print("  locky sync <dir>       Mirror the vault into <dir>, sending only what changed [--verify]")
+        print("  locky history <name>   List the versions a file kept each time it was overwritten")
+        print("  locky restore <name>@<n>   Write version n of a file to ~/Locky-files [--to DIR]")
+        print("  locky export <file|->  Pack the whole vault into one file (or stdout)")
+        print("  locky import <file>    Add everything in a pack [--on-conflict skip|overwrite] [--jobs N]")
+        print("  locky fsck             Check the vault against its database [--repair] [--full] [--jobs N]")
+        print("")
+        print("  --trace[=FILE]         Time each phase; summary on stderr, or JSON lines to FILE")
         return
 
     cmd = sys.argv[1]
+    handler = COMMANDS.get(cmd)
+    if handler is None:
+        print(f"Unknown command: '{cmd}'")
+        print("Run 'locky' with no arguments for help.")
+        return
+    with trace.span(f"cmd.{cmd}"):
+        handler(cfg, meta, sys.argv[2:])
 
-    if cmd == "add":
-        if len(sys.argv) < 3:
-            path = pick_file_to_add(Path.home())
-            if path is None:
-                return
-        else:
-            path = Path(sys.argv[2])
-        try:
-            add_file(cfg, meta, path)
-        except FileNotFoundError:
-            print(f"Error: file not found: {path}")
+
+def cmd_add(cfg: Config, meta: MetaStore, argv: list[str]) -> None:
+    import argparse
+    import glob
+    from core.compression import COMPRESSION_MODES
+    from core.vault import add_many, iter_sources, CONFLICT_POLICIES
+
+    parser = argparse.ArgumentParser(prog="locky add")
+    parser.add_argument("paths", nargs="*")
+    parser.add_argument("--on-conflict", choices=CONFLICT_POLICIES, default=None,
+                        help="names the vault already has: ask (default on a terminal), skip (default "
+                             "otherwise), overwrite or rename")
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--compress", choices=COMPRESSION_MODES, default=cfg.compression,
+                        help="compress stored contents (default from LOCKY_COMPRESSION, else off)")
+    args = parser.parse_args(argv)
+    if args.on_conflict is None:
+        # Scripts and pipes must never block on a question
+        args.on_conflict = "ask" if sys.stdin.isatty() else "skip"
+
+    if not args.paths:
+        from ui.fzf_ui import pick_file_to_add
+        path = pick_file_to_add(Path.home())
+        if path is None:
+            return
+        args.paths = [str(path)]
+
+    for p in args.paths:
+        if not Path(p).exists() and not glob.has_magic(p):
+            print(f"Error: file not found: {p}")
             return
-        desc = describe_and_store(meta, cfg.vault_dir / path.name)
-        print(f"Added '{path.name}'")
+    with trace.span("add.store"):
+        report = add_many(
+            cfg, meta, iter_sources(args.paths),
+            policy=args.on_conflict, workers=args.jobs, on_progress=_print_progress,
+            compression=args.compress,
+        )
+
+    # Descriptions are the only part that may need the Anthropic SDK
+    from core.describer import describe_and_store, describe_many
+    from core.semantic import index_files
+
+    if len(report.added) == 1 and not report.skipped and not report.failed:
+        name, src = report.added[0]
+        with trace.span("add.describe"):
+            desc = describe_and_store(meta, src, name, cache_size=cfg.desc_cache_size)
+        with trace.span("add.index"):
+            index_files(cfg.vault_dir, meta, [name])
+        print(f"Added '{name}'")
         print(f"Description: {desc}")
+        return
+    # Describe everything that was stored, several API calls at a time
+    with trace.span("add.describe"):
+        describe_many(
+            meta, ((src, name) for name, src in report.added),
+            concurrency=cfg.ai_concurrency, cache_size=cfg.desc_cache_size,
+        )
+    with trace.span("add.index"):
+        index_files(cfg.vault_dir, meta, (name for name, _ in report.added))
+    _print_add_report(report)
 
-    elif cmd == "paste":
-        files = meta.list_files()
-        if not files:
-            print("Vault is empty.")
+
+def cmd_paste(cfg: Config, meta: MetaStore, argv: list[str]) -> None:
+    import argparse
+    from core.vault import PASTE_MANIFEST, PASTE_POLICIES
+
+    parser = argparse.ArgumentParser(prog="locky paste")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--link", dest="mode", action="store_const", const="link",
+                      help="hard-link instead of copying (read-only; copies across filesystems)")
+    mode.add_argument("--symlink", dest="mode", action="store_const", const="symlink",
+                      help="symlink into the vault instead of copying (read-only)")
+    parser.set_defaults(mode="copy")
+    parser.add_argument("--match", metavar="QUERY",
+                        help="paste the best matches for QUERY without opening the picker")
+    parser.add_argument("--limit", type=int, default=1,
+                        help="how many matches --match pastes (default 1)")
+    parser.add_argument("--pack", type=Path, metavar="FILE",
+                        help="paste from a pack made by 'locky export' instead of the vault (read-only)")
+    parser.add_argument("--to", type=Path, metavar="DIR",
+                        help="directory to paste into (default: the paste folder)")
+    parser.add_argument("--on-conflict", choices=PASTE_POLICIES, default=None,
+                        help="files already at the destination: ask once (default on a terminal), "
+                             "skip (default otherwise), overwrite, rename, or newer (replace only older files)")
+    parser.add_argument("--jobs", type=int, default=8, help="files copied in parallel (default 8)")
+    parser.add_argument("--no-manifest", action="store_true",
+                        help=f"don't write {PASTE_MANIFEST} into the destination")
+    args = parser.parse_args(argv)
+    if args.on_conflict is None:
+        # Scripts and pipes must never block on a question
+        args.on_conflict = "ask" if sys.stdin.isatty() else "skip"
+
+    if args.pack is not None:
+        from core.pack import is_pack, open_pack
+
+        path = args.pack.expanduser()
+        if not is_pack(path):
+            print(f"Error: not a locky pack: {path}")
             return
-        selected = pick_files(files, cfg.db_path, cfg.vault_dir)
+        # The pack's own metadata drives the picker; contents come out of the mapped pack
+        with open_pack(path) as (pack, pack_meta):
+            _paste(cfg, pack_meta, args, pack)
+        return
+    _paste(cfg, meta, args)
+
+
+def _paste(cfg: Config, meta: MetaStore, args, pack=None) -> None:
+    from core.vault import paste_many
+    from ui.fzf_ui import pick_files
+
+    if args.match is not None:
+        from core.fuzzy import FuzzyMatcher
+
+        selected = [m.name for m in FuzzyMatcher(meta).search(args.match, limit=args.limit)]
         if not selected:
-            print("Nothing selected.")
+            print(f"No matches for '{args.match}'.")
             return
-        # Ensure the paste folder exists
-        cfg.paste_dir.mkdir(parents=True, exist_ok=True)
-        pasted = paste_files(cfg, selected, cfg.paste_dir)
-        if pasted:
-            print(f"\nPasted {len(pasted)} file(s) to {cfg.paste_dir}:")
-            for name in pasted:
-                print(f"  {name}")
-
-    elif cmd == "list":
+    else:
         files = meta.list_files()
         if not files:
             print("Vault is empty.")
             return
-        for name in files:
-            desc = meta.get_description(name) or "no description"
-            print(f"  {name}  —  {desc}")
+        selected = pick_files(files, meta.db_path, cfg.vault_dir, pack.path if pack else None)
+    if not selected:
+        print("Nothing selected.")
+        return
+    # Ensure the paste folder exists
+    dest = (args.to or cfg.paste_dir).expanduser()
+    dest.mkdir(parents=True, exist_ok=True)
+    report = paste_many(
+        cfg, meta, selected, dest, args.mode, args.on_conflict,
+        workers=args.jobs, pack=pack, manifest=not args.no_manifest,
+    )
+    _print_paste_report(report, dest)
 
-    elif cmd == "remove":
-        files = meta.list_files()
-        if not files:
-            print("Vault is empty.")
-            return
-        selected = pick_files(files, cfg.db_path, cfg.vault_dir)
-        if not selected:
-            print("Nothing selected.")
+
+def cmd_list(cfg: Config, meta: MetaStore, argv: list[str]) -> None:
+    import argparse
+    from core.metadata import LIST_ORDERS
+
+    parser = argparse.ArgumentParser(prog="locky list")
+    parser.add_argument("--sort", choices=LIST_ORDERS, default="name",
+                        help="name, size (biggest first) or added (newest first)")
+    parser.add_argument("--since", type=_parse_since, metavar="WHEN",
+                        help="only files added since, e.g. 2d, 12h, 30m or 2026-01-31")
+    parser.add_argument("--type", dest="kind", metavar="KIND",
+                        help="only files of this kind: text, binary, empty, png, pdf, ...")
+    parser.add_argument("--larger-than", type=_parse_size, metavar="SIZE",
+                        help="only files bigger than SIZE, e.g. 500k, 10M or 1.5G")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--offset", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="a JSON array of every field")
+    args = parser.parse_args(argv)
+    rows = meta.list_entries(args.sort, args.since, args.kind, args.larger_than, args.limit, args.offset)
+    # Rows are printed as the cursor hands them out, so a huge vault starts printing at once
+    # and memory stays flat
+    if args.json:
+        _print_json_rows(rows)
+        return
+    from core.sampler import human_size
+
+    empty = True
+    for row in rows:
+        empty = False
+        desc = row["description"] or "no description"
+        if args.sort == "size":
+            print(f"  {row['filename']}  ({human_size(row['size_bytes'])})  —  {desc}")
+        elif args.sort == "added":
+            added = time.strftime("%Y-%m-%d %H:%M", time.localtime(row["added_at"]))
+            print(f"  {added}  {row['filename']}  —  {desc}")
+        else:
+            print(f"  {row['filename']}  —  {desc}")
+    if empty:
+        filtered = args.since is not None or args.kind or args.larger_than is not None or args.offset
+        print("No matching files." if filtered else "Vault is empty.")
+
+
+def _print_json_rows(rows) -> None:
+    # One array, written an element at a time
+    import json
+
+    out = sys.stdout
+    out.write("[")
+    first = True
+    for row in rows:
+        out.write("\n  " if first else ",\n  ")
+        out.write(json.dumps(dict(row), ensure_ascii=False))
+        first = False
+    out.write("\n]\n" if not first else "]\n")
+
+
+def _parse_since(text: str) -> int:
+    # "30m", "12h", "2d", "1w" ago, or a date/time like "2026-01-31" or "2026-01-31T09:30"
+    import argparse
+    from datetime import datetime
+
+    units = {"m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+    if text[-1:] in units and text[:-1].isdigit():
+        return int(time.time()) - int(text[:-1]) * units[text[-1]]
+    try:
+        return int(datetime.fromisoformat(text).timestamp())
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a duration or date: {text!r}") from None
+
+
+def _parse_size(text: str) -> int:
+    # "1500", "500k", "10M", "1.5G" (powers of 1024, like the sizes `locky list` prints)
+    import argparse
+
+    units = {"k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40}
+    scale = units.get(text[-1:].lower(), 1)
+    try:
+        return int(float(text[:-1] if scale > 1 else text) * scale)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a size: {text!r}") from None
+
+
+def cmd_search(cfg: Config, meta: MetaStore, argv: list[str]) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="locky search")
+    parser.add_argument("query", nargs="+")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--semantic", action="store_true",
+                        help="rank by meaning of names and descriptions (needs numpy)")
+    args = parser.parse_args(argv)
+    if args.semantic:
+        from core.semantic import SemanticIndex, available as semantic_available
+
+        if not semantic_available():
+            print("Error: semantic search needs numpy (pip install numpy)")
             return
-        removed = remove_files(cfg, meta, selected)
-        print(f"\nRemoved {len(removed)} file(s) from vault:")
-        for name in removed:
-            print(f"  {name}")
+        index = SemanticIndex(cfg.vault_dir, meta)
+        if not index.exists():
+            # First semantic search builds the index; after that add/remove keep it current
+            index.rebuild()
+        hits = index.query(" ".join(args.query), k=args.limit)
+        if not hits:
+            print("No matches.")
+        for name, _ in hits:
+            print(f"  {name}  —  {meta.get_description(name) or 'no description'}")
+        return
+    # Bold the matched words when printing to a terminal
+    mark = ("\033[1m", "\033[0m") if sys.stdout.isatty() else ("[", "]")
+    results = meta.search(" ".join(args.query), limit=args.limit, mark=mark)
+    if not results:
+        print("No matches.")
+        return
+    for row in results:
+        print(f"  {row['filename']}  —  {row['snippet'] or row['description'] or ''}")
+
+
+def cmd_remove(cfg: Config, meta: MetaStore, argv: list[str]) -> None:
+    from core.vault import remove_files
+    from ui.fzf_ui import pick_files
+
+    files = meta.list_files()
+    if not files:
+        print("Vault is empty.")
+        return
+    selected = pick_files(files, cfg.db_path, cfg.vault_dir)
+    if not selected:
+        print("Nothing selected.")
+        return
+    removed = remove_files(cfg, meta, selected)
+    print(f"\nRemoved {len(removed)} file(s) from vault:")
+    for name in removed:
+        print(f"  {name}")
+
+
+def cmd_migrate(cfg: Config, meta: MetaStore, argv: list[str]) -> None:
+    import argparse
+    from core.blobs import MAX_FANOUT
+    from core.vault import migrate_vault
+
+    parser = argparse.ArgumentParser(prog="locky migrate")
+    parser.add_argument("--fanout", type=int, choices=range(1, MAX_FANOUT + 1),
+                        help="shard levels under blobs/ (2 or 3 for vaults with millions of files)")
+    args = parser.parse_args(argv)
+
+    report = migrate_vault(cfg, meta, fanout=args.fanout)
+    print(f"Moved {report.converted} flat file(s) into the blob store")
+    if report.moved:
+        print(f"Relocated {report.moved} blob(s) to the new layout")
+    if report.leftovers:
+        print(f"Cleaned up {report.leftovers} file(s) left by an interrupted migration")
+    for name in report.missing:
+        print(f"  missing from vault directory: {name}")
+
+
+def cmd_sync(cfg: Config, meta: MetaStore, argv: list[str]) -> None:
+    import argparse
+    from core.sync import sync_vault
 
+    parser = argparse.ArgumentParser(prog="locky sync")
+    parser.add_argument("target", type=Path, help="mirror directory (created if missing)")
+    parser.add_argument("--verify", action="store_true",
+                        help="read back every file on the mirror and resend what does not match, "
+                             "instead of trusting the last sync")
+    args = parser.parse_args(argv)
+
+    try:
+        report = sync_vault(cfg, meta, args.target, verify=args.verify)
+    except ValueError as exc:
+        print(f"Error: {exc}")
+        return
+    print(f"Synced to {args.target}: {report.copied} copied, {report.patched} patched, "
+          f"{report.moved} moved, {report.deleted} deleted, {report.unchanged} unchanged")
+    print(f"  read {report.bytes_sent / 1e6:.1f} MB from the vault for {report.bytes_total / 1e6:.1f} MB written")
+    for name in report.missing:
+        print(f"  missing from vault directory: {name}")
+
+
+def cmd_history(cfg: Config, meta: MetaStore, argv: list[str]) -> None:
+    import argparse
+    from core.sampler import human_size
+
+    parser = argparse.ArgumentParser(prog="locky history")
+    parser.add_argument("name")
+    args = parser.parse_args(argv)
+
+    entry = meta.get_entry(args.name)
+    if entry is None:
+        print(f"No such file in vault: {args.name}")
+        return
+    # Past versions, oldest first, then the current contents as the newest one. Numbers are the
+    # stored ones (they may have gaps, e.g. after `locky fsck --repair`), as restore expects them
+    past = meta.versions(args.name)
+    current = (past[-1]["version"] if past else 0) + 1
+    for row in [*past, entry]:
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(row["added_at"]))
+        number, label = (current, "  (current)") if row is entry else (row["version"], "")
+        print(f"  {args.name}@{number}  {when}  {human_size(row['size_bytes'])}{label}")
+
+
+def cmd_restore(cfg: Config, meta: MetaStore, argv: list[str]) -> None:
+    import argparse
+    from core.vault import restore_version
+    from utils.file_utils import CopyStats
+
+    parser = argparse.ArgumentParser(prog="locky restore")
+    parser.add_argument("spec", metavar="name@n", help="file and version number (see locky history)")
+    parser.add_argument("--to", type=Path, help="directory to restore into (default: the paste folder)")
+    args = parser.parse_args(argv)
+
+    name, _, number = args.spec.rpartition("@")
+    if not name or not number.isdigit():
+        print(f"Error: expected <name>@<version>, got '{args.spec}'")
+        return
+    dest = (args.to or cfg.paste_dir).expanduser()
+    dest.mkdir(parents=True, exist_ok=True)
+    try:
+        restored = restore_version(cfg, meta, name, int(number), dest, CopyStats())
+    except (ValueError, FileNotFoundError) as exc:
+        print(f"Error: {exc}")
+        return
+    if restored is not None:
+        print(f"Restored {name} version {number} to {restored}")
+
+
+def cmd_export(cfg: Config, meta: MetaStore, argv: list[str]) -> None:
+    import argparse
+    from core.pack import export_vault
+
+    parser = argparse.ArgumentParser(prog="locky export")
+    parser.add_argument("target", help="pack file to write, or - for stdout")
+    args = parser.parse_args(argv)
+
+    if args.target == "-":
+        report = export_vault(cfg, meta, sys.stdout.buffer)
+        sys.stdout.buffer.flush()
+        out = sys.stderr  # keep the pack on stdout clean
     else:
-        print(f"Unknown command: '{cmd}'")
-        print("Run 'locky' with no arguments for help.")
+        target = Path(args.target).expanduser()
+        # Write next to the target and rename, so a half-written pack never has the real name
+        part = target.with_name(target.name + ".part")
+        with open(part, "wb") as f:
+            report = export_vault(cfg, meta, f)
+        part.replace(target)
+        out = sys.stdout
+    print(f"Exported {report.blobs + report.legacy} blob(s), "
+          f"{report.bytes_written / 1e6:.1f} MB, to {args.target}", file=out)
+    for name in report.missing:
+        print(f"  missing from vault directory: {name}", file=out)
+
+
+def cmd_import(cfg: Config, meta: MetaStore, argv: list[str]) -> None:
+    import argparse
+    from core.pack import IMPORT_POLICIES, import_pack
+
+    parser = argparse.ArgumentParser(prog="locky import")
+    parser.add_argument("pack", type=Path, help="pack file made by 'locky export'")
+    parser.add_argument("--on-conflict", choices=IMPORT_POLICIES, default="skip",
+                        help="what to do with names the vault already has (default: skip)")
+    parser.add_argument("--jobs", type=int, default=8, help="blobs written in parallel (default 8)")
+    args = parser.parse_args(argv)
+
+    try:
+        report = import_pack(cfg, meta, args.pack.expanduser(), args.on_conflict, workers=args.jobs)
+    except (OSError, ValueError) as exc:
+        print(f"Error: {exc}")
+        return
+    # Imported entries come with their descriptions, ready for the semantic index
+    from core.semantic import index_files
+    with trace.span("import.index"):
+        index_files(cfg.vault_dir, meta, report.added)
+    print(f"Imported {len(report.added)} file(s): {report.blobs_written} blob(s) written, "
+          f"{report.deduplicated} already in vault")
+    if report.skipped:
+        print(f"Skipped {len(report.skipped)} existing name(s)")
+    for name in report.missing:
+        print(f"  not in pack or damaged: {name}")
+
+
+def cmd_fsck(cfg: Config, meta: MetaStore, argv: list[str]) -> None:
+    import argparse
+    from core.fsck import check_vault
+
+    parser = argparse.ArgumentParser(prog="locky fsck")
+    parser.add_argument("--repair", action="store_true",
+                        help="drop entries whose contents are gone, delete orphans, add stray files, fix sizes")
+    parser.add_argument("--full", action="store_true",
+                        help="hash everything, even files unchanged since they were last verified")
+    parser.add_argument("--jobs", type=int, help="files hashed in parallel (default: 2 per CPU, at most 32)")
+    args = parser.parse_args(argv)
+
+    report = check_vault(cfg, meta, repair=args.repair, full=args.full, workers=args.jobs)
+    print(f"Checked {report.checked} blob(s) and chunk(s) in {report.elapsed:.2f}s: "
+          f"{report.hashed} hashed, {report.cached} unchanged since last verified")
+    if report.hashed:
+        print(f"  hashed {report.bytes_hashed / 1e6:.1f} MB at {report.throughput():.1f} MB/s")
+    fixed = "removed" if report.repaired else "missing"
+    for name in report.missing:
+        print(f"  {fixed}: {name}")
+    for name in report.damaged:
+        print(f"  damaged (contents do not match their digest): {name}")
+    for name in report.size_drift:
+        print(f"  {'size fixed' if report.repaired else 'wrong size'}: {name}")
+    if report.repaired:
+        if report.deleted:
+            print(f"  deleted {report.deleted} orphaned file(s)")
+        for stray, name in report.adopted:
+            print(f"  added stray file: {stray}" + (f" as {name}" if name != stray else ""))
+    else:
+        for relpath in report.orphans:
+            print(f"  orphan: {relpath}")
+        for name in report.strays:
+            print(f"  stray file: {name}")
+    if report.clean:
+        print("Vault is consistent." if not report.repaired else "Vault repaired.")
+        return
+    if report.damaged:
+        print("Damaged files can't be repaired; add them again from their source.")
+    if not report.repaired and (report.missing or report.orphans or report.strays or report.size_drift):
+        print("Run 'locky fsck --repair' to fix what can be fixed.")
+    raise SystemExit(1)
+
+
+COMMANDS = {
+    "add": cmd_add,
+    "paste": cmd_paste,
+    "list": cmd_list,
+    "search": cmd_search,
+    "remove": cmd_remove,
+    "migrate": cmd_migrate,
+    "sync": cmd_sync,
+    "history": cmd_history,
+    "restore": cmd_restore,
+    "export": cmd_export,
+    "import": cmd_import,
+    "fsck": cmd_fsck,
+}
+
+
+def _print_paste_report(report, dest: Path) -> None:
+    if report.pasted:
+        print(f"\nPasted {len(report.pasted)} file(s) to {dest}:")
+        # Long batches are summarized; the manifest has the full list
+        for name, path in report.pasted[:20]:
+            print(f"  {name}" if path == dest / name else f"  {name} -> {path.relative_to(dest)}")
+        if len(report.pasted) > 20:
+            print(f"  ... and {len(report.pasted) - 20} more")
+        print(report.copy_stats.summary())
+    if report.conflicts:
+        print(f"{len(report.conflicts)} already existed: {len(report.skipped)} skipped, {report.renamed} renamed")
+    for name in report.missing:
+        print(f"  not in vault: {name}")
+    for name, error in report.failed:
+        print(f"  failed: {name}: {error}")
+    if report.manifest is not None:
+        print(f"Manifest: {report.manifest}")
+
+
+def _print_progress(done: int) -> None:
+    # Live counter on stderr for big imports, only when someone is watching
+    if sys.stderr.isatty() and done % 100 == 0:
+        print(f"\r  {done} file(s) stored...", end="", file=sys.stderr, flush=True)
+
+
+def _print_add_report(report) -> None:
+    if sys.stderr.isatty() and len(report.added) >= 100:
+        print(file=sys.stderr)
+    mb = report.bytes_total / 1e6
+    rate = mb / report.elapsed if report.elapsed > 0 else 0.0
+    print(f"Added {len(report.added)} file(s) ({report.deduplicated} already in vault, no copy needed)")
+    if report.skipped:
+        print(f"Skipped {len(report.skipped)} existing name(s)")
+    for name, error in report.failed:
+        print(f"  failed: {name}: {error}")
+    print(f"{mb:.1f} MB in {report.elapsed:.2f}s ({rate:.1f} MB/s, {report.bytes_copied / 1e6:.1f} MB copied)")
+    if report.copy_stats.bytes:
+        print(report.copy_stats.summary())
+    if report.bytes_stored < report.bytes_copied:
+        saved = 1 - report.bytes_stored / report.bytes_copied
+        print(f"Stored {report.bytes_stored / 1e6:.1f} MB on disk ({saved:.0%} saved by compression)")
 
 
 if __name__ == "__main__":
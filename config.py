@@ -12,6 +12,14 @@ class Config:
     db_path: Path
     # Path to the folder where pasted files are dropped
     paste_dir: Path
+    # How many Claude requests may be in flight at once when describing many files
+    ai_concurrency: int = 8
+    # Most descriptions kept in the content-keyed cache before old ones are evicted
+    desc_cache_size: int = 50_000
+    # Whether blobs are compressed on the way in: "off", "auto", "zlib" or "lzma"
+    compression: str = "off"
+    # Store bat-highlighted preview snippets at add time (costs one bat run per new file)
+    preview_highlight: bool = False
 
 def load_config() -> Config:
     # Get the user's home directory
@@ -22,4 +30,20 @@ def load_config() -> Config:
     db_path = vault_dir / "metadata.sqlite3"
     # Files retrieved from the vault are pasted here by default
     paste_dir = Path(os.environ.get("LOCKY_PASTE_DIR", home / "Locky-files")).expanduser()
-    return Config(vault_dir=vault_dir, db_path=db_path, paste_dir=paste_dir)
\ No newline at end of file
+    # Parallel API calls for bulk descriptions; keep it under your rate limit
+    ai_concurrency = int(os.environ.get("LOCKY_AI_CONCURRENCY", "8"))
+    # Upper bound on cached descriptions (keyed by content, model and prompt version)
+    desc_cache_size = int(os.environ.get("LOCKY_DESC_CACHE_SIZE", "50000"))
+    # "auto" compresses text-like files with zlib or lzma and leaves media/archives alone
+    compression = os.environ.get("LOCKY_COMPRESSION", "off")
+    # Pre-highlight previews when adding, so fzf never has to run bat
+    preview_highlight = os.environ.get("LOCKY_PREVIEW_HIGHLIGHT", "") not in ("", "0")
+    return Config(
+        vault_dir=vault_dir,
+        db_path=db_path,
+        paste_dir=paste_dir,
+        ai_concurrency=ai_concurrency,
+        desc_cache_size=desc_cache_size,
+        compression=compression,
+        preview_highlight=preview_highlight,
+    )
\ No newline at end of file
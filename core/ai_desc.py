@@ -1,11 +1,17 @@
 from __future__ import annotations
 from pathlib import Path
+import json
 import os
+import re
 
-# The anthropic package lets us talk to the Claude API.
-import anthropic
+from core.sampler import count_lines, human_size, read_sample
+from utils import trace
 
 def describe_file_baseline(path: Path, max_bytes: int = 16000) -> str:
+    with trace.span("describe.baseline", file=path.name):
+        return _describe_baseline(path, max_bytes)
+
+def _describe_baseline(path: Path, max_bytes: int) -> str:
     ext = path.suffix.lower().lstrip(".") or "unknown"
 
     # Map common extensions to human-friendly type labels
@@ -20,15 +26,17 @@ def describe_file_baseline(path: Path, max_bytes: int = 16000) -> str:
     label = type_labels.get(ext, f"{ext} file")
 
     try:
-        raw = path.read_bytes()[:max_bytes]
-        text = raw.decode(errors="ignore")
-        lines = [l.strip() for l in text.splitlines() if l.strip()]
+        # Only the first max_bytes are read for the preview line, however big the file is
+        sample = read_sample(path, max_bytes)
+        if sample.is_binary:
+            return f"{label} — binary content, {human_size(sample.size)}"
+        lines = [l.strip() for l in sample.text.splitlines() if l.strip()]
 
         if not lines:
             return f"{label} — no readable text content"
 
-        # Count meaningful lines to give a sense of file size
-        line_count = len(text.splitlines())
+        # Count lines across the whole file (streamed) to give a sense of file size
+        line_count = count_lines(path)
         size_hint = f"{line_count} lines" if line_count > 1 else "1 line"
 
         # Use the first non-comment, non-empty line as the content preview
@@ -47,32 +55,125 @@ def describe_file_baseline(path: Path, max_bytes: int = 16000) -> str:
 
     return f"{label} — could not read content"
 
+# Fast and cheap model, good for this task
+MODEL = "claude-haiku-4-5-20251001"
+# Only need a short description
+MAX_TOKENS = 100
+# Bump whenever build_messages or build_batch_messages changes wording, so cached descriptions
+# from the old prompt are not reused
+PROMPT_VERSION = 2
+# Same idea for describe_file_baseline's output format
+BASELINE_VERSION = 2
+
+# One client per process: it keeps its HTTP connection pool warm between calls
+_client = None
+_async_client = None
+
+def get_client():
+    global _client
+    if _client is None:
+        # The anthropic package lets us talk to the Claude API. It is slow to import,
+        # so it is only loaded the first time a description is actually requested.
+        import anthropic
+        # Create an Anthropic client (reads API key from environment variable)
+        _client = anthropic.Anthropic()
+    return _client
+
+def get_async_client():
+    global _async_client
+    if _async_client is None:
+        import anthropic
+        # Retries are handled by the describer pipeline, which knows about its own concurrency
+        _async_client = anthropic.AsyncAnthropic(max_retries=0)
+    return _async_client
+
+def build_messages(path: Path, content: str) -> list[dict]:
+    # The single user turn that asks Claude for a one-sentence description
+    return [
+        {
+            "role": "user",
+            "content": (
+                f"Describe this file in one sentence. Be specific about what it does or contains "
+                f"(e.g. 'A Python script that calculates student grades' or "
+                f"'A CSV file containing sales data with 3 columns'). "
+                f"File name: {path.name}\n\n{content}"
+            )
+        }
+    ]
+
+def build_batch_messages(files: list[tuple[str, str]]) -> list[dict]:
+    # One user turn asking for a one-sentence description of each (name, content) file,
+    # answered as a JSON object keyed by name so every reply can be matched to its file
+    parts = [f'<file name="{name}">\n{content}\n</file>' for name, content in files]
+    return [
+        {
+            "role": "user",
+            "content": (
+                f"Describe each of the {len(files)} files below in one sentence. Be specific about "
+                f"what it does or contains (e.g. 'A Python script that calculates student grades' or "
+                f"'A CSV file containing sales data with 3 columns'). "
+                f"Reply with only a JSON object that maps each file name, exactly as given, "
+                f"to its description.\n\n" + "\n\n".join(parts)
+            )
+        }
+    ]
+
+# A "name": "description" pair, for salvaging what a cut-off or malformed JSON reply has
+_PAIR = re.compile(r'"((?:[^"\\]|\\.)*)"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+def parse_batch_reply(text: str, names: list[str]) -> dict[str, str]:
+    # The descriptions a batched reply has for names; files it skipped or mangled are left out
+    data = None
+    # Replies may come in a code fence or with a sentence around them: take the outermost {...}
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end > start:
+        try:
+            data = json.loads(text[start:end + 1])
+        except ValueError:
+            data = None
+    if not isinstance(data, dict):
+        data = {}
+        for match in _PAIR.finditer(text):
+            try:
+                data[json.loads(f'"{match[1]}"')] = json.loads(f'"{match[2]}"')
+            except ValueError:
+                continue
+    wanted = set(names)
+    found = {}
+    for name, desc in data.items():
+        if isinstance(desc, dict):
+            desc = desc.get("description")
+        if name in wanted and isinstance(desc, str) and desc.strip():
+            found[name] = desc.strip()
+    return found
+
+def read_content(path: Path, max_bytes: int = 16000) -> str | None:
+    # Up to max_bytes of text taken from the head, middle and tail of the file,
+    # or None for binary files, which are never sent to the API
+    sample = read_sample(path, max_bytes, spread=True)
+    return None if sample.is_binary else sample.text
+
+def request_description(path: Path, max_bytes: int = 16000) -> str:
+    # Ask Claude for a description; errors propagate so callers know the result is not from the API
+    content = read_content(path, max_bytes)
+    if content is None:
+        # Binary content: nothing useful to send, describe it locally
+        return describe_file_baseline(path, max_bytes)
+    # Call the Claude API to get a short description of the file
+    with trace.span("describe.ai", file=path.name):
+        message = get_client().messages.create(
+            model=MODEL,
+            max_tokens=MAX_TOKENS,
+            messages=build_messages(path, content),
+        )
+    # Extract and return the text from the response
+    return message.content[0].text.strip()
+
 # Function that will describe the files using AI (Claude API)
 def describe_file_ai(path: Path, max_bytes: int = 16000) -> str:
     # In a try block so it falls back to baseline if anything fails (e.g., no API key, network error)
     try:
-        # Read up to max_bytes from the file and decode to a string
-        content = path.read_bytes()[:max_bytes].decode(errors="ignore")
-        # Create an Anthropic client (reads API key from environment variable)
-        client = anthropic.Anthropic()
-        # Call the Claude API to get a short description of the file
-        message = client.messages.create(
-            model="claude-haiku-4-5-20251001",  # Fast and cheap model, good for this task
-            max_tokens=100,  # Only need a short description
-            messages=[
-                {
-                    "role": "user",
-                    "content": (
-                        f"Describe this file in one sentence. Be specific about what it does or contains "
-                        f"(e.g. 'A Python script that calculates student grades' or "
-                        f"'A CSV file containing sales data with 3 columns'). "
-                        f"File name: {path.name}\n\n{content}"
-                    )
-                }
-            ]
-        )
-        # Extract and return the text from the response
-        return message.content[0].text.strip()
+        return request_description(path, max_bytes)
     except Exception:
         # If anything goes wrong, fall back to the baseline description
         return describe_file_baseline(path, max_bytes)
@@ -0,0 +1,208 @@
+from __future__ import annotations
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+import time
+from contextlib import AbstractContextManager
+from pathlib import Path
+from typing import BinaryIO
+
+from core.chunks import CHUNKED, chunk_relpath, read_manifest, write_chunked
+from core.compression import compress_file, open_blob
+from utils.file_utils import CopyStats, ensure_dir, copy_file, replace_durably
+from utils.locks import entry_locks
+
+# Directory levels under blobs/, two hex characters each: 1 gives 256 shards, 2 gives 65,536
+DEFAULT_FANOUT = 1
+MAX_FANOUT = 3
+# Chunked blobs are a manifest at the blob's path plus this suffix (the chunks live under chunks/)
+MANIFEST_SUFFIX = ".chunks"
+
+
+def blob_relpath(digest: str, fanout: int = DEFAULT_FANOUT, codec: str | None = None) -> str:
+    # "blobs/ab/abcdef..." for fanout 1, "blobs/ab/cd/abcdef..." for fanout 2
+    shards = [digest[2 * i:2 * i + 2] for i in range(fanout)]
+    relpath = "/".join(["blobs", *shards, digest])
+    return relpath + MANIFEST_SUFFIX if codec == CHUNKED else relpath
+
+
+def entry_path(vault_dir: Path, entry) -> Path | None:
+    """
+    Where a files row's contents live on disk: the blob path recorded in the metadata store,
+    or the flat file of an entry added before the blob store existed (see `locky migrate`).
+    """
+    if entry is None:
+        return None
+    if entry["digest"] is not None:
+        return vault_dir / entry["path"] if entry["path"] else None
+    legacy = vault_dir / entry["filename"]
+    return legacy if legacy.is_file() else None
+
+
+class BlobStore:
+    """
+    Content-addressed file bodies: every distinct file is stored once under blobs/, keyed by its SHA-256.
+    """
+
+    def __init__(self, vault_dir: Path, fanout: int = DEFAULT_FANOUT) -> None:
+        self.vault_dir = vault_dir
+        self.root = vault_dir / "blobs"
+        self.fanout = fanout
+        # Per-digest locks shared with every thread and process using the vault, so identical
+        # content is written once and never deleted while someone is about to reuse it
+        self._locks = entry_locks(vault_dir)
+
+    def relpath(self, digest: str, codec: str | None = None) -> str:
+        # Where new blobs go, relative to the vault directory (recorded in the metadata store)
+        return blob_relpath(digest, self.fanout, codec)
+
+    def path(self, digest: str, codec: str | None = None) -> Path:
+        # Fan out on leading hex characters so no single directory gets huge
+        return self.vault_dir / self.relpath(digest, codec)
+
+    def has(self, digest: str) -> bool:
+        return self.path(digest).is_file() or self.path(digest, CHUNKED).is_file()
+
+    def intact(self, row) -> bool:
+        # Whether a blobs row's file (and, for a chunked blob, every chunk it lists) is on disk
+        if row is None or row["path"] is None:
+            return False
+        path = self.vault_dir / row["path"]
+        if row["codec"] != CHUNKED:
+            return path.is_file()
+        try:
+            _, pieces = read_manifest(path)
+        except (OSError, ValueError):
+            return False
+        return all((self.vault_dir / chunk_relpath(chunk)).is_file() for chunk, _ in pieces)
+
+    def lock(self, digest: str) -> AbstractContextManager[None]:
+        # Hold digest against writers and garbage collection in this and other processes
+        return self._locks.hold(digest)
+
+    def open(self, digest: str, codec: str | None = None) -> BinaryIO:
+        # Read a blob's original bytes back, decompressing as they stream
+        return open_blob(self.path(digest, codec), codec)
+
+    def put(
+        self, src: Path, digest: str, stats: CopyStats | None = None, codec: str | None = None
+    ) -> str | None:
+        # Store the contents of src under digest (compressed with codec, if given), unless an
+        # identical blob is already there. Returns the copy strategy used (the codec's name for
+        # compressed blobs), or None if the blob already existed.
+        with self.lock(digest):
+            if self.has(digest):
+                return None
+            return self._write(src, digest, stats, codec)
+
+    def put_chunked(self, src: Path, digest: str, stats: CopyStats | None = None) -> int | None:
+        # Like put, but store src as content-defined chunks plus a manifest listing them.
+        # Returns how many bytes of new chunks were written (chunks already stored are shared),
+        # or None if the blob already existed.
+        with self.lock(digest):
+            if self.has(digest):
+                return None
+            dst = self.path(digest, CHUNKED)
+            ensure_dir(dst.parent)
+            fd, tmp = tempfile.mkstemp(dir=dst.parent, prefix=".tmp-")
+            os.close(fd)
+            try:
+                started = time.perf_counter()
+                _, fresh = write_chunked(src, self.vault_dir, Path(tmp))
+                os.chmod(tmp, 0o444)
+                replace_durably(tmp, dst)
+            except BaseException:
+                Path(tmp).unlink(missing_ok=True)
+                raise
+            if stats is not None:
+                stats.record(CHUNKED, fresh, time.perf_counter() - started)
+            return fresh
+
+    def put_stored(self, reader: BinaryIO, digest: str, codec: str | None = None) -> int | None:
+        # Store bytes that are already in stored form (compressed with codec, if any), e.g. a
+        # blob coming out of a pack, after checking they really are digest's contents.
+        # Returns the blob's size on disk, or None if the blob already existed.
+        with self.lock(digest):
+            if self.has(digest):
+                return None
+            dst = self.path(digest)
+            ensure_dir(dst.parent)
+            fd, tmp = tempfile.mkstemp(dir=dst.parent, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as out:
+                    shutil.copyfileobj(reader, out, 1 << 20)
+                    stored = out.tell()
+                h = hashlib.sha256()
+                with open_blob(Path(tmp), codec) as f:
+                    for block in iter(lambda: f.read(1 << 20), b""):
+                        h.update(block)
+                if h.hexdigest() != digest:
+                    raise ValueError(f"contents do not match digest {digest}")
+                os.chmod(tmp, 0o444)
+                replace_durably(tmp, dst)
+            except BaseException:
+                Path(tmp).unlink(missing_ok=True)
+                raise
+            return stored
+
+    def _write(self, src: Path, digest: str, stats: CopyStats | None, codec: str | None) -> str:
+        dst = self.path(digest, codec)
+        ensure_dir(dst.parent)
+        # Copy into a temp file next to the final path, flush it and rename it into place,
+        # so a blob is never visible half-written, not even after a crash
+        fd, tmp = tempfile.mkstemp(dir=dst.parent, prefix=".tmp-")
+        os.close(fd)
+        try:
+            if codec is None:
+                strategy = copy_file(src, Path(tmp), stats)
+            else:
+                started = time.perf_counter()
+                compress_file(src, Path(tmp), codec)
+                shutil.copystat(src, tmp)
+                strategy = codec
+                if stats is not None:
+                    stats.record(codec, src.stat().st_size, time.perf_counter() - started)
+            # Blobs are shared (dedup, hard-linked pastes), so nobody may edit one in place
+            os.chmod(tmp, stat.S_IMODE(os.stat(tmp).st_mode) & 0o555)
+            replace_durably(tmp, dst)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        return strategy
+
+    def rechunk(
+        self, digest: str, relpath: str, codec: str | None
+    ) -> tuple[str, int, list[tuple[str, int]]]:
+        """
+        Turn the stored blob at relpath into a chunked one, so it shares chunks with the versions
+        around it. Returns the manifest's path and size and the chunk list; the old file is left
+        for the caller to delete once the metadata store points at the manifest.
+        """
+        src = self.vault_dir / relpath
+        dst = self.path(digest, CHUNKED)
+        ensure_dir(dst.parent)
+        fd, tmp = tempfile.mkstemp(dir=dst.parent, prefix=".tmp-")
+        os.close(fd)
+        plain = None
+        try:
+            if codec is not None:
+                # Chunk the original bytes, not the compressed ones
+                fd, plain = tempfile.mkstemp(dir=dst.parent, prefix=".tmp-")
+                with open_blob(src, codec) as fin, os.fdopen(fd, "wb") as fout:
+                    shutil.copyfileobj(fin, fout, 1 << 20)
+            pieces, _ = write_chunked(Path(plain or src), self.vault_dir, Path(tmp))
+            os.chmod(tmp, 0o444)
+            replace_durably(tmp, dst)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        finally:
+            if plain is not None:
+                Path(plain).unlink(missing_ok=True)
+        return self.relpath(digest, CHUNKED), dst.stat().st_size, pieces
+
+    def delete(self, digest: str, relpath: str | None = None) -> None:
+        # Remove a blob that nothing references anymore (from its recorded path, if it has one)
+        (self.vault_dir / relpath if relpath else self.path(digest)).unlink(missing_ok=True)
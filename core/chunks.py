@@ -0,0 +1,227 @@
+from __future__ import annotations
+import bisect
+import hashlib
+import io
+import mmap
+import os
+import stat
+import tempfile
+from pathlib import Path
+from typing import BinaryIO, Iterator
+
+from utils.file_utils import ensure_dir, replace_durably
+
+# Codec name for blobs kept as a list of content-defined chunks (see the blobs table)
+CHUNKED = "chunks"
+# Versioned files at least this big are stored as chunks, so versions share what they have in common
+VERSIONED_MIN = 1 << 20
+# FastCDC bounds: no chunk is shorter than MIN_CHUNK (bar the last) or longer than MAX_CHUNK,
+# and cuts get easier once a chunk passes AVG_CHUNK ("normalized chunking")
+MIN_CHUNK = 64 * 1024
+AVG_CHUNK = 256 * 1024
+MAX_CHUNK = 1024 * 1024
+# Cut-point tests on the gear hash's top bits: a stricter mask before AVG_CHUNK, a looser one after
+MASK_STRICT = 0xFFFFF000
+MASK_LOOSE = 0xFFFF0000
+# The gear hash covers the last 32 bytes: each byte's contribution is shifted out after that
+WINDOW = 32
+# Bytes hashed per numpy pass; small enough to stay in cache across the five shift-and-add passes
+SEGMENT = 256 * 1024
+MANIFEST_HEADER = "locky-chunks 1"
+
+_MASK32 = 0xFFFFFFFF
+# 256 fixed pseudo-random 32-bit values, one per byte value; changing them changes every cut point
+GEAR = tuple(int.from_bytes(hashlib.sha256(bytes([i])).digest()[:4], "little") for i in range(256))
+
+np = None
+
+
+def _load_numpy():
+    # numpy (optional) hashes whole segments at once; without it the hash runs byte by byte
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return None
+        np = numpy
+    return np
+
+
+def chunk_relpath(digest: str) -> str:
+    return f"chunks/{digest[:2]}/{digest}"
+
+
+def cut_points(data, size: int) -> Iterator[int]:
+    """
+    End offsets of the content-defined chunks of data (bytes or an mmap of size bytes).
+    Cuts depend only on the bytes around them, so an edit or an append moves the cuts near
+    it and leaves every other chunk, and its digest, as it was.
+    """
+    if size == 0:
+        return
+    numpy = _load_numpy()
+    if numpy is not None:
+        strict, loose = _candidates(numpy, data, size)
+    start = 0
+    while start < size:
+        lo = start + MIN_CHUNK - 1
+        hi = min(start + MAX_CHUNK, size) - 1
+        if lo >= hi:
+            cut = hi
+        elif numpy is not None:
+            cut = _first_cut(strict, loose, start, lo, hi)
+        else:
+            cut = _scan_cut(data, start, lo, hi)
+        yield cut + 1
+        start = cut + 1
+
+
+def _candidates(numpy, data, size: int) -> tuple[set[int], list[int]]:
+    # Every position whose hash passes the loose mask (sorted), and those that also pass the strict one
+    gear = numpy.array(GEAR, dtype=numpy.uint32)
+    shifted = numpy.empty(SEGMENT + WINDOW, dtype=numpy.uint32)
+    strict: set[int] = set()
+    loose: list[int] = []
+    for begin in range(0, size, SEGMENT):
+        # Start WINDOW - 1 bytes early so the first hashes of the segment see a full window
+        lead = min(begin, WINDOW - 1)
+        raw = numpy.frombuffer(data[begin - lead:min(begin + SEGMENT, size)], dtype=numpy.uint8)
+        h = gear[raw]
+        shift = 1
+        while shift < WINDOW:
+            # h[i] += h[i - shift] << shift doubles the bytes each hash covers: 1, 2, 4, ... 32
+            part = shifted[:len(h) - shift]
+            numpy.left_shift(h[:-shift], shift, out=part)
+            h[shift:] += part
+            shift *= 2
+        h = h[lead:]
+        hits = numpy.flatnonzero((h & numpy.uint32(MASK_LOOSE)) == 0)
+        hard = hits[(h[hits] & numpy.uint32(MASK_STRICT)) == 0]
+        loose.extend((hits + begin).tolist())
+        strict.update((hard + begin).tolist())
+    return strict, loose
+
+
+def _first_cut(strict: set[int], loose: list[int], start: int, lo: int, hi: int) -> int:
+    normal = start + AVG_CHUNK - 1
+    i = bisect.bisect_left(loose, lo)
+    while i < len(loose) and loose[i] <= hi:
+        pos = loose[i]
+        if pos > normal or pos in strict:
+            return pos
+        i += 1
+    return hi
+
+
+def _scan_cut(data, start: int, lo: int, hi: int) -> int:
+    # The same cut as _first_cut, found by hashing one byte at a time from the window before lo
+    normal = start + AVG_CHUNK - 1
+    h = 0
+    for b in data[lo - WINDOW + 1:lo]:
+        h = ((h << 1) + GEAR[b]) & _MASK32
+    pos = lo
+    for b in data[lo:hi + 1]:
+        h = ((h << 1) + GEAR[b]) & _MASK32
+        if not h & (MASK_STRICT if pos <= normal else MASK_LOOSE):
+            return pos
+        pos += 1
+    return hi
+
+
+def write_chunked(src: Path, vault_dir: Path, manifest: Path) -> tuple[list[tuple[str, int]], int]:
+    """
+    Split src into chunks under vault_dir/chunks (skipping chunks already there) and write the
+    manifest that lists them. Returns the (digest, size) list and how many bytes were new.
+    """
+    chunks: list[tuple[str, int]] = []
+    fresh = 0
+    size = src.stat().st_size
+    with open(src, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        try:
+            start = 0
+            for end in cut_points(data, size):
+                piece = data[start:end]
+                digest = hashlib.sha256(piece).hexdigest()
+                if _put_chunk(vault_dir / chunk_relpath(digest), piece):
+                    fresh += len(piece)
+                chunks.append((digest, len(piece)))
+                start = end
+        finally:
+            if size:
+                data.close()
+    lines = [f"{MANIFEST_HEADER} {size}"] + [f"{d} {n}" for d, n in chunks]
+    manifest.write_text("\n".join(lines) + "\n", encoding="ascii")
+    return chunks, fresh
+
+
+def _put_chunk(path: Path, piece: bytes) -> bool:
+    # Write one chunk (read-only, via a temp file and rename) unless it is already stored
+    if path.is_file():
+        return False
+    ensure_dir(path.parent)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(piece)
+        os.chmod(tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        replace_durably(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return True
+
+
+def read_manifest(manifest: Path) -> tuple[int, list[tuple[str, int]]]:
+    lines = manifest.read_text(encoding="ascii").split("\n")
+    header = lines[0].rsplit(" ", 1)
+    if header[0] != MANIFEST_HEADER:
+        raise ValueError(f"not a chunk manifest: {manifest}")
+    chunks = [(d, int(n)) for d, n in (line.split(" ") for line in lines[1:] if line)]
+    return int(header[1]), chunks
+
+
+def vault_root(manifest: Path) -> Path:
+    # Manifests live somewhere under <vault>/blobs/, chunks under <vault>/chunks/
+    for parent in manifest.parents:
+        if parent.name == "blobs":
+            return parent.parent
+    raise ValueError(f"chunk manifest outside a blob store: {manifest}")
+
+
+def open_chunked(manifest: Path) -> BinaryIO:
+    """
+    Read a chunked blob back as one stream, opening each chunk only when the reader gets to it.
+    """
+    return io.BufferedReader(_ChunkReader(manifest), buffer_size=1 << 20)
+
+
+class _ChunkReader(io.RawIOBase):
+    def __init__(self, manifest: Path) -> None:
+        root = vault_root(manifest)
+        _, chunks = read_manifest(manifest)
+        self._paths = iter([root / chunk_relpath(d) for d, _ in chunks])
+        self._current: BinaryIO | None = None
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while True:
+            if self._current is None:
+                path = next(self._paths, None)
+                if path is None:
+                    return 0
+                self._current = open(path, "rb")
+            n = self._current.readinto(buffer)
+            if n:
+                return n
+            self._current.close()
+            self._current = None
+
+    def close(self) -> None:
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+        super().close()
@@ -0,0 +1,100 @@
+from __future__ import annotations
+import shutil
+import zlib
+from pathlib import Path
+from typing import BinaryIO
+
+# How blobs may be stored: never compressed, compressed where it pays off, or one codec for everything
+COMPRESSION_MODES = ("off", "auto", "zlib", "lzma")
+# zlib blobs are gzip streams and lzma blobs are .xz streams, so both can be read back incrementally
+CODECS = ("zlib", "lzma")
+
+# Formats that are already compressed; squeezing them again only burns CPU
+PRECOMPRESSED = frozenset({
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z", ".rar", ".jar", ".whl",
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".heic", ".avif",
+    ".pdf", ".docx", ".xlsx", ".pptx", ".odt",
+    ".mp3", ".mp4", ".m4a", ".mkv", ".mov", ".webm", ".woff2",
+})
+# Below this the container overhead eats most of the savings
+MIN_SIZE = 1024
+# "auto" test-compresses this much of the file's head to judge how compressible it is
+PROBE_BYTES = 64 * 1024
+# Probes that shrink less than this are stored raw
+MIN_SAVING = 0.1
+# Large, very compressible files (logs, CSVs, SQL dumps) are worth lzma's extra CPU
+LZMA_MIN_SIZE = 1 << 20
+LZMA_MAX_RATIO = 0.35
+CHUNK = 1 << 20
+
+
+def choose_codec(path: Path, size: int, mode: str = "auto") -> str | None:
+    """
+    Pick the codec a file should be stored with under `mode`, or None to store it raw.
+    """
+    if mode not in COMPRESSION_MODES:
+        raise ValueError(f"unknown compression mode: {mode}")
+    if mode == "off" or size < MIN_SIZE or path.suffix.lower() in PRECOMPRESSED:
+        return None
+    if mode != "auto":
+        return mode
+    with open(path, "rb") as f:
+        probe = f.read(PROBE_BYTES)
+    if not probe:
+        return None
+    ratio = len(zlib.compress(probe, 1)) / len(probe)
+    if ratio > 1 - MIN_SAVING:
+        return None
+    if size >= LZMA_MIN_SIZE and ratio <= LZMA_MAX_RATIO:
+        return "lzma"
+    return "zlib"
+
+
+def compress_file(src: Path, dst: Path, codec: str) -> None:
+    # Stream src through the codec into dst, one chunk at a time
+    with open(src, "rb") as fin, _writer(dst, codec) as fout:
+        shutil.copyfileobj(fin, fout, CHUNK)
+
+
+def open_blob(path: Path, codec: str | None) -> BinaryIO:
+    """
+    Open a stored blob for reading, decompressing on the fly when it has a codec
+    (or reassembling it from its chunks, for the "chunks" codec of versioned files).
+    """
+    if codec is None:
+        return open(path, "rb")
+    if codec == "zlib":
+        import gzip
+        return gzip.open(path, "rb")
+    if codec == "lzma":
+        import lzma
+        return lzma.open(path, "rb")
+    if codec == "chunks":
+        from core.chunks import open_chunked
+        return open_chunked(path)
+    raise ValueError(f"unknown codec: {codec}")
+
+
+def wrap_stream(f: BinaryIO, codec: str | None) -> BinaryIO:
+    # Like open_blob, for stored bytes that come from an already open stream (e.g. inside a pack)
+    if codec is None:
+        return f
+    if codec == "zlib":
+        import gzip
+        return gzip.GzipFile(fileobj=f, mode="rb")
+    if codec == "lzma":
+        import lzma
+        return lzma.LZMAFile(f, "rb")
+    raise ValueError(f"unknown codec: {codec}")
+
+
+def _writer(dst: Path, codec: str) -> BinaryIO:
+    # gzip/lzma are only imported when something is actually compressed (cold start budget)
+    if codec == "zlib":
+        import gzip
+        # mtime=0 keeps the output a pure function of the input
+        return gzip.GzipFile(dst, "wb", compresslevel=6, mtime=0)
+    if codec == "lzma":
+        import lzma
+        return lzma.open(dst, "wb", preset=6)
+    raise ValueError(f"unknown codec: {codec}")
@@ -1,20 +1,292 @@
 from __future__ import annotations
-from pathlib import Path
+import asyncio
 import os
+import random
+from pathlib import Path
+from typing import Iterable
 
 from core.metadata import MetaStore
-from core.ai_desc import describe_file_ai, describe_file_baseline
+from utils import trace
+from core.ai_desc import (
+    BASELINE_VERSION, MAX_TOKENS, MODEL, PROMPT_VERSION, build_batch_messages, build_messages,
+    describe_file_baseline, get_async_client, parse_batch_reply, read_content, request_description,
+)
 
-def describe_and_store(meta: MetaStore, path: Path) -> str:
+# HTTP statuses worth retrying: rate limited, server errors, overloaded
+RETRYABLE_STATUS = {429, 500, 502, 503, 504, 529}
+# Default upper bound on cached descriptions before the least recently used are evicted
+DEFAULT_CACHE_SIZE = 50_000
+# Small text files share one request: at most this many files, and this many (estimated) tokens
+# of file content, per prompt. Files bigger than BATCH_FILE_TOKENS get a request of their own.
+BATCH_MAX_FILES = 20
+BATCH_TOKEN_BUDGET = 8000
+BATCH_FILE_TOKENS = 1000
+# Rough size of a token, for budgeting without a tokenizer
+CHARS_PER_TOKEN = 4
+
+def describe_and_store(
+    meta: MetaStore, path: Path, name: str | None = None, cache_size: int = DEFAULT_CACHE_SIZE
+) -> str:
+    # path is read for content, name is the vault entry to attach the description to
+    # (they differ now that vault contents live in the blob store)
+    name = name or path.name
     # Check if the ANTHROPIC_API_KEY environment variable is set
-    if os.environ.get("ANTHROPIC_API_KEY"):
-        # If the API key exists, use the AI-powered description
-        description = describe_file_ai(path)
-    else:
-        # If the API key doesn't exist, use the baseline (non-AI) description
-        description = describe_file_baseline(path)   
+    use_ai = bool(os.environ.get("ANTHROPIC_API_KEY"))
+
+    # Identical content described before (under any name) is served from the cache
+    digest = meta.get_digest(name)
+    key = cache_key(digest, path, use_ai)
+    description = meta.cached_description(key) if key else None
+    if description is None:
+        description, source = _describe_now(path, use_ai)
+        # A local description goes under the baseline's key, never the model's
+        key = cache_key(digest, path, source == "model") if source else None
+        if key:
+            meta.cache_descriptions([(key, description)], cache_size)
 
     # Store the description in the metadata database
-    meta.set_description(path.name, description)
+    meta.set_description(name, description)
     # Return the description
     return description
+
+
+def cache_key(digest: str | None, path: Path, use_ai: bool) -> str | None:
+    # Descriptions depend on the content, the model and the prompt wording; the baseline
+    # also depends on the extension because its label comes from it
+    if digest is None:
+        return None
+    if use_ai:
+        return f"{digest}:{MODEL}:p{PROMPT_VERSION}"
+    return f"{digest}:baseline{path.suffix.lower()}:b{BASELINE_VERSION}"
+
+
+def _describe_now(path: Path, use_ai: bool) -> tuple[str, str | None]:
+    # Returns the description and where it came from: "model", "baseline", or None for an
+    # API fallback, which is not worth caching
+    if not use_ai or read_content(path) is None:
+        # No API key, or binary content that is never sent: use the baseline (non-AI) description
+        return describe_file_baseline(path), "baseline"
+    try:
+        # If the API key exists, use the AI-powered description
+        return request_description(path), "model"
+    except Exception:
+        return describe_file_baseline(path), None
+
+
+def describe_many(
+    meta: MetaStore,
+    items: Iterable[tuple[Path, str]],
+    concurrency: int = 8,
+    batch_size: int = 50,
+    client=None,
+    max_retries: int = 5,
+    cache_size: int = DEFAULT_CACHE_SIZE,
+    batch_files: int = BATCH_MAX_FILES,
+) -> dict[str, str]:
+    """
+    Describe many (path, vault name) pairs with up to `concurrency` API calls in flight,
+    writing descriptions back to the store in batches. Returns name -> description.
+
+    Small text files are packed up to batch_files at a time (within BATCH_TOKEN_BUDGET) into
+    one prompt that asks for a JSON object keyed by vault name; any file the reply leaves out
+    or garbles gets the baseline description. batch_files=1 sends one request per file.
+
+    `client` is anything with an async `messages.create(...)`; it defaults to the shared
+    AsyncAnthropic client when an API key is set, otherwise the baseline describer is used.
+    """
+    if client is None and os.environ.get("ANTHROPIC_API_KEY"):
+        client = get_async_client()
+    return asyncio.run(
+        _describe_many(meta, items, client, concurrency, batch_size, max_retries, cache_size, batch_files)
+    )
+
+
+async def _describe_many(
+    meta: MetaStore,
+    items: Iterable[tuple[Path, str]],
+    client,
+    concurrency: int,
+    batch_size: int,
+    max_retries: int,
+    cache_size: int,
+    batch_files: int,
+) -> dict[str, str]:
+    results: dict[str, str] = {}
+    done: asyncio.Queue = asyncio.Queue()
+    source = iter(items)
+    # Identical content seen twice in one run waits for the first request instead of repeating it;
+    # the future holds the model's description, or None if the first copy got a local one
+    in_flight: dict[str, asyncio.Future] = {}
+    # Small files waiting for a shared request: (name, path, content, cache key, future)
+    waiting: list[tuple] = []
+    waiting_tokens = 0
+    # Workers still pulling input; the last one out sends whatever is left waiting
+    active = max(1, concurrency)
+    # Repeats of content already being described, each waiting on the first copy's future
+    followers: list[asyncio.Task] = []
+
+    def take_waiting() -> list[tuple]:
+        nonlocal waiting, waiting_tokens
+        batch, waiting, waiting_tokens = waiting, [], 0
+        return batch
+
+    def enqueue(job: tuple, tokens: int) -> list[tuple] | None:
+        # Add a small file to the shared batch; returns a batch that is ready to go, if any
+        nonlocal waiting_tokens
+        ready = take_waiting() if waiting and waiting_tokens + tokens > BATCH_TOKEN_BUDGET else None
+        waiting.append(job)
+        waiting_tokens += tokens
+        if ready is None and len(waiting) >= batch_files:
+            ready = take_waiting()
+        return ready
+
+    async def send(batch: list[tuple]) -> None:
+        # One request for the whole batch; whatever it did not describe falls back to the baseline
+        if len(batch) == 1:
+            name, path, content, _, _ = batch[0]
+            with trace.span("describe.ai", file=path.name):
+                text = await _request(client, build_messages(path, content), MAX_TOKENS, max_retries)
+            replies = {name: text} if text else {}
+        else:
+            names = [job[0] for job in batch]
+            with trace.span("describe.ai", files=len(batch)):
+                text = await _request(
+                    client, build_batch_messages([(job[0], job[2]) for job in batch]),
+                    MAX_TOKENS * len(batch), max_retries,
+                )
+            replies = parse_batch_reply(text, names) if text else {}
+        for name, path, _, key, pending in batch:
+            desc = replies.get(name)
+            pending.set_result(desc)
+            if desc is None:
+                desc, key = describe_file_baseline(path), None  # never cache a fallback under the model's key
+            await done.put((name, desc, key))
+
+    async def follow(name: str, path: Path, first: asyncio.Future) -> None:
+        # The first copy's description, or, when it got a local one (labelled by its own
+        # extension), one of this copy's own
+        desc = await first
+        if desc is None:
+            desc = await asyncio.to_thread(describe_file_baseline, path)
+        await done.put((name, desc, None))
+
+    async def worker() -> None:
+        # Each worker pulls the next file from the shared iterator, so at most
+        # `concurrency` requests are ever in flight and the input is never materialised
+        nonlocal active
+        for path, name in source:
+            digest = meta.get_digest(name)
+            key = cache_key(digest, path, client is not None)
+            desc = meta.cached_description(key) if key else None
+            if desc is not None:
+                key = None  # already cached, nothing new to remember
+            elif key is not None and key in in_flight:
+                # The first copy may still be waiting for its batch, which only goes out once the
+                # workers move on, so its description is picked up off to the side
+                followers.append(asyncio.create_task(follow(name, path, in_flight[key])))
+                continue
+            elif client is None:
+                desc = describe_file_baseline(path)
+            else:
+                pending = asyncio.get_running_loop().create_future()
+                if key is not None:
+                    in_flight[key] = pending
+                try:
+                    content = await asyncio.to_thread(read_content, path)
+                except OSError:
+                    desc, key, content = describe_file_baseline(path), None, None
+                else:
+                    # Binary files skip the API entirely; their local description is cached
+                    # under the baseline's key, which also tells extensions apart
+                    desc = None
+                    if content is None:
+                        desc, key = describe_file_baseline(path), cache_key(digest, path, False)
+                if desc is not None:
+                    pending.set_result(None)
+                else:
+                    job = (name, path, content, key, pending)
+                    tokens = len(content) // CHARS_PER_TOKEN + 1
+                    if batch_files > 1 and tokens <= BATCH_FILE_TOKENS:
+                        ready = enqueue(job, tokens)
+                        if ready:
+                            await send(ready)
+                    else:
+                        await send([job])
+                    continue
+            await done.put((name, desc, key))
+        active -= 1
+        if active == 0 and waiting:
+            await send(take_waiting())
+
+    async def writer() -> None:
+        # Drain finished descriptions and commit them batch_size at a time
+        batch: list[tuple[str, str]] = []
+        cached: list[tuple[str, str]] = []
+
+        def flush() -> None:
+            meta.set_descriptions(batch)
+            if cached:
+                meta.cache_descriptions(cached, cache_size)
+            batch.clear()
+            cached.clear()
+
+        while True:
+            item = await done.get()
+            if item is None:
+                break
+            name, desc, key = item
+            batch.append((name, desc))
+            if key is not None:
+                cached.append((key, desc))
+            results[name] = desc
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+
+    writer_task = asyncio.create_task(writer())
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+        await asyncio.gather(*followers)
+    finally:
+        for task in followers:
+            task.cancel()  # still pending only if a worker failed and its futures never resolve
+        await done.put(None)
+        await writer_task
+    return results
+
+
+async def _request(client, messages: list[dict], max_tokens: int, max_retries: int) -> str | None:
+    # One API call with exponential backoff on rate limits and transient failures.
+    # Returns the reply's text, or None on any other error (or running out of retries),
+    # in which case the caller falls back to the baseline description.
+    for attempt in range(max_retries + 1):
+        try:
+            message = await client.messages.create(model=MODEL, max_tokens=max_tokens, messages=messages)
+            return message.content[0].text.strip()
+        except Exception as exc:
+            if attempt == max_retries or not _is_retryable(exc):
+                break
+            await asyncio.sleep(_backoff_delay(exc, attempt))
+    return None
+
+
+def _is_retryable(exc: Exception) -> bool:
+    # Duck-typed so stub clients in tests can raise their own errors with a status_code
+    status = getattr(exc, "status_code", None)
+    if status in RETRYABLE_STATUS:
+        return True
+    return type(exc).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+def _backoff_delay(exc: Exception, attempt: int) -> float:
+    # Honour the server's retry-after when it sends one, else 0.5s, 1s, 2s, ... with jitter
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random() / 2)
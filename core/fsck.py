@@ -0,0 +1,320 @@
+from __future__ import annotations
+import hashlib
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from config import Config
+from core.blobs import MANIFEST_SUFFIX
+from core.chunks import CHUNKED, read_manifest
+from core.compression import open_blob
+from core.metadata import MetaStore
+from utils import trace
+from utils.file_utils import iter_files
+
+# Top-level names in the vault directory that belong to locky, not to any entry
+RESERVED = ("blobs", "chunks", "semantic")
+# Files under blobs/ and chunks/ changed more recently than this may belong to an add that
+# has not committed yet, so they are never called orphans
+ORPHAN_GRACE = 3600
+# Verified files are remembered in batches of this many, one transaction each
+REMEMBER_BATCH = 1000
+_BLOCK = 1 << 20
+
+
+@dataclass
+class FsckReport:
+    # blobs and chunks looked at, how many were hashed and how many were skipped because
+    # they are unchanged since an earlier run verified them
+    checked: int = 0
+    hashed: int = 0
+    cached: int = 0
+    bytes_hashed: int = 0
+    elapsed: float = 0.0
+    hash_seconds: float = 0.0
+    # entries (and "name@n" past versions) whose contents are gone from the vault directory
+    missing: list[str] = field(default_factory=list)
+    # entries whose contents are on disk but no longer match their digest (bit rot, edits)
+    damaged: list[str] = field(default_factory=list)
+    # files under blobs/ or chunks/ that no row mentions
+    orphans: list[str] = field(default_factory=list)
+    # files dropped into the vault directory that are not entries
+    strays: list[str] = field(default_factory=list)
+    # entries whose recorded size is not the size of their contents
+    size_drift: list[str] = field(default_factory=list)
+    # what repair did: rows dropped, orphans deleted, strays added, sizes corrected
+    repaired: bool = False
+    removed: list[str] = field(default_factory=list)
+    deleted: int = 0
+    adopted: list[tuple[str, str]] = field(default_factory=list)
+    sizes_fixed: int = 0
+
+    @property
+    def clean(self) -> bool:
+        # Nothing left that needs a look: damage can't be repaired, the rest can
+        if self.damaged:
+            return False
+        return self.repaired or not (self.missing or self.orphans or self.strays or self.size_drift)
+
+    def throughput(self) -> float:
+        # MB/s hashed, over the whole verify phase (stat calls on unchanged files included)
+        return self.bytes_hashed / self.hash_seconds / 1e6 if self.hash_seconds > 0 else 0.0
+
+
+def check_vault(
+    cfg: Config, meta: MetaStore, repair: bool = False, full: bool = False, workers: int | None = None
+) -> FsckReport:
+    """
+    Check that the vault directory and the metadata store agree: every entry's contents are on
+    disk and still match their digest, every file on disk belongs to something, and recorded
+    sizes are right.
+
+    Blobs and chunks are hashed on a thread pool. Each file that checks out is remembered by
+    (inode, size, mtime_ns), and later runs skip files whose stat still matches; full hashes
+    everything again (stored files keep their source's mtime, so only a full run catches rot
+    that left size and mtime alone).
+
+    With repair, entries whose contents are gone are dropped, orphans are deleted, stray
+    files are added to the vault (renamed on a clash) and sizes are corrected. Damaged
+    contents are only reported: the right bytes are not in the vault to put back.
+    """
+    report = FsckReport()
+    started = time.perf_counter()
+    workers = workers or min(32, (os.cpu_count() or 1) * 2)
+    missing_blobs, damaged_blobs = set(), set()
+    missing_chunks, damaged_chunks = set(), set()
+    with trace.span("fsck.verify"):
+        hashing = time.perf_counter()
+        _verify(cfg, meta, False, full, workers, missing_blobs, damaged_blobs, report)
+        _verify(cfg, meta, True, full, workers, missing_chunks, damaged_chunks, report)
+        report.hash_seconds = time.perf_counter() - hashing
+    # A chunk that is gone or bad takes every chunked blob listing it with it
+    missing_blobs |= meta.chunked_blobs_using(missing_chunks) - damaged_blobs
+    damaged_blobs |= meta.chunked_blobs_using(damaged_chunks) - missing_blobs
+
+    with trace.span("fsck.entries"):
+        gone, gone_versions = meta.entries_using(missing_blobs)
+        unstored, unstored_versions = meta.unstored_entries()
+        gone, gone_versions = sorted({*gone, *unstored}), sorted({*gone_versions, *unstored_versions})
+        drift = [(r["filename"], r["actual"]) for r in meta.size_drift()]
+        for name in meta.legacy_entries():
+            try:
+                size = (cfg.vault_dir / name).stat().st_size
+            except FileNotFoundError:
+                gone.append(name)
+                continue
+            if size != meta.get_entry(name)["size_bytes"]:
+                drift.append((name, size))
+        report.missing = sorted(gone) + [f"{n}@{v}" for n, v in gone_versions]
+        bad, bad_versions = meta.entries_using(damaged_blobs)
+        report.damaged = bad + [f"{n}@{v}" for n, v in bad_versions]
+        report.size_drift = sorted(name for name, _ in drift)
+
+    with trace.span("fsck.walk"):
+        orphans = _find_orphans(cfg, meta)
+        report.orphans = [relpath for relpath, _ in orphans]
+        report.strays = _find_strays(cfg, meta)
+
+    if repair:
+        with trace.span("fsck.repair"):
+            _repair(cfg, meta, report, gone, gone_versions, orphans, drift)
+            report.repaired = True
+    meta.forget_verified()
+    report.elapsed = time.perf_counter() - started
+    return report
+
+
+def _verify(
+    cfg: Config, meta: MetaStore, chunks: bool, full: bool, workers: int,
+    missing: set[str], damaged: set[str], report: FsckReport,
+) -> None:
+    # Stat every blob (or chunk): sizes are compared right away, and whatever is new or changed
+    # since it was last verified is hashed on the pool, a bounded number of files in flight
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    verified: list[tuple] = []
+    pending: set = set()
+
+    def settle(block_until: int) -> None:
+        nonlocal pending
+        while len(pending) > block_until:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                row, st, digest, nbytes = fut.result()
+                report.hashed += 1
+                report.bytes_hashed += nbytes
+                if digest is None:
+                    missing.add(row["digest"])
+                elif digest != row["digest"]:
+                    damaged.add(row["digest"])
+                else:
+                    verified.append((row["path"], st.st_ino, st.st_size, st.st_mtime_ns, digest))
+        if len(verified) >= REMEMBER_BATCH:
+            meta.remember_verified(verified)
+            verified.clear()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for row in meta.stored_for_check(chunks):
+            report.checked += 1
+            if row["path"] is None:
+                continue  # unstored_entries reports the entries
+            path = cfg.vault_dir / row["path"]
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                missing.add(row["digest"])
+                continue
+            if row["codec"] == CHUNKED:
+                # The manifest only lists chunks; their contents are verified as chunks
+                if not _manifest_ok(path, row["size_bytes"]):
+                    damaged.add(row["digest"])
+                continue
+            expected = row["stored_bytes"] if row["codec"] else row["size_bytes"]
+            if expected is not None and st.st_size != expected:
+                damaged.add(row["digest"])
+                continue
+            seen = (row["inode"], row["seen_size"], row["mtime_ns"], row["seen_digest"])
+            if not full and seen == (st.st_ino, st.st_size, st.st_mtime_ns, row["digest"]):
+                report.cached += 1
+                continue
+            pending.add(pool.submit(_hash, path, row, st))
+            settle(workers * 4)
+        settle(0)
+    if verified:
+        meta.remember_verified(verified)
+
+
+def _hash(path: Path, row, st: os.stat_result) -> tuple:
+    # Worker: the digest of a stored file's original contents (None if it vanished meanwhile)
+    h = hashlib.sha256()
+    nbytes = 0
+    try:
+        with open_blob(path, row["codec"]) as f:
+            for block in iter(lambda: f.read(_BLOCK), b""):
+                h.update(block)
+                nbytes += len(block)
+    except FileNotFoundError:
+        return row, st, None, nbytes
+    except (OSError, EOFError, ValueError):
+        # A compressed stream too mangled to decode is as damaged as a wrong digest
+        return row, st, "", nbytes
+    if trace.ENABLED:
+        trace.add("bytes.hashed", nbytes)
+    return row, st, h.hexdigest(), nbytes
+
+
+def _manifest_ok(path: Path, size: int) -> bool:
+    try:
+        total, pieces = read_manifest(path)
+    except (OSError, ValueError):
+        return False
+    return total == size and sum(n for _, n in pieces) == size
+
+
+def _find_orphans(cfg: Config, meta: MetaStore) -> list[tuple[str, str]]:
+    # (relpath, digest) of files under blobs/ and chunks/ that no row points at, plus temp files
+    # left by an interrupted write; recently changed files are given time to be committed
+    orphans: list[tuple[str, str]] = []
+    cutoff = time.time() - ORPHAN_GRACE
+    for top in ("blobs", "chunks"):
+        batch: dict[str, tuple[str, str]] = {}
+
+        def flush() -> None:
+            if top == "blobs":
+                rows = meta.get_blobs({digest for _, digest in batch.values()})
+                known = {rel for rel, (_, digest) in batch.items()
+                         if digest in rows and rows[digest]["path"] == rel}
+            else:
+                stored = meta.known_chunks(digest for _, digest in batch.values())
+                known = {rel for rel, (_, digest) in batch.items() if digest in stored}
+            orphans.extend((rel, digest) for rel, (_, digest) in batch.items() if rel not in known)
+            batch.clear()
+
+        for path in iter_files(cfg.vault_dir / top):
+            try:
+                if path.stat().st_ctime > cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            rel = path.relative_to(cfg.vault_dir).as_posix()
+            if path.name.startswith(".tmp-"):
+                orphans.append((rel, ""))
+                continue
+            batch[rel] = (rel, path.name.removesuffix(MANIFEST_SUFFIX))
+            if len(batch) >= 500:
+                flush()
+        flush()
+    return sorted(orphans)
+
+
+def _find_strays(cfg: Config, meta: MetaStore) -> list[str]:
+    # Files in the vault directory, outside locky's own, that are not pre-blob-store entries
+    legacy = set(meta.legacy_entries())
+    strays = []
+    try:
+        tops = sorted(os.scandir(cfg.vault_dir), key=lambda e: e.name)
+    except FileNotFoundError:
+        return strays
+    for top in tops:
+        if top.name in RESERVED or top.name.startswith(".") or top.name.startswith(cfg.db_path.name):
+            continue
+        paths = iter_files(Path(top.path)) if top.is_dir(follow_symlinks=False) else [Path(top.path)]
+        for path in paths:
+            name = path.relative_to(cfg.vault_dir).as_posix()
+            if name not in legacy and path.is_file():
+                strays.append(name)
+    return strays
+
+
+def _repair(
+    cfg: Config, meta: MetaStore, report: FsckReport,
+    gone: list[str], gone_versions: list[tuple[str, int]],
+    orphans: list[tuple[str, str]], drift: list[tuple[str, int]],
+) -> None:
+    from core.blobs import BlobStore
+    from core.describer import describe_many
+    from core.semantic import forget_files, index_files
+    from core.vault import _collect_garbage, add_many
+
+    # Entries with nothing behind them go; their blobs are then collected like any other
+    if gone or gone_versions:
+        meta.delete_many(gone)
+        meta.drop_versions(gone_versions)
+        forget_files(cfg.vault_dir, meta, gone)
+        _collect_garbage(cfg, meta)
+        report.removed = report.missing
+
+    # Orphans are checked again under their digest's lock, in case an add just committed them
+    blobs = BlobStore(cfg.vault_dir)
+    for rel, digest in orphans:
+        if digest:
+            with blobs.lock(digest):
+                if rel.startswith("chunks/"):
+                    known = bool(meta.known_chunks([digest]))
+                else:
+                    row = meta.get_blobs([digest]).get(digest)
+                    known = row is not None and row["path"] == rel
+                if known:
+                    continue
+                (cfg.vault_dir / rel).unlink(missing_ok=True)
+        else:
+            (cfg.vault_dir / rel).unlink(missing_ok=True)
+        report.deleted += 1
+
+    # Strays become entries under their path in the vault, described as `locky add` would
+    # while the loose copy is still there to read, then the loose copy goes
+    if report.strays:
+        added = add_many(cfg, meta, ((cfg.vault_dir / name, name) for name in report.strays), policy="rename")
+        describe_many(
+            meta, ((src, name) for name, src in added.added),
+            concurrency=cfg.ai_concurrency, cache_size=cfg.desc_cache_size,
+        )
+        for name, src in added.added:
+            src.unlink(missing_ok=True)
+            report.adopted.append((src.relative_to(cfg.vault_dir).as_posix(), name))
+        index_files(cfg.vault_dir, meta, (name for _, name in report.adopted))
+
+    if drift:
+        meta.set_sizes(drift)
+        report.sizes_fixed = len(drift)
@@ -0,0 +1,193 @@
+from __future__ import annotations
+import re
+from bisect import bisect_right
+from dataclasses import dataclass
+
+from core.metadata import MetaStore
+from utils import trace
+
+# Most candidate rows pulled per query; they are ranked in memory afterwards
+CANDIDATE_LIMIT = 2000
+
+
+@dataclass
+class Match:
+    name: str
+    description: str | None
+    # True when every term matched the name itself, not just the description
+    in_name: bool
+
+
+class FuzzyMatcher:
+    """
+    Type-ahead matching over vault names and descriptions, for the built-in picker and
+    `locky paste --match`.
+
+    Every word of the query must appear (case-insensitively) in the name or description.
+    Words of three or more characters go through the trigram index, names first, and each
+    lookup stops once it has enough candidates; one- and two-character queries are answered
+    by scanning an in-memory copy of the names. When nothing contains the query, names that
+    contain its characters in order ("pstfl" -> "paste_files.py") are tried instead.
+
+    A matcher remembers its last query: when the next one only adds characters (the usual
+    case while typing), the previous candidates are filtered in memory instead of
+    querying again, as long as that candidate set was complete.
+    """
+
+    def __init__(self, meta: MetaStore, candidate_limit: int = CANDIDATE_LIMIT) -> None:
+        self.meta = meta
+        self.candidate_limit = candidate_limit
+        self._query: str | None = None
+        self._rows: list = []
+        self._complete = False
+        self._fuzzy = False
+        # The last candidates came from the name scan, so they say nothing about descriptions
+        self._names_only = False
+        # Every name lowercased and joined by newlines, plus where each one starts; built on
+        # the first short query so a single str.find can scan them all
+        self._names: list[str] | None = None
+        self._joined = ""
+        self._starts: list[int] = []
+        # How the last search was answered ("index", "scan", "refine" or "fuzzy"), for tests and tracing
+        self.last_source = ""
+
+    def search(self, query: str, limit: int = 50) -> list[Match]:
+        q = " ".join(query.lower().split())
+        terms = q.split()
+        if not terms:
+            self._query = None
+            rows = self.meta.fuzzy_candidates([], limit)
+            return [Match(r["filename"], r["description"], True) for r in rows]
+
+        with trace.span("fuzzy.search", query=q):
+            if self._refines(q, terms):
+                rows = [r for r in self._rows if _accepts(r, terms, self._fuzzy, q)]
+                self.last_source = "refine"
+            else:
+                rows = []
+            if not rows:
+                self._fuzzy = False
+                rows, self._complete = self._candidates(terms)
+                if not rows:
+                    rows, self._complete = self._fuzzy_candidates(q)
+                    self._fuzzy = True
+                    self.last_source = "fuzzy"
+            self._query, self._rows = q, rows
+            return _rank(rows, terms, q, self._fuzzy)[:limit]
+
+    def invalidate(self) -> None:
+        # The vault changed underneath us: forget cached names and candidates
+        self._query = None
+        self._names = None
+
+    def _refines(self, q: str, terms: list[str]) -> bool:
+        # Typing more characters can only shrink the match set, so a complete earlier set
+        # still holds every answer; unless it came from the name scan and the query now has
+        # a term long enough to be looked up in descriptions too
+        if self._query is None or not self._complete or not q.startswith(self._query):
+            return False
+        return self._fuzzy or not self._names_only or all(len(t) < 3 for t in terms)
+
+    def _candidates(self, terms: list[str]) -> tuple[list, bool]:
+        # (rows, complete): complete means no matching row was left out by a limit
+        limit = self.candidate_limit
+        if all(len(t) < 3 for t in terms):
+            self.last_source = "scan"
+            self._names_only = True
+            return self._scan_names(terms, limit)
+        self.last_source = "index"
+        self._names_only = False
+        # Name matches first, so a flood of description matches can't push them out
+        rows = self.meta.fuzzy_candidates(terms, limit, names_only=True)
+        if len(rows) >= limit:
+            return rows, False
+        seen = {r["rowid"] for r in rows}
+        more = self.meta.fuzzy_candidates(terms, limit + len(rows))
+        rows += [r for r in more if r["rowid"] not in seen][:limit - len(rows)]
+        return rows, len(more) < limit + len(seen)
+
+    def _scan_names(self, terms: list[str], limit: int) -> tuple[list, bool]:
+        # Scan the joined names for the longest term, checking the others per hit; rows for
+        # the scan path carry no description (short queries are about names)
+        self._load_names()
+        needle = max(terms, key=len)
+        rows: list[dict] = []
+        pos = self._joined.find(needle)
+        while pos >= 0:
+            i = bisect_right(self._starts, pos) - 1
+            lower = self._joined[self._starts[i]:self._starts[i + 1] - 1]
+            if all(t in lower for t in terms):
+                if len(rows) == limit:
+                    return rows, False
+                rows.append({"filename": self._names[i], "description": None})
+            # Resume after this name: one hit per name is enough
+            pos = self._joined.find(needle, self._starts[i + 1])
+        return rows, True
+
+    def _load_names(self) -> None:
+        if self._names is not None:
+            return
+        with trace.span("fuzzy.load_names"):
+            self._names = list(self.meta.iter_names())
+            # Lowercased one by one: lower() can change a name's length, so offsets come from these
+            lowered = [name.lower() for name in self._names]
+            self._joined = "\n".join(lowered) + "\n"
+            starts, at = [], 0
+            for name in lowered:
+                starts.append(at)
+                at += len(name) + 1
+            starts.append(at)
+            self._starts = starts
+
+    def _fuzzy_candidates(self, q: str) -> tuple[list, bool]:
+        # Names containing the query's characters in order, found by one regex pass over the
+        # joined names; "a[^\nb]*b" stops at the first b without backtracking and never
+        # crosses into the next name
+        chars = q.replace(" ", "")
+        self._load_names()
+        pattern = re.compile(re.escape(chars[0]) + "".join(
+            f"[^\n{re.escape(c)}]*{re.escape(c)}" for c in chars[1:]
+        ))
+        rows: list[dict] = []
+        pos = 0
+        while True:
+            found = pattern.search(self._joined, pos)
+            if found is None:
+                return rows, True
+            if len(rows) == self.candidate_limit:
+                return rows, False
+            i = bisect_right(self._starts, found.start()) - 1
+            rows.append({"filename": self._names[i], "description": None})
+            pos = self._starts[i + 1]
+
+
+def _accepts(row, terms: list[str], fuzzy: bool, q: str) -> bool:
+    if fuzzy:
+        return _subsequence(q.replace(" ", ""), row["filename"].lower())
+    name = row["filename"].lower()
+    desc = (row["description"] or "").lower()
+    return all(t in name or t in desc for t in terms)
+
+
+def _subsequence(needle: str, haystack: str) -> bool:
+    # True when needle's characters appear in haystack in order
+    it = iter(haystack)
+    return all(c in it for c in needle)
+
+
+def _rank(rows: list, terms: list[str], q: str, fuzzy: bool) -> list[Match]:
+    # Name matches before description-only matches, then matches at the start of the file's
+    # own name, then at a word boundary, then shorter names; one sort over precomputed keys
+    first = q.replace(" ", "")[:3] if fuzzy else terms[0]
+    keyed = []
+    for row in rows:
+        name = row["filename"]
+        lower = name.lower()
+        base = lower.rsplit("/", 1)[-1]
+        in_name = fuzzy or all(t in lower for t in terms)
+        at = lower.find(first)
+        boundary = at == 0 or (at > 0 and not lower[at - 1].isalnum())
+        keyed.append(((not in_name, not base.startswith(first), not boundary, len(name), name),
+                      Match(name, row["description"], in_name)))
+    keyed.sort(key=lambda pair: pair[0])
+    return [match for _, match in keyed]
@@ -1,93 +1,1106 @@
 from __future__ import annotations
+from contextlib import contextmanager
 from pathlib import Path
+import random
 import sqlite3
+import threading
 import time
+from typing import Callable, Iterable, Iterator
+
+from utils import trace
+
+# How long a writer waits on another process's lock before giving up
+BUSY_TIMEOUT_MS = 5000
+# When that is not enough (many processes writing at once), a write is tried this many more
+# times, waiting BUSY_BACKOFF seconds (doubling each time, with jitter) in between
+BUSY_RETRIES = 6
+BUSY_BACKOFF = 0.05
+# How list_entries can order entries: by name, biggest first, or newest first
+LIST_ORDERS = {"name": "filename", "size": "size_bytes DESC", "added": "added_at DESC"}
+
+# Bumped with every change to COLUMNS, BACKFILL or the indexes; PRAGMA user_version says which
+# schema a database was last brought up to, so opening an up-to-date one checks nothing
+SCHEMA_VERSION = 2
 
 SCHEMA = """
 CREATE TABLE IF NOT EXISTS files (
   filename TEXT PRIMARY KEY,
   added_at INTEGER NOT NULL,
   size_bytes INTEGER NOT NULL,
-  description TEXT
+  description TEXT,
+  digest TEXT,
+  mtime INTEGER,
+  kind TEXT,
+  line_count INTEGER
+);
+CREATE TABLE IF NOT EXISTS blobs (
+  digest TEXT PRIMARY KEY,
+  size_bytes INTEGER NOT NULL,
+  refcount INTEGER NOT NULL DEFAULT 0,
+  codec TEXT,
+  stored_bytes INTEGER,
+  path TEXT
+);
+CREATE TABLE IF NOT EXISTS desc_cache (
+  cache_key TEXT PRIMARY KEY,
+  description TEXT NOT NULL,
+  hits INTEGER NOT NULL DEFAULT 0,
+  created_at INTEGER NOT NULL,
+  last_used INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS desc_cache_last_used ON desc_cache(last_used);
+CREATE TABLE IF NOT EXISTS counters (
+  name TEXT PRIMARY KEY,
+  value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS semantic_rows (
+  row INTEGER PRIMARY KEY,
+  filename TEXT UNIQUE
+);
+CREATE INDEX IF NOT EXISTS semantic_rows_free ON semantic_rows(row) WHERE filename IS NULL;
+CREATE TABLE IF NOT EXISTS previews (
+  digest TEXT PRIMARY KEY,
+  head BLOB NOT NULL,
+  kind TEXT NOT NULL,
+  line_count INTEGER,
+  truncated INTEGER NOT NULL,
+  highlighted BLOB
+);
+CREATE TABLE IF NOT EXISTS settings (
+  name TEXT PRIMARY KEY,
+  value TEXT NOT NULL
 );
+CREATE TABLE IF NOT EXISTS versions (
+  filename TEXT NOT NULL,
+  version INTEGER NOT NULL,
+  digest TEXT NOT NULL,
+  size_bytes INTEGER NOT NULL,
+  added_at INTEGER NOT NULL,
+  description TEXT,
+  PRIMARY KEY (filename, version)
+);
+CREATE TABLE IF NOT EXISTS chunks (
+  digest TEXT PRIMARY KEY,
+  size_bytes INTEGER NOT NULL,
+  refcount INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS blob_chunks (
+  blob TEXT NOT NULL,
+  seq INTEGER NOT NULL,
+  chunk TEXT NOT NULL,
+  PRIMARY KEY (blob, seq)
+);
+CREATE TABLE IF NOT EXISTS verified (
+  path TEXT PRIMARY KEY,
+  inode INTEGER NOT NULL,
+  size_bytes INTEGER NOT NULL,
+  mtime_ns INTEGER NOT NULL,
+  digest TEXT NOT NULL,
+  checked_at INTEGER NOT NULL
+);
+"""
+
+# Columns added after the first release, so older databases get them on open
+COLUMNS = {
+    # mtime: the source file's modification time when it was added (unknown for older entries);
+    # kind and line_count: what the preview found in the contents (see core.sampler.Snippet)
+    "files": {"digest": "TEXT", "mtime": "INTEGER", "kind": "TEXT", "line_count": "INTEGER"},
+    # NULL codec means the blob is stored raw; size_bytes is always the original size
+    # path is where the blob lives, relative to the vault directory
+    "blobs": {"codec": "TEXT", "stored_bytes": "INTEGER", "path": "TEXT"},
+}
+
+# Fills in a column for existing rows right after it has been added
+BACKFILL = {
+    # every blob written before paths were recorded used the one-level blobs/xx/<digest> layout
+    ("blobs", "path"): "UPDATE blobs SET path = 'blobs/' || substr(digest, 1, 2) || '/' || digest",
+    # kind and line_count come from the previews stored for each entry's contents
+    ("files", "line_count"): """
+        UPDATE files SET
+          kind = (SELECT kind FROM previews p WHERE p.digest = files.digest),
+          line_count = (SELECT line_count FROM previews p WHERE p.digest = files.digest)
+        WHERE digest IS NOT NULL
+    """,
+}
+
+# Reference counts on blobs are kept in step with the files (and past versions) that point at
+# them, and chunk reference counts with the chunked blobs that list them. Whenever a name is
+# pointed at new contents, its previous contents are kept as a numbered version.
+# An entry's kind and line count follow the preview stored for its contents.
+TRIGGERS = """
+CREATE INDEX IF NOT EXISTS files_digest ON files(digest);
+CREATE INDEX IF NOT EXISTS files_added ON files(added_at);
+CREATE INDEX IF NOT EXISTS files_size ON files(size_bytes);
+CREATE INDEX IF NOT EXISTS files_kind ON files(kind, filename);
+CREATE TRIGGER IF NOT EXISTS previews_describe_files AFTER INSERT ON previews
+BEGIN
+  UPDATE files SET kind = NEW.kind, line_count = NEW.line_count WHERE digest = NEW.digest;
+END;
+CREATE TRIGGER IF NOT EXISTS files_ref_insert AFTER INSERT ON files
+WHEN NEW.digest IS NOT NULL
+BEGIN
+  UPDATE blobs SET refcount = refcount + 1 WHERE digest = NEW.digest;
+END;
+CREATE TRIGGER IF NOT EXISTS files_ref_update AFTER UPDATE OF digest ON files
+WHEN OLD.digest IS NOT NEW.digest
+BEGIN
+  UPDATE blobs SET refcount = refcount - 1 WHERE digest = OLD.digest;
+  UPDATE blobs SET refcount = refcount + 1 WHERE digest = NEW.digest;
+END;
+CREATE TRIGGER IF NOT EXISTS files_ref_delete AFTER DELETE ON files
+WHEN OLD.digest IS NOT NULL
+BEGIN
+  UPDATE blobs SET refcount = refcount - 1 WHERE digest = OLD.digest;
+END;
+CREATE TRIGGER IF NOT EXISTS files_keep_version AFTER UPDATE OF digest ON files
+WHEN OLD.digest IS NOT NULL AND OLD.digest IS NOT NEW.digest
+BEGIN
+  INSERT INTO versions(filename, version, digest, size_bytes, added_at, description)
+  VALUES (
+    OLD.filename,
+    (SELECT COALESCE(MAX(version), 0) + 1 FROM versions WHERE filename = OLD.filename),
+    OLD.digest, OLD.size_bytes, OLD.added_at, OLD.description
+  );
+END;
+CREATE TRIGGER IF NOT EXISTS files_drop_versions AFTER DELETE ON files
+BEGIN
+  DELETE FROM versions WHERE filename = OLD.filename;
+END;
+CREATE TRIGGER IF NOT EXISTS versions_ref_insert AFTER INSERT ON versions
+BEGIN
+  UPDATE blobs SET refcount = refcount + 1 WHERE digest = NEW.digest;
+END;
+CREATE TRIGGER IF NOT EXISTS versions_ref_delete AFTER DELETE ON versions
+BEGIN
+  UPDATE blobs SET refcount = refcount - 1 WHERE digest = OLD.digest;
+END;
+CREATE TRIGGER IF NOT EXISTS blob_chunks_ref_insert AFTER INSERT ON blob_chunks
+BEGIN
+  UPDATE chunks SET refcount = refcount + 1 WHERE digest = NEW.chunk;
+END;
+CREATE TRIGGER IF NOT EXISTS blob_chunks_ref_delete AFTER DELETE ON blob_chunks
+BEGIN
+  UPDATE chunks SET refcount = refcount - 1 WHERE digest = OLD.chunk;
+END;
+"""
+
+# Full-text index over names, descriptions and a text sample of each file.
+# Rows share the rowid of their files row; triggers keep names and descriptions in sync,
+# the sample is filled in by set_search_samples when a file is stored.
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE files_fts USING fts5(filename, description, sample);
+INSERT INTO files_fts(rowid, filename, description, sample)
+  SELECT rowid, filename, description, '' FROM files;
+"""
+
+SEARCH_TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS files_fts_insert AFTER INSERT ON files
+BEGIN
+  INSERT INTO files_fts(rowid, filename, description, sample)
+  VALUES (NEW.rowid, NEW.filename, NEW.description, '');
+END;
+CREATE TRIGGER IF NOT EXISTS files_fts_describe AFTER UPDATE OF description ON files
+WHEN OLD.description IS NOT NEW.description
+BEGIN
+  UPDATE files_fts SET description = NEW.description WHERE rowid = NEW.rowid;
+END;
+CREATE TRIGGER IF NOT EXISTS files_fts_delete AFTER DELETE ON files
+BEGIN
+  DELETE FROM files_fts WHERE rowid = OLD.rowid;
+END;
+"""
+
+# bm25 weights for (filename, description, sample): a name hit beats a description hit beats a content hit
+SEARCH_WEIGHTS = (10.0, 5.0, 1.0)
+
+# Trigram index over names and descriptions for the built-in fuzzy picker: any substring of
+# three or more characters is answered from the index instead of scanning every name
+FUZZY_SCHEMA = """
+CREATE VIRTUAL TABLE files_trigram USING fts5(filename, description, tokenize='trigram');
+INSERT INTO files_trigram(rowid, filename, description)
+  SELECT rowid, filename, COALESCE(description, '') FROM files;
 """
 
+FUZZY_TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS files_trigram_insert AFTER INSERT ON files
+BEGIN
+  INSERT INTO files_trigram(rowid, filename, description)
+  VALUES (NEW.rowid, NEW.filename, COALESCE(NEW.description, ''));
+END;
+CREATE TRIGGER IF NOT EXISTS files_trigram_describe AFTER UPDATE OF description ON files
+WHEN OLD.description IS NOT NEW.description
+BEGIN
+  UPDATE files_trigram SET description = COALESCE(NEW.description, '') WHERE rowid = NEW.rowid;
+END;
+CREATE TRIGGER IF NOT EXISTS files_trigram_delete AFTER DELETE ON files
+BEGIN
+  DELETE FROM files_trigram WHERE rowid = OLD.rowid;
+END;
+"""
+
+def _run_script(con: sqlite3.Connection, script: str) -> None:
+    # Run a script statement by statement inside the caller's transaction (executescript would
+    # commit it first, letting another process in between the schema checks and the changes)
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            con.execute(statement)
+            statement = ""
+
+
+def _try_script(con: sqlite3.Connection, script: str) -> bool:
+    # Run an optional part of the schema; if this SQLite can't (no FTS5, no trigram tokenizer),
+    # undo what it did and return False
+    con.execute("SAVEPOINT optional")
+    try:
+        _run_script(con, script)
+    except sqlite3.OperationalError:
+        con.execute("ROLLBACK TO optional")
+        return False
+    finally:
+        con.execute("RELEASE optional")
+    return True
+
+
+def _retry(step: Callable):
+    # Run one SQLite step, retrying with exponential backoff while another process holds the lock
+    delay = BUSY_BACKOFF
+    for attempt in range(BUSY_RETRIES + 1):
+        try:
+            return step()
+        except sqlite3.OperationalError as exc:
+            message = str(exc)
+            if attempt == BUSY_RETRIES or ("locked" not in message and "busy" not in message):
+                raise
+        time.sleep(delay * random.uniform(0.5, 1.5))
+        delay *= 2
+
+
 class MetaStore:
     def __init__(self, db_path: Path) -> None:
         self.db_path = db_path
         # Ensure the parent directory for the database exists
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
-        # Initialize the database schema if it doesn't exist
-        with self._connect() as con:
-            con.executescript(SCHEMA)
+        # One connection for the life of the store; every method reuses it
+        self._con = sqlite3.connect(
+            self.db_path,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+        )
+        self._con.row_factory = sqlite3.Row
+        if trace.ENABLED:
+            # Count statements for the trace summary; no callback at all otherwise
+            self._con.set_trace_callback(trace.sql)
+        # Threads sharing the connection take turns at write transactions
+        self._txn = threading.RLock()
+        self._depth = 0
+        self._con.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        # WAL lets readers (like the fzf preview) run while a writer is busy; switching to it
+        # can fail outright while another process is creating the same database
+        _retry(lambda: self._con.execute("PRAGMA journal_mode=WAL"))
+        self._con.execute("PRAGMA synchronous=NORMAL")
+        # Initialize the database schema if it doesn't exist, all in one write transaction so
+        # processes opening an old database at once upgrade it one after the other
+        with self._write() as con:
+            _run_script(con, SCHEMA)
+            self._migrate(con)
+            _run_script(con, TRIGGERS)
+            self.has_search = self._init_search(con)
+            self.has_trigram = self._init_fuzzy(con)
 
     def _connect(self) -> sqlite3.Connection:
-        # Helper method to open a connection to the SQLite database
-        return sqlite3.connect(self.db_path)
+        # Hand out the shared connection; "with" on it wraps a transaction, it does not close it
+        return self._con
 
-    def upsert(self, filename: str, size_bytes: int) -> None:
-        # Insert or update a file's metadata (filename, timestamp, size, description)
-        now = int(time.time())  # Current Unix timestamp
-        with self._connect() as con:
-            # Try to fetch the existing description for this file, if any
-            row = con.execute(
-                "SELECT description FROM files WHERE filename=?",
-                (filename,),
-            ).fetchone()
-            existing_desc = row[0] if row else None
+    @contextmanager
+    def _write(self) -> Iterator[sqlite3.Connection]:
+        # A write transaction that other processes cannot interleave with: BEGIN IMMEDIATE
+        # takes SQLite's write lock up front (so a read-then-write never fails halfway with
+        # "database is locked"), retried with backoff while other writers hold it.
+        # A nested call joins the transaction already open.
+        with self._txn:
+            con = self._con
+            if self._depth:
+                self._depth += 1
+                try:
+                    yield con
+                finally:
+                    self._depth -= 1
+                return
+            if not con.in_transaction:
+                _retry(lambda: con.execute("BEGIN IMMEDIATE"))
+            self._depth = 1
+            try:
+                yield con
+            except BaseException:
+                con.rollback()
+                raise
+            else:
+                _retry(con.commit)
+            finally:
+                self._depth = 0
 
-            # Insert new or update existing record for this file
-            con.execute(
+    def close(self) -> None:
+        self._con.close()
+
+    def __enter__(self) -> MetaStore:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _init_search(self, con: sqlite3.Connection) -> bool:
+        # Create (and backfill) the FTS5 index; returns False if this SQLite lacks FTS5
+        exists = con.execute(
+            "SELECT 1 FROM sqlite_master WHERE name='files_fts'"
+        ).fetchone()
+        return _try_script(con, ("" if exists else SEARCH_SCHEMA) + SEARCH_TRIGGERS)
+
+    def _init_fuzzy(self, con: sqlite3.Connection) -> bool:
+        # Create (and backfill) the trigram index; returns False if this SQLite lacks the
+        # trigram tokenizer (added in 3.34), in which case the picker scans instead
+        exists = con.execute(
+            "SELECT 1 FROM sqlite_master WHERE name='files_trigram'"
+        ).fetchone()
+        return _try_script(con, ("" if exists else FUZZY_SCHEMA) + FUZZY_TRIGGERS)
+
+    def _migrate(self, con: sqlite3.Connection) -> None:
+        # Bring a database written by an older version up to SCHEMA_VERSION, once
+        (version,) = con.execute("PRAGMA user_version").fetchone()
+        if version >= SCHEMA_VERSION:
+            return
+        self._add_missing_columns(con)
+        con.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def _add_missing_columns(self, con: sqlite3.Connection) -> None:
+        # Bring tables created by older versions up to the current column set
+        for table, columns in COLUMNS.items():
+            existing = {row[1] for row in con.execute(f"PRAGMA table_info({table})")}
+            for name, decl in columns.items():
+                if name not in existing:
+                    con.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+                    if (table, name) in BACKFILL:
+                        con.execute(BACKFILL[table, name])
+
+    def upsert(self, filename: str, size_bytes: int, digest: str | None = None, mtime: int | None = None) -> None:
+        # Insert or update a file's metadata (filename, timestamp, size, blob digest, source mtime)
+        self.upsert_many([(filename, size_bytes, digest, mtime)])
+
+    def upsert_many(
+        self,
+        rows: Iterable[tuple],
+        blobs: Iterable[tuple[str, int, str, str | None, int | None]] = (),
+        chunks: Iterable[tuple[str, list[tuple[str, int]]]] = (),
+    ) -> None:
+        # Insert or update many (filename, size_bytes, digest[, mtime]) rows in a single transaction.
+        # The description column is left alone, so re-adding a file keeps its description;
+        # kind and line_count come from the preview of the contents, once there is one.
+        # blobs describes freshly written blobs: (digest, size_bytes, path, codec, stored_bytes),
+        # and chunks the (chunk digest, size) list of each fresh chunked blob, by blob digest
+        now = int(time.time())  # Current Unix timestamp
+        rows = list(rows)
+        with trace.span("meta.upsert", rows=len(rows)), self._write() as con:
+            self._insert_blobs(con, rows, blobs)
+            for digest, pieces in chunks:
+                self._insert_chunks(con, digest, pieces)
+            con.executemany(
                 """
-                INSERT INTO files(filename, added_at, size_bytes, description)
-                VALUES(?,?,?,?)
+                INSERT INTO files(filename, added_at, size_bytes, digest, mtime, kind, line_count)
+                VALUES(?1, ?2, ?3, ?4, ?5,
+                  (SELECT kind FROM previews WHERE digest = ?4),
+                  (SELECT line_count FROM previews WHERE digest = ?4))
                 ON CONFLICT(filename) DO UPDATE SET
                   added_at=excluded.added_at,
                   size_bytes=excluded.size_bytes,
-                  description=excluded.description
+                  digest=COALESCE(excluded.digest, files.digest),
+                  mtime=excluded.mtime,
+                  kind=CASE WHEN excluded.digest IS NULL THEN files.kind ELSE excluded.kind END,
+                  line_count=CASE WHEN excluded.digest IS NULL THEN files.line_count ELSE excluded.line_count END
                 """,
-                (filename, now, size_bytes, existing_desc),
+                [(name, now, size, digest, mtime[0] if mtime else None) for name, size, digest, *mtime in rows],
             )
 
+    def set_digests(
+        self,
+        rows: Iterable[tuple[str, int, str]],
+        blobs: Iterable[tuple[str, int, str, str | None, int | None]] = (),
+    ) -> None:
+        # Point existing (filename, size_bytes, digest) rows at blobs without touching added_at
+        # or descriptions, e.g. when `locky migrate` moves flat files into the blob store
+        rows = list(rows)
+        with self._write() as con:
+            self._insert_blobs(con, rows, blobs)
+            con.executemany(
+                "UPDATE files SET digest=?, size_bytes=? WHERE filename=?",
+                [(digest, size, name) for name, size, digest in rows],
+            )
+
+    def _insert_blobs(self, con: sqlite3.Connection, rows: list, blobs: Iterable) -> None:
+        # Record where new blobs live before any file row can point at them
+        con.executemany(
+            """
+            INSERT INTO blobs(digest, size_bytes, path, codec, stored_bytes) VALUES(?,?,?,?,?)
+            ON CONFLICT(digest) DO UPDATE SET
+              path=excluded.path, codec=excluded.codec, stored_bytes=excluded.stored_bytes
+            """,
+            list(blobs),
+        )
+        # Make sure blob rows exist before the triggers bump their refcounts
+        con.executemany(
+            "INSERT OR IGNORE INTO blobs(digest, size_bytes) VALUES(?,?)",
+            [(row[2], row[1]) for row in rows if row[2] is not None],
+        )
+
+    def _insert_chunks(self, con: sqlite3.Connection, digest: str, pieces: list[tuple[str, int]]) -> None:
+        # List a chunked blob's chunks in order; the triggers count the references
+        con.executemany("INSERT OR IGNORE INTO chunks(digest, size_bytes) VALUES(?,?)", pieces)
+        con.executemany(
+            "INSERT OR IGNORE INTO blob_chunks(blob, seq, chunk) VALUES(?,?,?)",
+            [(digest, seq, chunk) for seq, (chunk, _) in enumerate(pieces)],
+        )
+
+    def set_chunked(self, digest: str, path: str, stored_bytes: int, pieces: list[tuple[str, int]]) -> bool:
+        # An existing blob now lives at path as a chunk manifest; False if the blob is gone
+        with self._write() as con:
+            updated = con.execute(
+                "UPDATE blobs SET codec='chunks', path=?, stored_bytes=? WHERE digest=?",
+                (path, stored_bytes, digest),
+            ).rowcount
+            if updated:
+                self._insert_chunks(con, digest, pieces)
+        return bool(updated)
+
     def set_description(self, filename: str, description: str) -> None:
         # Set or update the description for a file
-        now = int(time.time())  # Current Unix timestamp
-        with self._connect() as con:
-            # Try to fetch the existing file size, default to 0 if not found
-            row = con.execute(
-                "SELECT size_bytes FROM files WHERE filename=?",
-                (filename,),
-            ).fetchone()
-            size_bytes = row[0] if row else 0
+        self.set_descriptions([(filename, description)])
 
-            # Insert new or update existing record with the new description
-            con.execute(
+    def set_descriptions(self, pairs: Iterable[tuple[str, str]]) -> None:
+        # Set many (filename, description) pairs in one transaction; unknown files get a zero-size row
+        now = int(time.time())  # Current Unix timestamp
+        pairs = list(pairs)
+        with trace.span("meta.set_descriptions", rows=len(pairs)), self._write() as con:
+            con.executemany(
                 """
                 INSERT INTO files(filename, added_at, size_bytes, description)
-                VALUES(?,?,?,?)
+                VALUES(?,?,0,?)
                 ON CONFLICT(filename) DO UPDATE SET
                   description=excluded.description,
                   added_at=excluded.added_at
                 """,
-                (filename, now, size_bytes, description),
+                [(name, now, desc) for name, desc in pairs],
             )
 
     def get_description(self, filename: str) -> str | None:
         # retrieve the description for a given file, or None if not found
-        with self._connect() as con:
-            row = con.execute(
-                "SELECT description FROM files WHERE filename=?",
-                (filename,),
-            ).fetchone()
+        row = self._con.execute(
+            "SELECT description FROM files WHERE filename=?",
+            (filename,),
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_digest(self, filename: str) -> str | None:
+        # Retrieve the blob digest a file points at, or None for unknown/legacy entries
+        row = self._con.execute(
+            "SELECT digest FROM files WHERE filename=?",
+            (filename,),
+        ).fetchone()
         return row[0] if row else None
 
+    def get_entry(self, filename: str) -> sqlite3.Row | None:
+        # Everything known about one file in a single lookup (used by the preview pane)
+        return self._con.execute(
+            """
+            SELECT f.filename, f.size_bytes, f.added_at, f.description, f.digest, f.mtime, f.kind,
+              f.line_count, b.codec, b.path
+            FROM files f LEFT JOIN blobs b ON b.digest = f.digest
+            WHERE f.filename=?
+            """,
+            (filename,),
+        ).fetchone()
+
+    def get_preview(self, filename: str) -> sqlite3.Row | None:
+        # Everything the preview pane shows for one file, stored snippet included, in one indexed query
+        return self._con.execute(
+            """
+            SELECT f.filename, f.size_bytes, f.description, f.digest, b.codec, b.path,
+                   p.head, p.kind, p.line_count, p.truncated, p.highlighted
+            FROM files f
+            LEFT JOIN blobs b ON b.digest = f.digest
+            LEFT JOIN previews p ON p.digest = f.digest
+            WHERE f.filename=?
+            """,
+            (filename,),
+        ).fetchone()
+
+    def set_previews(self, rows: Iterable[tuple[str, bytes, str, int | None, bool, bytes | None]]) -> None:
+        # Store (digest, head, kind, line_count, truncated, highlighted) preview snippets
+        with self._write() as con:
+            con.executemany("INSERT OR REPLACE INTO previews VALUES(?,?,?,?,?,?)", list(rows))
+
+    def has_blob(self, digest: str) -> bool:
+        # Check whether any file (past or present) has registered this blob
+        row = self._con.execute("SELECT 1 FROM blobs WHERE digest=?", (digest,)).fetchone()
+        return row is not None
+
+    def take_unreferenced(self) -> list[str]:
+        # Drop blob rows nobody points at anymore and hand back their digests for deletion on disk
+        return [digest for digest, _ in self.take_unreferenced_blobs()]
+
+    def take_unreferenced_blobs(
+        self, discard: Callable[[str, str | None], None] | None = None
+    ) -> list[tuple[str, str | None]]:
+        # Same as take_unreferenced, as (digest, path) pairs. discard(digest, path) is called on
+        # each before the rows go, inside the transaction: another process committing a new
+        # reference to the same content then either keeps the row or finds the file gone.
+        with self._write() as con:
+            rows = con.execute("SELECT digest, path FROM blobs WHERE refcount <= 0").fetchall()
+            if discard is not None:
+                for digest, path in rows:
+                    discard(digest, path)
+            con.execute("DELETE FROM previews WHERE digest IN (SELECT digest FROM blobs WHERE refcount <= 0)")
+            con.execute("DELETE FROM blob_chunks WHERE blob IN (SELECT digest FROM blobs WHERE refcount <= 0)")
+            con.execute("DELETE FROM blobs WHERE refcount <= 0")
+        return [(r[0], r[1]) for r in rows]
+
+    def take_unreferenced_chunks(self, discard: Callable[[str], None] | None = None) -> list[str]:
+        # Drop chunks no blob lists anymore and hand back their digests; discard as above
+        with self._write() as con:
+            rows = [r[0] for r in con.execute("SELECT digest FROM chunks WHERE refcount <= 0")]
+            if discard is not None:
+                for digest in rows:
+                    discard(digest)
+            con.execute("DELETE FROM chunks WHERE refcount <= 0")
+        return rows
+
+    def get_blobs(self, digests: Iterable[str]) -> dict[str, sqlite3.Row]:
+        # Blob rows (where and how each blob is stored) by digest; unknown digests are left out
+        digests = list(digests)
+        found = {}
+        for i in range(0, len(digests), 500):
+            part = digests[i:i + 500]
+            marks = ",".join("?" * len(part))
+            for row in self._con.execute(
+                f"SELECT digest, size_bytes, path, codec FROM blobs WHERE digest IN ({marks})", part
+            ):
+                found[row["digest"]] = row
+        return found
+
+    def versions(self, filename: str) -> list[sqlite3.Row]:
+        # Earlier contents of a name, oldest first, with where their blobs live
+        return self._con.execute(
+            """
+            SELECT v.filename, v.version, v.digest, v.size_bytes, v.added_at, v.description, b.codec, b.path
+            FROM versions v JOIN blobs b ON b.digest = v.digest
+            WHERE v.filename=? ORDER BY v.version
+            """,
+            (filename,),
+        ).fetchall()
+
+    def get_version(self, filename: str, version: int) -> sqlite3.Row | None:
+        return self._con.execute(
+            """
+            SELECT v.filename, v.version, v.digest, v.size_bytes, v.added_at, v.description, b.codec, b.path
+            FROM versions v JOIN blobs b ON b.digest = v.digest
+            WHERE v.filename=? AND v.version=?
+            """,
+            (filename, version),
+        ).fetchone()
+
+    def stored_for_check(self, chunks: bool = False, page: int = 1000) -> Iterator[sqlite3.Row]:
+        # Every blob (or, with chunks, every chunk) with where it lives and what `locky fsck`
+        # last saw there: the (inode, size, mtime_ns) a digest was verified for. Read a page at a
+        # time by digest, so memory stays flat and the caller may write between pages.
+        if chunks:
+            query = """
+                SELECT c.digest, c.size_bytes, NULL AS stored_bytes, NULL AS codec,
+                  'chunks/' || substr(c.digest, 1, 2) || '/' || c.digest AS path,
+                  v.inode, v.size_bytes AS seen_size, v.mtime_ns, v.digest AS seen_digest
+                FROM chunks c
+                LEFT JOIN verified v ON v.path = 'chunks/' || substr(c.digest, 1, 2) || '/' || c.digest
+                WHERE c.digest > ? ORDER BY c.digest LIMIT ?
+            """
+        else:
+            query = """
+                SELECT b.digest, b.size_bytes, b.stored_bytes, b.codec, b.path,
+                  v.inode, v.size_bytes AS seen_size, v.mtime_ns, v.digest AS seen_digest
+                FROM blobs b LEFT JOIN verified v ON v.path = b.path
+                WHERE b.digest > ? ORDER BY b.digest LIMIT ?
+            """
+        last = ""
+        while True:
+            rows = self._con.execute(query, (last, page)).fetchall()
+            yield from rows
+            if len(rows) < page:
+                return
+            last = rows[-1]["digest"]
+
+    def remember_verified(self, rows: Iterable[tuple[str, int, int, int, str]]) -> None:
+        # Record (path, inode, size_bytes, mtime_ns, digest) for files whose contents just checked out
+        now = int(time.time())
+        with self._write() as con:
+            con.executemany(
+                "INSERT OR REPLACE INTO verified VALUES(?,?,?,?,?,?)", [(*row, now) for row in rows]
+            )
+
+    def forget_verified(self, paths: Iterable[str] | None = None) -> None:
+        # Drop what fsck remembers about paths, or (with None) about files no row mentions anymore
+        with self._write() as con:
+            if paths is not None:
+                con.executemany("DELETE FROM verified WHERE path=?", [(p,) for p in paths])
+                return
+            con.execute(
+                """
+                DELETE FROM verified WHERE path NOT IN (SELECT path FROM blobs WHERE path IS NOT NULL)
+                  AND path NOT IN (SELECT 'chunks/' || substr(digest, 1, 2) || '/' || digest FROM chunks)
+                """
+            )
+
+    def known_chunks(self, digests: Iterable[str]) -> set[str]:
+        digests = list(digests)
+        found = set()
+        for i in range(0, len(digests), 500):
+            part = digests[i:i + 500]
+            marks = ",".join("?" * len(part))
+            found.update(r[0] for r in self._con.execute(f"SELECT digest FROM chunks WHERE digest IN ({marks})", part))
+        return found
+
+    def chunked_blobs_using(self, chunks: Iterable[str]) -> set[str]:
+        # Chunked blobs that list any of the given chunks
+        chunks = list(chunks)
+        found = set()
+        for i in range(0, len(chunks), 500):
+            part = chunks[i:i + 500]
+            marks = ",".join("?" * len(part))
+            found.update(r[0] for r in self._con.execute(
+                f"SELECT DISTINCT blob FROM blob_chunks WHERE chunk IN ({marks})", part
+            ))
+        return found
+
+    def entries_using(self, digests: Iterable[str]) -> tuple[list[str], list[tuple[str, int]]]:
+        # The names, and (name, version) pairs of past versions, whose contents are these blobs
+        digests = list(digests)
+        names, versions = [], []
+        for i in range(0, len(digests), 500):
+            part = digests[i:i + 500]
+            marks = ",".join("?" * len(part))
+            names += [r[0] for r in self._con.execute(f"SELECT filename FROM files WHERE digest IN ({marks})", part)]
+            versions += [(r[0], r[1]) for r in self._con.execute(
+                f"SELECT filename, version FROM versions WHERE digest IN ({marks})", part
+            )]
+        return sorted(names), sorted(versions)
+
+    def unstored_entries(self) -> tuple[list[str], list[tuple[str, int]]]:
+        # Entries (and past versions) pointing at a blob the store has no row or path for
+        names = [r[0] for r in self._con.execute(
+            """
+            SELECT f.filename FROM files f LEFT JOIN blobs b ON b.digest = f.digest
+            WHERE f.digest IS NOT NULL AND b.path IS NULL ORDER BY f.filename
+            """
+        )]
+        versions = [(r[0], r[1]) for r in self._con.execute(
+            """
+            SELECT v.filename, v.version FROM versions v LEFT JOIN blobs b ON b.digest = v.digest
+            WHERE b.path IS NULL ORDER BY v.filename, v.version
+            """
+        )]
+        return names, versions
+
+    def drop_versions(self, pairs: Iterable[tuple[str, int]]) -> None:
+        with self._write() as con:
+            con.executemany("DELETE FROM versions WHERE filename=? AND version=?", list(pairs))
+
+    def size_drift(self) -> list[sqlite3.Row]:
+        # Entries whose recorded size is not the size of the blob they point at
+        return self._con.execute(
+            """
+            SELECT f.filename, f.size_bytes, b.size_bytes AS actual
+            FROM files f JOIN blobs b ON b.digest = f.digest
+            WHERE f.size_bytes != b.size_bytes ORDER BY f.filename
+            """
+        ).fetchall()
+
+    def set_sizes(self, pairs: Iterable[tuple[str, int]]) -> None:
+        # Correct the recorded size of (filename, size_bytes) entries, nothing else
+        with self._write() as con:
+            con.executemany("UPDATE files SET size_bytes=? WHERE filename=?", [(n, f) for f, n in pairs])
+
+    def legacy_entries(self) -> list[str]:
+        # Names still stored flat in the vault directory (added before the blob store existed)
+        return [r[0] for r in self._con.execute("SELECT filename FROM files WHERE digest IS NULL")]
+
+    def blob_paths(self) -> list[tuple[str, str | None]]:
+        # Every (digest, path) pair, for moving blobs to a new layout
+        return [(r[0], r[1]) for r in self._con.execute("SELECT digest, path FROM blobs")]
+
+    def set_blob_paths(self, pairs: Iterable[tuple[str, str]]) -> None:
+        # Point blobs at their new (digest, path) locations in one transaction
+        with self._write() as con:
+            con.executemany("UPDATE blobs SET path=? WHERE digest=?", [(p, d) for d, p in pairs])
+
+    def mirror_entries(self) -> list[sqlite3.Row]:
+        # What a copy of the vault must hold: every entry with its blob's (digest, path, stored
+        # size, codec), where digest and path are NULL for flat pre-blob-store files; then blobs
+        # only past versions use, and chunks, with a NULL filename
+        return self._con.execute(
+            """
+            SELECT f.filename, f.digest, b.path, COALESCE(b.stored_bytes, b.size_bytes) AS stored_bytes, b.codec
+            FROM files f LEFT JOIN blobs b ON b.digest = f.digest
+            UNION ALL
+            SELECT NULL, b.digest, b.path, COALESCE(b.stored_bytes, b.size_bytes), b.codec
+            FROM blobs b WHERE b.refcount > 0 AND NOT EXISTS (SELECT 1 FROM files f WHERE f.digest = b.digest)
+            UNION ALL
+            SELECT NULL, c.digest, 'chunks/' || substr(c.digest, 1, 2) || '/' || c.digest, c.size_bytes, NULL
+            FROM chunks c WHERE c.refcount > 0
+            """
+        ).fetchall()
+
+    def pack_blobs(self) -> Iterator[sqlite3.Row]:
+        # Every blob an entry or a past version still uses, in on-disk order, for `locky export`
+        yield from self._con.execute(
+            "SELECT digest, size_bytes, codec, path FROM blobs WHERE refcount > 0 ORDER BY path"
+        )
+
+    def export_rows(self) -> Iterator[sqlite3.Row]:
+        # Stream every entry as it would be imported elsewhere, search sample included
+        if self.has_search:
+            query = """
+            SELECT f.filename, f.added_at, f.size_bytes, f.description, f.digest, f.mtime, s.sample
+            FROM files f LEFT JOIN files_fts s ON s.rowid = f.rowid ORDER BY f.filename
+            """
+        else:
+            query = """
+            SELECT filename, added_at, size_bytes, description, digest, mtime, '' AS sample
+            FROM files ORDER BY filename
+            """
+        yield from self._con.execute(query)
+
+    def get_previews(self, digests: list[str]) -> list[sqlite3.Row]:
+        # Stored preview snippets for many blobs at once (missing ones are left out)
+        marks = ",".join("?" * len(digests))
+        return self._con.execute(
+            f"SELECT digest, head, kind, line_count, truncated, highlighted FROM previews WHERE digest IN ({marks})",
+            digests,
+        ).fetchall()
+
+    def import_entries(
+        self,
+        files: Iterable[tuple[str, int, int, str | None, str, int | None]],
+        blobs: Iterable[tuple[str, int, str, str | None, int | None]] = (),
+        versions: Iterable[tuple[str, int, str, int, int, str | None]] = (),
+    ) -> None:
+        # Bring in entries from another vault as they were there, in one transaction:
+        # files are (filename, added_at, size_bytes, description, digest, mtime) rows, blobs as in
+        # upsert_many, and versions (filename, version, digest, size_bytes, added_at, description)
+        files = list(files)
+        versions = list(versions)
+        with self._write() as con:
+            self._insert_blobs(con, [], blobs)
+            con.executemany(
+                "INSERT OR IGNORE INTO blobs(digest, size_bytes) VALUES(?,?)",
+                [(f[4], f[2]) for f in files] + [(v[2], v[3]) for v in versions],
+            )
+            con.executemany(
+                """
+                INSERT INTO files(filename, added_at, size_bytes, description, digest, mtime, kind, line_count)
+                VALUES(?1, ?2, ?3, ?4, ?5, ?6,
+                  (SELECT kind FROM previews WHERE digest = ?5),
+                  (SELECT line_count FROM previews WHERE digest = ?5))
+                ON CONFLICT(filename) DO UPDATE SET
+                  added_at=excluded.added_at,
+                  size_bytes=excluded.size_bytes,
+                  description=COALESCE(excluded.description, files.description),
+                  digest=excluded.digest,
+                  mtime=excluded.mtime,
+                  kind=excluded.kind,
+                  line_count=excluded.line_count
+                """,
+                files,
+            )
+            con.executemany(
+                """
+                INSERT OR IGNORE INTO versions(filename, version, digest, size_bytes, added_at, description)
+                VALUES(?,?,?,?,?,?)
+                """,
+                versions,
+            )
+
+    def backup_to(self, dest: Path) -> None:
+        # A consistent copy of the whole database (WAL contents included), taken while
+        # other connections keep working
+        target = sqlite3.connect(dest)
+        try:
+            self._con.backup(target)
+        finally:
+            target.close()
+
+    def get_setting(self, name: str, default: str | None = None) -> str | None:
+        row = self._con.execute("SELECT value FROM settings WHERE name=?", (name,)).fetchone()
+        return row[0] if row else default
+
+    def set_setting(self, name: str, value: str) -> None:
+        with self._write() as con:
+            con.execute(
+                "INSERT INTO settings(name, value) VALUES(?,?) ON CONFLICT(name) DO UPDATE SET value=excluded.value",
+                (name, value),
+            )
+
     def delete(self, filename: str) -> None:
         # Remove a file's record from the database
-        with self._connect() as con:
-            con.execute("DELETE FROM files WHERE filename=?", (filename,))
+        self.delete_many([filename])
+
+    def delete_many(self, filenames: Iterable[str]) -> None:
+        # Remove many records in a single transaction
+        with self._write() as con:
+            con.executemany("DELETE FROM files WHERE filename=?", [(name,) for name in filenames])
+
+    def cached_description(self, cache_key: str) -> str | None:
+        # Look up a description by content key, recording the hit or miss
+        now = int(time.time())
+        with self._write() as con:
+            row = con.execute(
+                "SELECT description FROM desc_cache WHERE cache_key=?", (cache_key,)
+            ).fetchone()
+            if row is not None:
+                con.execute(
+                    "UPDATE desc_cache SET hits = hits + 1, last_used=? WHERE cache_key=?",
+                    (now, cache_key),
+                )
+            self._bump(con, "desc_cache_hits" if row else "desc_cache_misses")
+        return row[0] if row else None
+
+    def cache_descriptions(self, entries: Iterable[tuple[str, str]], max_entries: int) -> None:
+        # Remember (cache_key, description) pairs, then evict the least recently used
+        # entries so the cache never holds more than max_entries rows
+        now = int(time.time())
+        with self._write() as con:
+            con.executemany(
+                """
+                INSERT INTO desc_cache(cache_key, description, created_at, last_used)
+                VALUES(?,?,?,?)
+                ON CONFLICT(cache_key) DO UPDATE SET
+                  description=excluded.description,
+                  last_used=excluded.last_used
+                """,
+                [(key, desc, now, now) for key, desc in entries],
+            )
+            (count,) = con.execute("SELECT COUNT(*) FROM desc_cache").fetchone()
+            if count > max_entries:
+                con.execute(
+                    """
+                    DELETE FROM desc_cache WHERE cache_key IN (
+                      SELECT cache_key FROM desc_cache ORDER BY last_used, hits LIMIT ?
+                    )
+                    """,
+                    (count - max_entries,),
+                )
+
+    def cache_stats(self) -> dict[str, int]:
+        # Size of the description cache and how often it saved an API call
+        (entries,) = self._con.execute("SELECT COUNT(*) FROM desc_cache").fetchone()
+        counters = dict(self._con.execute("SELECT name, value FROM counters").fetchall())
+        return {
+            "entries": entries,
+            "hits": counters.get("desc_cache_hits", 0),
+            "misses": counters.get("desc_cache_misses", 0),
+        }
+
+    def _bump(self, con: sqlite3.Connection, name: str, by: int = 1) -> None:
+        con.execute(
+            """
+            INSERT INTO counters(name, value) VALUES(?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+            """,
+            (name, by),
+        )
+
+    def set_search_samples(self, samples: Iterable[tuple[str, str]]) -> None:
+        # Attach a text sample of each file's contents to its search row
+        if not self.has_search:
+            return
+        with self._write() as con:
+            con.executemany(
+                "UPDATE files_fts SET sample=? WHERE rowid=(SELECT rowid FROM files WHERE filename=?)",
+                [(sample, name) for name, sample in samples],
+            )
+
+    def search(
+        self, query: str, limit: int = 20, mark: tuple[str, str] = ("[", "]")
+    ) -> list[sqlite3.Row]:
+        # BM25-ranked matches with a highlighted snippet; every word must match, the last one as a prefix
+        terms = query.split()
+        if not terms:
+            return []
+        if not self.has_search:
+            # No FTS5 in this SQLite build: fall back to a plain substring scan
+            like = f"%{query}%"
+            return self._con.execute(
+                """
+                SELECT filename, description, COALESCE(description, '') AS snippet, 0.0 AS rank
+                FROM files WHERE filename LIKE ? OR description LIKE ?
+                ORDER BY filename LIMIT ?
+                """,
+                (like, like, limit),
+            ).fetchall()
+        match = " ".join('"' + t.replace('"', '""') + '"' for t in terms) + "*"
+        return self._con.execute(
+            f"""
+            SELECT f.filename, f.description,
+                   snippet(files_fts, -1, ?, ?, '…', 12) AS snippet,
+                   bm25(files_fts, {", ".join(map(str, SEARCH_WEIGHTS))}) AS rank
+            FROM files_fts JOIN files f ON f.rowid = files_fts.rowid
+            WHERE files_fts MATCH ?
+            ORDER BY rank
+            LIMIT ?
+            """,
+            (mark[0], mark[1], match, limit),
+        ).fetchall()
+
+    def fuzzy_candidates(
+        self, terms: list[str], limit: int, names_only: bool = False
+    ) -> list[sqlite3.Row]:
+        """
+        Up to limit (rowid, filename, description) rows containing every term (lowercase) in their
+        name or description (or just the name, with names_only), in index order so the lookup
+        stops as soon as limit rows are found.
+        """
+        long = [t for t in terms if len(t) >= 3]
+        test = "instr(lower(f.filename), ?)"
+        if not names_only:
+            test = f"({test} OR instr(lower(COALESCE(f.description, '')), ?))"
+        per_term = 1 if names_only else 2
+        if self.has_trigram and long:
+            match = " AND ".join('"' + t.replace('"', '""') + '"' for t in long)
+            if names_only:
+                match = f"{{filename}} : ({match})"
+            # Terms too short for trigrams are checked on the rows the index narrowed down to
+            short = [t for t in terms if len(t) < 3]
+            return self._con.execute(
+                f"""
+                SELECT f.rowid, f.filename, f.description
+                FROM files_trigram JOIN files f ON f.rowid = files_trigram.rowid
+                WHERE files_trigram MATCH ?{"".join(" AND " + test for _ in short)}
+                LIMIT ?
+                """,
+                (match, *[t for t in short for _ in range(per_term)], limit),
+            ).fetchall()
+        # No trigram index, or only short terms: scan, stopping as soon as limit rows matched
+        return self._con.execute(
+            f"SELECT f.rowid, f.filename, f.description FROM files f WHERE 1{''.join(' AND ' + test for _ in terms)} LIMIT ?",
+            (*[t for t in terms for _ in range(per_term)], limit),
+        ).fetchall()
+
+    def iter_names(self) -> Iterator[str]:
+        # Every file name, streamed in table order (for in-memory name scans)
+        for row in self._con.execute("SELECT filename FROM files"):
+            yield row[0]
+
+    def rebuild_search_index(self) -> None:
+        # Recreate the FTS rows from the files table (samples are lost until files are re-added)
+        if not self.has_search:
+            return
+        with self._write() as con:
+            con.execute("DELETE FROM files_fts")
+            con.execute(
+                "INSERT INTO files_fts(rowid, filename, description, sample) "
+                "SELECT rowid, filename, description, '' FROM files"
+            )
+
+    def assign_semantic_row(self, filename: str) -> tuple[int, bool]:
+        # The semantic-index matrix row for a file: its existing row (True), or a freed
+        # or brand new one (False)
+        with self._write() as con:
+            row = con.execute(
+                "SELECT row FROM semantic_rows WHERE filename=?", (filename,)
+            ).fetchone()
+            if row is not None:
+                return row[0], True
+            free = con.execute(
+                "SELECT row FROM semantic_rows WHERE filename IS NULL LIMIT 1"
+            ).fetchone()
+            if free is not None:
+                con.execute("UPDATE semantic_rows SET filename=? WHERE row=?", (filename, free[0]))
+                return free[0], False
+            (new,) = con.execute(
+                "SELECT COALESCE(MAX(row) + 1, 0) FROM semantic_rows"
+            ).fetchone()
+            con.execute("INSERT INTO semantic_rows(row, filename) VALUES(?,?)", (new, filename))
+            return new, False
+
+    def release_semantic_rows(self, filenames: Iterable[str]) -> list[int]:
+        # Free the rows of removed files for reuse and return them so they can be zeroed
+        rows = []
+        with self._write() as con:
+            for name in filenames:
+                row = con.execute(
+                    "SELECT row FROM semantic_rows WHERE filename=?", (name,)
+                ).fetchone()
+                if row is not None:
+                    con.execute("UPDATE semantic_rows SET filename=NULL WHERE row=?", (row[0],))
+                    rows.append(row[0])
+        return rows
+
+    def clear_semantic_rows(self) -> None:
+        with self._write() as con:
+            con.execute("DELETE FROM semantic_rows")
+
+    def semantic_row_count(self) -> int:
+        (count,) = self._con.execute(
+            "SELECT COUNT(*) FROM semantic_rows WHERE filename IS NOT NULL"
+        ).fetchone()
+        return count
+
+    def semantic_names(self, rows: list[int]) -> dict[int, str]:
+        # Map matrix rows back to filenames
+        if not rows:
+            return {}
+        marks = ",".join("?" * len(rows))
+        return dict(self._con.execute(
+            f"SELECT row, filename FROM semantic_rows WHERE row IN ({marks}) AND filename IS NOT NULL",
+            rows,
+        ).fetchall())
 
     def list_files(self) -> list[str]:
         # Return a list of all filenames in the database, sorted alphabetically
-        with self._connect() as con:
-            rows = con.execute("SELECT filename FROM files ORDER BY filename").fetchall()
-        return [r[0] for r in rows]
\ No newline at end of file
+        rows = self._con.execute("SELECT filename FROM files ORDER BY filename").fetchall()
+        return [r[0] for r in rows]
+
+    def list_entries(
+        self,
+        sort: str = "name",
+        since: int | None = None,
+        kind: str | None = None,
+        larger_than: int | None = None,
+        limit: int | None = None,
+        offset: int = 0,
+    ) -> Iterator[sqlite3.Row]:
+        """
+        Stream the entries that match every filter given (added at or after since, of kind,
+        bigger than larger_than bytes), in LIST_ORDERS[sort] order, straight off the cursor.
+        Each order and filter has an index, so rows start coming without reading the rest
+        (only a kind filter with a size or added order sorts, and just that kind's rows).
+        """
+        where, params = [], []
+        if since is not None:
+            where.append("added_at >= ?")
+            params.append(since)
+        if kind is not None:
+            where.append("kind = ?")
+            params.append(kind)
+        if larger_than is not None:
+            where.append("size_bytes > ?")
+            params.append(larger_than)
+        query = (
+            "SELECT filename, size_bytes, added_at, mtime, kind, line_count, digest, description FROM files"
+            + (" WHERE " + " AND ".join(where) if where else "")
+            + f" ORDER BY {LIST_ORDERS[sort]} LIMIT ? OFFSET ?"
+        )
+        yield from self._con.execute(query, [*params, -1 if limit is None else limit, offset])
+
+    def list_with_metadata(self) -> Iterator[sqlite3.Row]:
+        # Stream filename/size/date/description rows from one query, sorted by name,
+        # without building the whole list in memory
+        cur = self._con.execute(
+            "SELECT filename, size_bytes, added_at, description FROM files ORDER BY filename"
+        )
+        yield from cur
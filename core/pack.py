@@ -0,0 +1,341 @@
+from __future__ import annotations
+import hashlib
+import io
+import json
+import mmap
+import struct
+import tempfile
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import BinaryIO, Iterator
+
+from config import Config
+from core.blobs import BlobStore
+from core.chunks import CHUNKED
+from core.compression import open_blob, wrap_stream
+from core.metadata import MetaStore
+from utils import trace
+
+# A pack is one file holding a whole vault, written front to back so it can go to a pipe:
+#
+#   MAGIC | blob contents, back to back | metadata database snapshot | index | TRAILER
+#
+# The index (zlib-compressed JSON) says where each blob and the database start, and the
+# fixed-size trailer at the very end says where the index starts. Readers seek to the trailer,
+# then the index, then straight to whatever entry they want.
+MAGIC = b"LOCKYPK1"
+TRAILER = struct.Struct("<8sQQ")
+TRAILER_MAGIC = b"LOCKYIDX"
+PACK_VERSION = 1
+# How import_pack may treat names the vault already has
+IMPORT_POLICIES = ("skip", "overwrite")
+_BLOCK = 1 << 20
+
+
+@dataclass
+class ExportReport:
+    blobs: int = 0
+    # entries stored flat in the vault directory (pre-blob-store), packed as blobs
+    legacy: int = 0
+    bytes_written: int = 0
+    # blobs or flat files that vanished from the vault while exporting
+    missing: list[str] = field(default_factory=list)
+
+
+@dataclass
+class ImportReport:
+    added: list[str] = field(default_factory=list)
+    # names left alone because the vault already has them
+    skipped: list[str] = field(default_factory=list)
+    blobs_written: int = 0
+    # blobs the vault already had, so nothing was copied
+    deduplicated: int = 0
+    # entries whose contents are not in the pack, or do not match their digest
+    missing: list[str] = field(default_factory=list)
+
+
+class _Counter:
+    # Write-through wrapper that knows how far into the pack it is, even on a pipe
+    def __init__(self, out: BinaryIO) -> None:
+        self.out = out
+        self.offset = 0
+
+    def write(self, data) -> int:
+        n = self.out.write(data)
+        self.offset += len(data) if n is None else n
+        return n
+
+
+def export_vault(cfg: Config, meta: MetaStore, out: BinaryIO) -> ExportReport:
+    """
+    Write the whole vault (every blob that an entry or a past version uses, plus the metadata
+    database) as one pack to out. Blobs are streamed through a 1 MiB buffer, so memory stays
+    flat whatever the vault's size; out does not need to be seekable.
+    """
+    report = ExportReport()
+    writer = _Counter(out)
+    writer.write(MAGIC)
+    index: dict = {"version": PACK_VERSION, "blobs": {}, "legacy": {}}
+    with tempfile.TemporaryDirectory(prefix="locky-export-") as tmp:
+        # Export a snapshot, so entries added or removed meanwhile don't tear the pack
+        snapshot = Path(tmp) / cfg.db_path.name
+        meta.backup_to(snapshot)
+        with MetaStore(snapshot) as snap:
+            with trace.span("export.blobs"):
+                for row in snap.pack_blobs():
+                    if row["path"] is None:
+                        continue
+                    # Compressed blobs go in as stored; chunked ones reassembled, as a pack has no chunk store
+                    chunked = row["codec"] == CHUNKED
+                    offset = writer.offset
+                    try:
+                        with open_blob(cfg.vault_dir / row["path"], CHUNKED if chunked else None) as f:
+                            _copy(f, writer)
+                    except FileNotFoundError:
+                        report.missing.append(row["digest"])
+                        continue
+                    codec = None if chunked else row["codec"]
+                    index["blobs"][row["digest"]] = [offset, writer.offset - offset, codec, row["size_bytes"]]
+                    report.blobs += 1
+            with trace.span("export.legacy"):
+                for name in snap.legacy_entries():
+                    offset = writer.offset
+                    h = hashlib.sha256()
+                    try:
+                        with open(cfg.vault_dir / name, "rb") as f:
+                            _copy(f, writer, h)
+                    except FileNotFoundError:
+                        report.missing.append(name)
+                        continue
+                    digest, length = h.hexdigest(), writer.offset - offset
+                    index["blobs"].setdefault(digest, [offset, length, None, length])
+                    index["legacy"][name] = digest
+                    report.legacy += 1
+        with trace.span("export.database"):
+            offset = writer.offset
+            with open(snapshot, "rb") as f:
+                _copy(f, writer)
+            index["database"] = [offset, writer.offset - offset]
+    offset = writer.offset
+    writer.write(zlib.compress(json.dumps(index, separators=(",", ":")).encode()))
+    writer.write(TRAILER.pack(TRAILER_MAGIC, offset, writer.offset - offset))
+    report.bytes_written = writer.offset
+    return report
+
+
+def _copy(f: BinaryIO, writer: _Counter, h=None) -> None:
+    for block in iter(lambda: f.read(_BLOCK), b""):
+        if h is not None:
+            h.update(block)
+        writer.write(block)
+
+
+def is_pack(path: Path) -> bool:
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class Pack:
+    """
+    Read-only access to a pack, memory-mapped: any entry is read straight out of the map by its
+    offset in the index, without scanning the rest of the pack.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"not a locky pack: {path}") from None
+        if len(self._map) < len(MAGIC) + TRAILER.size or self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"not a locky pack: {path}")
+        magic, offset, length = TRAILER.unpack(self._map[-TRAILER.size:])
+        if magic != TRAILER_MAGIC:
+            self.close()
+            raise ValueError(f"pack has no index (incomplete write?): {path}")
+        index = json.loads(zlib.decompress(self._map[offset:offset + length]))
+        # digest -> (offset, packed length, codec, original size)
+        self.blobs: dict[str, list] = index["blobs"]
+        # flat pre-blob-store entry name -> the digest its contents are packed under
+        self.legacy: dict[str, str] = index["legacy"]
+        self._database = index["database"]
+
+    def close(self) -> None:
+        if getattr(self, "_map", None) is not None:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self) -> Pack:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def digest_of(self, entry) -> str | None:
+        # The digest a metadata row's contents are packed under (None if they are not in the pack)
+        if entry is None:
+            return None
+        digest = entry["digest"] if entry["digest"] is not None else self.legacy.get(entry["filename"])
+        return digest if digest in self.blobs else None
+
+    def open(self, digest: str, raw: bool = False) -> BinaryIO:
+        # A blob's original contents (or, with raw, its bytes as packed) as a stream over the map
+        offset, length, codec, _ = self.blobs[digest]
+        reader = io.BufferedReader(_SliceReader(self._map, offset, length), buffer_size=_BLOCK)
+        return reader if raw else wrap_stream(reader, codec)
+
+    def open_entry(self, entry) -> BinaryIO | None:
+        digest = self.digest_of(entry)
+        return self.open(digest) if digest is not None else None
+
+    def extract_database(self, dst: Path) -> None:
+        offset, length = self._database
+        with open(dst, "wb") as out:
+            out.write(self._map[offset:offset + length])
+
+
+class _SliceReader(io.RawIOBase):
+    # One blob's byte range of the mapped pack, read like a file
+    def __init__(self, data: mmap.mmap, offset: int, length: int) -> None:
+        self._data = data
+        self._start = offset
+        self._end = offset + length
+        self._pos = offset
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        n = min(len(buffer), self._end - self._pos)
+        buffer[:n] = self._data[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+
+@contextmanager
+def open_pack(path: Path) -> Iterator[tuple[Pack, MetaStore]]:
+    """
+    Browse a pack without importing it: its metadata database is unpacked to a temporary file
+    (so the picker, previews and search work on it as usual) while file contents are served
+    from the memory-mapped pack.
+    """
+    with Pack(path) as pack, tempfile.TemporaryDirectory(prefix="locky-pack-") as tmp:
+        db = Path(tmp) / "metadata.sqlite3"
+        pack.extract_database(db)
+        with MetaStore(db) as meta:
+            yield pack, meta
+
+
+def import_pack(
+    cfg: Config,
+    meta: MetaStore,
+    path: Path,
+    policy: str = "skip",
+    workers: int = 8,
+    batch_size: int = 500,
+) -> ImportReport:
+    """
+    Add every entry of a pack to the vault, with its description, date, search sample,
+    preview and past versions. Blobs are written by a thread pool straight out of the
+    mapped pack and checked against their digests; metadata rows go in batches of
+    batch_size, one transaction each. With policy "overwrite" a name the vault already has
+    keeps its current contents as a version (the pack's history for it is not merged).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from core.vault import blob_store
+
+    if policy not in IMPORT_POLICIES:
+        raise ValueError(f"unknown conflict policy: {policy}")
+    report = ImportReport()
+    blobs = blob_store(cfg, meta)
+    with open_pack(path) as (pack, snap), ThreadPoolExecutor(max_workers=workers) as pool:
+        batch: list[tuple] = []
+        for row in snap.export_rows():
+            name = row["filename"]
+            taken = meta.get_entry(name) is not None
+            if taken and policy == "skip":
+                report.skipped.append(name)
+                continue
+            digest = pack.digest_of(row)
+            if digest is None:
+                report.missing.append(name)
+                continue
+            history = [] if taken else [v for v in snap.versions(name) if v["digest"] in pack.blobs]
+            batch.append((row, digest, history))
+            if len(batch) >= batch_size:
+                _import_batch(pack, snap, meta, blobs, pool, batch, report)
+                batch.clear()
+        if batch:
+            _import_batch(pack, snap, meta, blobs, pool, batch, report)
+    return report
+
+
+def _import_batch(pack: Pack, snap: MetaStore, meta: MetaStore, blobs: BlobStore, pool, batch, report) -> None:
+    digests = sorted({d for _, d, history in batch for d in [d, *(v["digest"] for v in history)]})
+
+    def store(digest: str) -> tuple[str, int | None, bool]:
+        # Worker: copy one blob out of the pack unless the vault has it already
+        if blobs.has(digest):
+            return digest, None, True
+        codec = pack.blobs[digest][2]
+        try:
+            with pack.open(digest, raw=True) as f:
+                stored = blobs.put_stored(f, digest, codec)
+        except ValueError:
+            return digest, None, False
+        return digest, stored, True
+
+    fresh: list[tuple] = []
+    good: set[str] = set()
+    with trace.span("import.blobs", blobs=len(digests)):
+        for digest, stored, ok in pool.map(store, digests):
+            if not ok:
+                continue
+            good.add(digest)
+            if stored is None:
+                report.deduplicated += 1
+            else:
+                _, _, codec, size = pack.blobs[digest]
+                fresh.append((digest, size, blobs.relpath(digest), codec, stored))
+                report.blobs_written += 1
+
+    files, versions, samples = [], [], []
+    for row, digest, history in batch:
+        if digest not in good:
+            report.missing.append(row["filename"])
+            continue
+        files.append((row["filename"], row["added_at"], row["size_bytes"], row["description"], digest, row["mtime"]))
+        versions.extend(
+            (v["filename"], v["version"], v["digest"], v["size_bytes"], v["added_at"], v["description"])
+            for v in history if v["digest"] in good
+        )
+        if row["sample"]:
+            samples.append((row["filename"], row["sample"]))
+        report.added.append(row["filename"])
+    with trace.span("import.commit", rows=len(files)):
+        meta.import_entries(files, fresh, versions)
+        meta.set_search_samples(samples)
+        meta.set_previews(tuple(p) for p in snap.get_previews(sorted(good)))
+    # As when adding (see core.vault._heal): a blob found already stored may have been garbage
+    # collected by another process before the commit above; copy it out of the pack again
+    rows = meta.get_blobs(good)
+    lost = [digest for digest in sorted(good) if not blobs.intact(rows.get(digest))]
+    healed = []
+    for digest in lost:
+        _, _, codec, size = pack.blobs[digest]
+        with blobs.lock(digest):
+            blobs.delete(digest)
+            blobs.delete(digest, blobs.relpath(digest, CHUNKED))
+            with pack.open(digest, raw=True) as f:
+                stored = blobs.put_stored(f, digest, codec)
+        healed.append((digest, size, blobs.relpath(digest), codec, stored))
+    if healed:
+        meta.upsert_many([], healed)
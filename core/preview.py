@@ -1,24 +1,15 @@
 from __future__ import annotations
-import sys
 import sqlite3
+import sys
 import shutil
 import subprocess
 from pathlib import Path
 
-def get_description(db_path: Path, filename: str) -> str | None:
-    # Check if the database file exists
-    if not db_path.exists():
-        return None
-    # Connect to the SQLite database
-    con = sqlite3.connect(db_path)
-    try:
-        # Query for the description of the given filename
-        row = con.execute("SELECT description FROM files WHERE filename=?", (filename,)).fetchone()
-        # Return the description if found and not empty, else None
-        return row[0] if row and row[0] else None
-    finally:
-        # Always close the database connection
-        con.close()
+from core.blobs import entry_path
+from core.compression import open_blob
+from core.metadata import MetaStore
+from core.sampler import Snippet, human_size, read_snippet
+from utils import trace
 
 def pick_preview_cmd():
     # Check if the 'bat' CLI tool is installed (for pretty file previews)
@@ -31,34 +22,132 @@ def pick_preview_cmd():
     # Fallback to 'cat' if neither is available (plain output)
     return ["cat"]
 
+def render(
+    meta: MetaStore | None,
+    vault_dir: Path,
+    filename: str,
+    preview_cmd: list[str],
+    width: int | None = None,
+    max_lines: int | None = None,
+    pack=None,
+) -> bytes:
+    # Build the whole preview (header + file contents) as bytes, so it can be printed or cached.
+    # With pack (a core.pack.Pack), meta is the pack's metadata and contents come from the pack.
+    with trace.span("preview.render", file=filename):
+        return _render(meta, vault_dir, filename, preview_cmd, width, max_lines, pack)
+
+def _render(
+    meta: MetaStore | None,
+    vault_dir: Path,
+    filename: str,
+    preview_cmd: list[str],
+    width: int | None,
+    max_lines: int | None,
+    pack,
+) -> bytes:
+    # The file's row, blob location and stored snippet, in one indexed query
+    row = meta.get_preview(filename) if meta is not None else None
+    desc = row["description"] if row else None
+
+    if row is not None and row["head"] is not None:
+        snippet = Snippet(row["head"], row["kind"], row["line_count"], bool(row["truncated"]))
+        highlighted = row["highlighted"]
+    elif pack is not None:
+        # Read-only pack: read the head straight out of the mapped pack
+        if pack.digest_of(row) is None:
+            return _header(filename, desc) + b"(file not found in pack)\n"
+        with pack.open_entry(row) as f:
+            snippet = read_snippet(f)
+        highlighted = None
+    else:
+        # Full path to the file's contents, as recorded in the metadata store
+        file_path = entry_path(vault_dir, row)
+        # Check if the file exists and is a regular file
+        if file_path is None or not file_path.is_file():
+            return _header(filename, desc) + b"(file not found in vault)\n"
+        # No stored snippet (added before snippets existed, or a legacy flat file):
+        # read just the head, and keep it for next time
+        with open_blob(file_path, row["codec"]) as f:
+            snippet = read_snippet(f)
+        highlighted = None
+        if row["digest"] is not None:
+            try:
+                meta.set_previews([(row["digest"], snippet.head, snippet.kind, snippet.line_count, snippet.truncated, None)])
+            except sqlite3.Error:
+                pass  # only a cache; the preview itself is fine
+
+    header = _header(filename, desc, row["size_bytes"], snippet)
+    if snippet.kind == "empty":
+        return header + b"(empty file)\n"
+    if snippet.kind != "text":
+        return header + f"({snippet.kind}, no text preview)\n".encode()
+
+    lines = snippet.head.splitlines(keepends=True)
+    shown = lines[:max_lines] if max_lines else lines
+    if preview_cmd[0] == "cat":
+        # No bat: the stored lines are the preview
+        body = b"".join(shown)
+    elif highlighted is not None:
+        # Highlighted at add time; bat keeps one output line per input line
+        body = b"".join(highlighted.splitlines(keepends=True)[:len(shown)])
+    else:
+        body = highlight(preview_cmd, filename, b"".join(shown), width)
+    if snippet.truncated and len(shown) == len(lines):
+        body += f"[... first {len(lines)} lines shown]\n".encode()
+    return header + body
+
+def _header(filename: str, desc: str | None, size: int | None = None, snippet: Snippet | None = None) -> bytes:
+    # File info and description
+    info = ""
+    if snippet is not None:
+        info = f"Size: {human_size(size)} · {snippet.kind}"
+        if snippet.line_count is not None:
+            info += f" · {snippet.line_count:,} lines"
+        info += "\n"
+    return (
+        f"File: {filename}\n"
+        f"Description: {desc if desc else '(none)'}\n"
+        + info
+        + "-" * 60 + "\n"  # Separator line
+    ).encode()
+
+def highlight(preview_cmd: list[str], filename: str, data: bytes, width: int | None = None) -> bytes:
+    """
+    Run bat over a few lines of text fed on stdin and return its coloured output.
+    """
+    # Blobs have no extension, so tell bat the real name for syntax highlighting
+    cmd = list(preview_cmd) + ["--file-name", filename, "--wrap=never"]
+    if width:
+        cmd += ["--terminal-width", str(width)]
+    result = subprocess.run(cmd + ["-"], input=data, capture_output=True, check=False)
+    return result.stdout
+
 def main(argv: list[str]) -> int:
     # Ensure the correct number of arguments are provided
-    if len(argv) != 4:
+    if len(argv) not in (4, 5):
         return 1  # Return error code if arguments are missing
 
     # Parse command-line arguments
     db_path = Path(argv[1])      # Path to the metadata database
     vault_dir = Path(argv[2])    # Path to the vault directory
     filename = argv[3]           # Name of the file to preview
+    pack = None
+    if len(argv) == 5:           # Optional: a pack being browsed read-only (see core.pack)
+        from core.pack import Pack
+        pack = Pack(Path(argv[4]))
 
-    file_path = vault_dir / filename  # Full path to the file in the vault
-    desc = get_description(db_path, filename)  # Get file description from database
-
-    # Print file info and description
-    print(f"File: {filename}")
-    print(f"Description: {desc if desc else '(none)'}")
-    print("-" * 60)  # Separator line
-
-    # Check if the file exists and is a regular file
-    if not file_path.exists() or not file_path.is_file():
-        print("(file not found in vault)")
-        return 0  # Exit gracefully if file is missing
-
-    # Build the preview command and run it to display the file contents
-    cmd = pick_preview_cmd() + [str(file_path)]
-    subprocess.run(cmd, check=False)
+    meta = MetaStore(db_path) if db_path.exists() else None
+    try:
+        out = render(meta, vault_dir, filename, pick_preview_cmd(), pack=pack)
+    finally:
+        if meta is not None:
+            meta.close()
+        if pack is not None:
+            pack.close()
+    sys.stdout.buffer.write(out)
+    sys.stdout.flush()
     return 0  # Success
 
 if __name__ == "__main__":
     # Run the main function with command-line arguments and exit with its status code
-    raise SystemExit(main(sys.argv))
\ No newline at end of file
+    raise SystemExit(main(sys.argv))
@@ -0,0 +1,31 @@
+# Tiny fzf preview client: forwards one request to the preview server and prints the reply.
+# fzf runs it on every cursor move, so it must only use modules that load instantly
+# (it is started with "python -S" and without the locky packages on the path).
+import os
+import socket
+import sys
+
+
+def main(argv: list[str]) -> int:
+    if len(argv) != 3:
+        return 1
+    socket_path, filename = argv[1], argv[2]
+    cols = os.environ.get("FZF_PREVIEW_COLUMNS", "")
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+            sock.sendall(f"{cols}\t{filename}\n".encode())
+            out = sys.stdout.buffer
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                out.write(chunk)
+            out.flush()
+    except OSError as exc:
+        print(f"(preview unavailable: {exc})")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv))
@@ -0,0 +1,96 @@
+from __future__ import annotations
+import shutil
+import socketserver
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from core.metadata import MetaStore
+from core.preview import pick_preview_cmd, render
+
+# Previews kept in memory; enough to scroll back and forth through a long list
+CACHE_ENTRIES = 256
+# fzf only shows the top of a preview, so don't render more than this
+MAX_LINES = 1000
+
+
+class PreviewServer:
+    """
+    Serves fzf previews over a Unix socket for the length of one fzf session.
+    The metadata connection, the bat lookup and recently rendered previews stay warm,
+    so each cursor move costs one socket round trip instead of a new Python process.
+    """
+
+    def __init__(
+        self, db_path: Path, vault_dir: Path, cache_entries: int = CACHE_ENTRIES, pack_path: Path | None = None
+    ) -> None:
+        self.vault_dir = vault_dir
+        self.meta = MetaStore(db_path)
+        # Browsing a pack read-only: contents come from the mapped pack (see core.pack)
+        self.pack = None
+        if pack_path is not None:
+            from core.pack import Pack
+            self.pack = Pack(pack_path)
+        self.preview_cmd = pick_preview_cmd()
+        self.cache_entries = cache_entries
+        self._cache: OrderedDict[tuple, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+        self._dir = Path(tempfile.mkdtemp(prefix="locky-"))
+        self.socket_path = self._dir / "preview.sock"
+        self._server: socketserver.ThreadingUnixStreamServer | None = None
+        self._thread: threading.Thread | None = None
+
+    def preview(self, filename: str, width: int | None = None) -> bytes:
+        # Rendered preview for one file, from the LRU cache when the content hasn't changed
+        with self._lock:
+            entry = self.meta.get_entry(filename)
+        key = (filename, entry["digest"] if entry else None, entry["description"] if entry else None, width)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        out = render(self.meta, self.vault_dir, filename, self.preview_cmd, width, MAX_LINES, self.pack)
+        with self._lock:
+            self._cache[key] = out
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        return out
+
+    def start(self) -> PreviewServer:
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                # Request: "<columns>\t<filename>\n"; reply: the rendered preview, then close
+                line = self.rfile.readline().decode(errors="replace").rstrip("\n")
+                cols, _, filename = line.partition("\t")
+                try:
+                    out = server.preview(filename, int(cols) if cols.isdigit() else None)
+                except Exception as exc:
+                    out = f"(preview failed: {exc})\n".encode()
+                try:
+                    self.wfile.write(out)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # fzf moved on and killed the client
+
+        self._server = socketserver.ThreadingUnixStreamServer(str(self.socket_path), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        self.meta.close()
+        if self.pack is not None:
+            self.pack.close()
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def __enter__(self) -> PreviewServer:
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
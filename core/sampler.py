@@ -0,0 +1,160 @@
+from __future__ import annotations
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+from utils import trace
+
+# How much of a file is inspected to decide whether it is binary
+SNIFF_BYTES = 8192
+# Block size for streaming passes over whole files
+BLOCK_BYTES = 1 << 20
+# Marks where windows were stitched together in a spread sample
+GAP = "\n[...]\n"
+# Stored preview snippets hold at most this many lines, and never more than PREVIEW_BYTES
+PREVIEW_LINES = 200
+PREVIEW_BYTES = 32 * 1024
+
+# Leading bytes of common binary formats, for naming what a preview can't show
+MAGIC = (
+    (b"\x89PNG\r\n\x1a\n", "PNG image"),
+    (b"\xff\xd8\xff", "JPEG image"),
+    (b"GIF8", "GIF image"),
+    (b"%PDF", "PDF document"),
+    (b"PK\x03\x04", "ZIP archive"),
+    (b"\x1f\x8b", "gzip data"),
+    (b"\xfd7zXZ\x00", "xz data"),
+    (b"\x7fELF", "ELF executable"),
+    (b"SQLite format 3\x00", "SQLite database"),
+)
+
+# Bytes that show up in ordinary text: printable ASCII, whitespace, escape, and anything >= 0x80 (UTF-8)
+_TEXT_BYTES = bytes({7, 8, 9, 10, 12, 13, 27} | set(range(0x20, 0x7F)) | set(range(0x80, 0x100)))
+
+
+@dataclass
+class Sample:
+    # Decoded text of the sampled windows ("" for binary files)
+    text: str
+    # True when the first block looks like binary data
+    is_binary: bool
+    # Size of the whole file in bytes
+    size: int
+    # True when the sample does not cover the whole file
+    truncated: bool
+
+
+@dataclass
+class Snippet:
+    # The first lines of a file, as shown in the preview pane (b"" for binary files)
+    head: bytes
+    # "text", "empty", "binary" or a format name from MAGIC
+    kind: str
+    # Lines in the whole file, or None when only the head was read
+    line_count: int | None
+    # True when head does not cover the whole file
+    truncated: bool
+
+
+def human_size(size: int) -> str:
+    for unit in ("bytes", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size} {unit}" if unit == "bytes" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def sniff_kind(block: bytes) -> str:
+    """
+    Name what a file's first block looks like: a known binary format, other binary data, or text.
+    """
+    if not block:
+        return "empty"
+    for magic, kind in MAGIC:
+        if block.startswith(magic):
+            return kind
+    return "binary" if is_binary(block[:SNIFF_BYTES]) else "text"
+
+
+def read_snippet(f: BinaryIO, count_all: bool = False) -> Snippet:
+    """
+    The preview snippet of an open file: at most PREVIEW_LINES lines / PREVIEW_BYTES bytes.
+    With count_all the rest of the file is streamed too, to count its lines.
+    """
+    block = f.read(PREVIEW_BYTES)
+    if trace.ENABLED:
+        trace.add("bytes.read", len(block))
+    kind = sniff_kind(block)
+    if kind != "text":
+        return Snippet(b"", kind, None, bool(block))
+    lines = block.splitlines(keepends=True)
+    head = b"".join(lines[:PREVIEW_LINES])
+    more = f.read(1)
+    truncated = len(head) < len(block) or bool(more)
+    if not count_all:
+        return Snippet(head, kind, None if truncated else len(lines), truncated)
+    count = block.count(b"\n") + more.count(b"\n")
+    last = (more or block)[-1:]
+    for chunk in iter(lambda: f.read(BLOCK_BYTES), b""):
+        count += chunk.count(b"\n")
+        last = chunk[-1:]
+    return Snippet(head, kind, count if last == b"\n" else count + 1, truncated)
+
+
+def is_binary(block: bytes) -> bool:
+    """
+    Guess whether a block is binary: any NUL byte, or more than 30% non-text bytes.
+    """
+    if not block:
+        return False
+    if b"\0" in block:
+        return True
+    non_text = len(block.translate(None, _TEXT_BYTES))
+    return non_text / len(block) > 0.30
+
+
+def read_sample(path: Path, max_bytes: int = 16000, spread: bool = False) -> Sample:
+    """
+    Read at most max_bytes of a file without loading the rest of it.
+    With spread=True, files larger than max_bytes are sampled from the head, middle
+    and tail (a third each) so the sample is representative of the whole file.
+    Binary files are detected from the first block and return no text.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        spread = spread and size > max_bytes
+        third = max_bytes // 3
+        head = f.read(third if spread else max_bytes)
+        if trace.ENABLED:
+            trace.add("bytes.read", len(head))
+        if is_binary(head[:SNIFF_BYTES]):
+            return Sample("", True, size, size > len(head))
+        if not spread:
+            return Sample(head.decode(errors="ignore"), False, size, size > len(head))
+
+        windows = [head]
+        for offset in (size // 2 - third // 2, size - third):
+            f.seek(offset)
+            windows.append(f.read(third))
+            if trace.ENABLED:
+                trace.add("bytes.read", len(windows[-1]))
+    return Sample(GAP.join(w.decode(errors="ignore") for w in windows), False, size, True)
+
+
+def count_lines(path: Path) -> int:
+    """
+    Count lines by streaming newlines block by block, in constant memory.
+    A last line without a trailing newline still counts, like str.splitlines().
+    """
+    lines = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(BLOCK_BYTES)
+            if not block:
+                break
+            lines += block.count(b"\n")
+            last = block[-1:]
+        if trace.ENABLED:
+            trace.add("bytes.read", f.tell())
+    return lines if last == b"\n" else lines + 1
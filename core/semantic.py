@@ -0,0 +1,192 @@
+from __future__ import annotations
+import math
+import re
+import zlib
+from pathlib import Path
+from typing import Iterable
+
+from core.metadata import MetaStore
+
+# NumPy is optional and only loaded once an index is actually used (pip install locky[semantic])
+np = None
+
+# Width of the hashed feature space; each indexed file costs DIM * 4 bytes on disk
+DIM = 1024
+# Character n-gram sizes taken from every word, on top of the word itself
+NGRAMS = (3, 4, 5)
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _load_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return None
+        np = numpy
+    return np
+
+
+def available() -> bool:
+    return _load_numpy() is not None
+
+
+def features(text: str) -> dict[int, float]:
+    """
+    Hash a text's words and character n-grams into DIM buckets.
+    Returns bucket -> signed, sublinearly scaled term frequency.
+    """
+    counts: dict[int, float] = {}
+    for word in _WORD.findall(text.lower()):
+        grams = [word]
+        padded = f"<{word}>"
+        for n in NGRAMS:
+            grams.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+        for gram in grams:
+            # crc32 is stable across runs (unlike hash()); one bit picks the sign so
+            # colliding features tend to cancel rather than pile up
+            h = zlib.crc32(gram.encode())
+            bucket = h % DIM
+            counts[bucket] = counts.get(bucket, 0.0) + (1.0 if h & 0x80000000 else -1.0)
+    return {b: math.copysign(1.0 + math.log(abs(c)), c) for b, c in counts.items() if c}
+
+
+class SemanticIndex:
+    """
+    Hashed n-gram TF-IDF vectors of every file's name and description, kept as one
+    contiguous float32 matrix memory-mapped from <vault>/semantic/vectors.f32.
+    Row assignments live in the metadata store; freed rows are reused.
+    """
+
+    def __init__(self, vault_dir: Path, meta: MetaStore) -> None:
+        if _load_numpy() is None:
+            raise RuntimeError("semantic search needs numpy (pip install numpy)")
+        self.dir = vault_dir / "semantic"
+        self.meta = meta
+        self._matrix = None
+        self._df = None
+
+    def exists(self) -> bool:
+        return (self.dir / "vectors.f32").exists()
+
+    # --- storage ---------------------------------------------------------
+
+    def _open(self, min_rows: int = 0):
+        # Map the matrix, growing the file (doubling) when more rows are needed.
+        # Growing only appends zeros to the file, so existing rows are never copied.
+        path = self.dir / "vectors.f32"
+        if not path.exists():
+            self.dir.mkdir(parents=True, exist_ok=True)
+            path.touch()
+        rows = path.stat().st_size // (DIM * 4)
+        if self._matrix is None or rows < min_rows or self._matrix.shape[0] != rows:
+            if rows < min_rows:
+                rows = max(min_rows, rows * 2, 64)
+                with open(path, "r+b") as f:
+                    f.truncate(rows * DIM * 4)
+            self._matrix = np.memmap(path, dtype=np.float32, mode="r+", shape=(rows, DIM)) if rows else None
+        if self._df is None:
+            df_path = self.dir / "df.f32"
+            if not df_path.exists():
+                np.zeros(DIM, dtype=np.float32).tofile(df_path)
+            self._df = np.memmap(df_path, dtype=np.float32, mode="r+", shape=(DIM,))
+        return self._matrix
+
+    def flush(self) -> None:
+        if self._matrix is not None:
+            self._matrix.flush()
+        if self._df is not None:
+            self._df.flush()
+
+    # --- updates ---------------------------------------------------------
+
+    def update(self, entries: Iterable[tuple[str, str]]) -> None:
+        # (filename, text) pairs: (re)write each file's row and adjust document frequencies
+        for name, text in entries:
+            row, old = self.meta.assign_semantic_row(name)
+            matrix = self._open(row + 1)
+            if old:
+                self._df -= matrix[row] != 0
+            vec = np.zeros(DIM, dtype=np.float32)
+            for bucket, weight in features(text).items():
+                vec[bucket] = weight
+            norm = float(np.linalg.norm(vec))
+            matrix[row] = vec / norm if norm else vec
+            self._df += vec != 0
+        self.flush()
+
+    def remove(self, names: Iterable[str]) -> None:
+        # Zero out the rows of removed files and hand them back for reuse
+        if not self.exists():
+            return
+        for row in self.meta.release_semantic_rows(names):
+            matrix = self._open()
+            if matrix is not None and row < matrix.shape[0]:
+                self._df -= matrix[row] != 0
+                matrix[row] = 0.0
+        self.flush()
+
+    def rebuild(self) -> None:
+        # Index every file from scratch (first use, or after the index was deleted)
+        for name in ("vectors.f32", "df.f32"):
+            (self.dir / name).unlink(missing_ok=True)
+        self._matrix = self._df = None
+        self.meta.clear_semantic_rows()
+        self._open()
+        docs = [
+            (row["filename"], _doc_text(row["filename"], row["description"]))
+            for row in self.meta.list_with_metadata()
+        ]
+        self.update(docs)
+
+    # --- queries ---------------------------------------------------------
+
+    def query(self, text: str, k: int = 10) -> list[tuple[str, float]]:
+        """
+        Top-k files by cosine similarity, as (filename, score) pairs.
+        One matrix-vector product scores every row at once.
+        """
+        matrix = self._open()
+        n_docs = self.meta.semantic_row_count()
+        if matrix is None or n_docs == 0:
+            return []
+        q = np.zeros(DIM, dtype=np.float32)
+        for bucket, weight in features(text).items():
+            q[bucket] = weight
+        # idf applied on the query side weights rare n-grams up in the dot product
+        idf = np.log((1.0 + n_docs) / (1.0 + np.maximum(self._df, 0.0))) + 1.0
+        q *= idf * idf
+        scores = matrix @ q
+        k = min(k, scores.shape[0])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        names = self.meta.semantic_names([int(r) for r in top])
+        return [(names[int(r)], float(scores[r])) for r in top if int(r) in names and scores[r] > 0]
+
+
+def _doc_text(filename: str, description: str | None) -> str:
+    return f"{filename} {description or ''}"
+
+
+def _built(vault_dir: Path) -> bool:
+    # Indexes are built on first semantic search; until then add/remove skip them (and numpy)
+    return (vault_dir / "semantic" / "vectors.f32").exists() and available()
+
+
+def index_files(vault_dir: Path, meta: MetaStore, names: Iterable[str]) -> None:
+    """
+    Refresh the semantic rows of the given files, if a semantic index has been built.
+    """
+    if _built(vault_dir):
+        index = SemanticIndex(vault_dir, meta)
+        index.update((name, _doc_text(name, meta.get_description(name))) for name in names)
+
+
+def forget_files(vault_dir: Path, meta: MetaStore, names: Iterable[str]) -> None:
+    """
+    Drop removed files from the semantic index, if one has been built.
+    """
+    if _built(vault_dir):
+        SemanticIndex(vault_dir, meta).remove(names)
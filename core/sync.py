@@ -0,0 +1,238 @@
+from __future__ import annotations
+import filecmp
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from config import Config
+from core.chunks import CHUNKED
+from core.compression import open_blob
+from core.metadata import MetaStore
+from utils import trace
+from utils.delta import delta_copy
+from utils.file_utils import CopyStats, copy_file, ensure_dir
+
+# Files at least this big are rebuilt from their old version on the mirror (rsync-style
+# block deltas) instead of being copied whole
+DELTA_MIN = 1 << 20
+# Paths a sync will delete once the new mirror database is in place; a run interrupted
+# after the swap finishes them first thing next time
+PENDING_DELETES = ".locky-sync-pending"
+
+
+@dataclass
+class SyncReport:
+    # files copied whole, and files rebuilt from an older version already on the mirror
+    copied: int = 0
+    patched: int = 0
+    # blobs that only changed place (after `locky migrate --fanout`) and were renamed on the mirror
+    moved: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+    # entries whose file vanished from the vault while syncing
+    missing: list[str] = field(default_factory=list)
+    # size of everything written to the mirror, and how much of it had to be read from the vault
+    bytes_total: int = 0
+    bytes_sent: int = 0
+    copy_stats: CopyStats = field(default_factory=CopyStats)
+
+
+def sync_vault(
+    cfg: Config, meta: MetaStore, target: Path, verify: bool = False, delta_min: int = DELTA_MIN
+) -> SyncReport:
+    """
+    Make target a mirror of the vault: blobs, flat pre-blob-store files and the metadata database,
+    laid out exactly as in the vault (so target can itself be opened as a vault).
+
+    The mirror's own copy of the database records what was sent last time, so only entries that
+    changed since then are looked at; with verify, every file on the mirror is read back and
+    checked against its digest instead, and whatever does not match is sent again.
+    Each file lands with an atomic rename and the database goes last, so an interrupted sync
+    is resumed by running it again: finished files are kept and a half-written large file is
+    reused as the starting point for the retry.
+    """
+    target = target.expanduser().resolve()
+    vault_dir = cfg.vault_dir.resolve()
+    if target == vault_dir or vault_dir in target.parents:
+        raise ValueError("the mirror must be outside the vault directory")
+    ensure_dir(target)
+    report = SyncReport()
+    gone = _finish_deletes(target, report)
+
+    with tempfile.TemporaryDirectory(prefix="locky-sync-") as tmp:
+        # Sync from a snapshot, so entries added or removed meanwhile don't tear the mirror
+        snapshot = Path(tmp) / cfg.db_path.name
+        with trace.span("sync.snapshot"):
+            meta.backup_to(snapshot)
+            with MetaStore(snapshot) as snap:
+                wanted = snap.mirror_entries()
+        mirror_db = target / cfg.db_path.name
+        previous = _mirrored_entries(mirror_db)
+
+        # What the mirror held after the last sync (minus anything deleted since); a chunk can
+        # have the same digest as a whole blob, so the top directory is part of the key
+        old_paths = {_key(r): r["path"] for r in previous if r["digest"] and r["path"] not in gone}
+        old_by_name = {r["filename"]: r["path"] for r in previous if r["digest"] and r["filename"]}
+        old_legacy = {r["filename"] for r in previous if r["digest"] is None}
+
+        with trace.span("sync.blobs"):
+            new_paths: set[str] = set()
+            for row in wanted:
+                digest, relpath = row["digest"], row["path"]
+                if digest is None or relpath is None or relpath in new_paths:
+                    continue
+                new_paths.add(relpath)
+                src, dst = cfg.vault_dir / relpath, target / relpath
+                old = old_paths.get(_key(row))
+                if old == relpath and not verify:
+                    report.unchanged += 1
+                elif old is not None and old != relpath and (target / old).is_file() and (
+                    not verify or _holds(target / old, src, row)
+                ):
+                    ensure_dir(dst.parent)
+                    os.replace(target / old, dst)
+                    report.moved += 1
+                elif _same_size(dst, row["stored_bytes"]) and (not verify or _holds(dst, src, row)):
+                    report.unchanged += 1  # blobs never change, so the right size means done
+                else:
+                    # A name that used to hold other contents: its old blob is a likely basis
+                    basis = old_by_name.get(row["filename"]) if row["filename"] else None
+                    if not _send(src, dst, target / basis if basis else None, delta_min, report):
+                        report.missing.append(row["filename"])
+
+        with trace.span("sync.legacy"):
+            new_legacy = set()
+            for row in wanted:
+                if row["digest"] is not None:
+                    continue
+                name = row["filename"]
+                new_legacy.add(name)
+                src, dst = cfg.vault_dir / name, target / name
+                if _same_file(src, dst) and (not verify or filecmp.cmp(src, dst, shallow=False)):
+                    report.unchanged += 1
+                elif not _send(src, dst, dst, delta_min, report):
+                    report.missing.append(name)
+
+        # Record what to delete before the database stops mentioning it
+        doomed = sorted(
+            {p for p in old_paths.values() if p not in new_paths}
+            | {name for name in old_legacy if name not in new_legacy}
+        )
+        if doomed:
+            _write_pending(target, doomed)
+        with trace.span("sync.database"):
+            # A stale WAL next to the new database would be replayed into it
+            for suffix in ("-wal", "-shm"):
+                Path(f"{mirror_db}{suffix}").unlink(missing_ok=True)
+            _send(snapshot, mirror_db, mirror_db, delta_min, report)
+    _finish_deletes(target, report)
+    return report
+
+
+def _key(row: sqlite3.Row) -> tuple[str, str]:
+    return row["digest"], (row["path"] or "").split("/", 1)[0]
+
+
+def _mirrored_entries(mirror_db: Path) -> list[sqlite3.Row]:
+    # What the mirror's database says it holds; nothing if there is no (readable) mirror yet
+    if not mirror_db.is_file():
+        return []
+    try:
+        with MetaStore(mirror_db) as mirror:
+            return mirror.mirror_entries()
+    except sqlite3.DatabaseError:
+        return []
+
+
+def _same_size(path: Path, size: int | None) -> bool:
+    try:
+        return size is not None and path.stat().st_size == size
+    except OSError:
+        return False
+
+
+def _holds(path: Path, src: Path, row: sqlite3.Row) -> bool:
+    # Whether a mirror file really has the blob's contents. A chunk manifest must match the
+    # vault's byte for byte; the chunks it lists are checked as entries of their own
+    try:
+        if row["codec"] == CHUNKED:
+            return path.read_bytes() == src.read_bytes()
+        h = hashlib.sha256()
+        with open_blob(path, row["codec"]) as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    except (OSError, EOFError, ValueError):
+        # Gone, or a compressed stream too mangled to decode
+        return False
+    return h.hexdigest() == row["digest"]
+
+
+def _same_file(src: Path, dst: Path) -> bool:
+    # Flat files can change in place; size plus mtime (kept by every copy) tells
+    try:
+        a, b = src.stat(), dst.stat()
+    except OSError:
+        return False
+    return a.st_size == b.st_size and a.st_mtime_ns == b.st_mtime_ns
+
+
+def _send(src: Path, dst: Path, basis: Path | None, delta_min: int, report: SyncReport) -> bool:
+    """
+    Put src's contents at dst via dst.part and an atomic rename. Large files are rebuilt from
+    basis when there is one; a .part left by an interrupted run is kept as .resume and used
+    as the basis instead, so only what it is missing gets read again.
+    """
+    part = dst.with_name(dst.name + ".part")
+    resume = dst.with_name(dst.name + ".resume")
+    try:
+        size = src.stat().st_size
+    except FileNotFoundError:
+        return False
+    ensure_dir(dst.parent)
+    if part.exists():
+        os.replace(part, resume)
+    if resume.exists():
+        basis = resume
+    with trace.span("sync.send", file=dst.name, bytes=size):
+        if basis is not None and size >= delta_min and basis.is_file():
+            sent = delta_copy(src, basis, part)
+            shutil.copystat(src, part)
+            report.patched += 1
+        else:
+            copy_file(src, part, report.copy_stats)
+            sent = size
+            report.copied += 1
+        with open(part, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(part, dst)
+        resume.unlink(missing_ok=True)
+    report.bytes_total += size
+    report.bytes_sent += sent
+    if trace.ENABLED:
+        trace.add("bytes.sent", sent)
+    return True
+
+
+def _write_pending(target: Path, paths: list[str]) -> None:
+    tmp = target / (PENDING_DELETES + ".tmp")
+    tmp.write_text("\n".join(paths) + "\n", encoding="utf-8")
+    os.replace(tmp, target / PENDING_DELETES)
+
+
+def _finish_deletes(target: Path, report: SyncReport) -> set[str]:
+    # Carry out a recorded deletion list; returns the paths it covered
+    pending = target / PENDING_DELETES
+    if not pending.is_file():
+        return set()
+    paths = set(pending.read_text(encoding="utf-8").split("\n")) - {""}
+    for relpath in paths:
+        path = target / relpath
+        if path.exists():
+            path.unlink()
+            report.deleted += 1
+    pending.unlink()
+    return paths
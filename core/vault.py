@@ -1,7 +1,122 @@
-from pathlib import Path
+from __future__ import annotations
+import errno
+import glob
+import os
+import shutil
+import sqlite3
+import stat
+import time
+from collections import Counter
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from pathlib import Path, PurePosixPath
+from typing import TYPE_CHECKING, BinaryIO, Callable, Iterable, Iterator
 from config import Config
+from core.blobs import DEFAULT_FANOUT, MANIFEST_SUFFIX, MAX_FANOUT, BlobStore, entry_path
+from core.chunks import CHUNKED, VERSIONED_MIN, chunk_relpath, read_manifest
+from core.compression import CODECS, COMPRESSION_MODES, choose_codec, open_blob
 from core.metadata import MetaStore
-from utils.file_utils import ensure_dir, prompt_yes_no, copy_file
+from core.sampler import Snippet, read_sample, read_snippet
+from core.semantic import forget_files
+from utils import trace
+from utils.file_utils import CopyStats, ensure_dir, prompt_yes_no, copy_file, hash_file, iter_files
+from utils.locks import entry_locks
+
+if TYPE_CHECKING:
+    from core.pack import Pack
+
+# What to do when an added file's name is already taken in the vault
+CONFLICT_POLICIES = ("ask", "skip", "overwrite", "rename")
+# How paste_files puts a vault file at its destination: an independent copy,
+# a hard link to the blob, or a symlink to it (both links are for read-only use)
+PASTE_MODES = ("copy", "link", "symlink")
+# What paste does when a destination file already exists ("newer": only replace files older
+# than the vault entry's source file; "ask": one question for the whole batch)
+PASTE_POLICIES = ("ask", "skip", "overwrite", "rename", "newer")
+# Written into the destination by every paste: which vault entry went to which file
+PASTE_MANIFEST = ".locky-paste.json"
+# How much of each file's text goes into the full-text search index
+SEARCH_SAMPLE_BYTES = 4096
+
+@dataclass
+class StoredFile:
+    # Everything a worker learned about one file while putting it in the blob store
+    src: Path
+    name: str
+    size: int
+    digest: str
+    # copy strategy used to write the blob, None when identical content was already stored
+    strategy: str | None
+    sample: str = ""
+    # the source's modification time, whole seconds
+    mtime: int | None = None
+    # set when this call wrote the blob compressed: the codec and the blob's size on disk
+    codec: str | None = None
+    stored_size: int = 0
+    # where the freshly written blob lives, relative to the vault directory
+    path: str | None = None
+    # for a blob stored as chunks: the (chunk digest, size) list, and how many bytes of it were new
+    chunks: list[tuple[str, int]] | None = None
+    chunk_bytes: int = 0
+    # preview snippet for a freshly written blob, and its bat-highlighted form if asked for
+    preview: Snippet | None = None
+    highlighted: bytes | None = None
+
+@dataclass
+class AddReport:
+    # (vault name, source path) for every file that was stored
+    added: list[tuple[str, Path]] = field(default_factory=list)
+    # names left alone because of the conflict policy
+    skipped: list[str] = field(default_factory=list)
+    # (vault name, error) for files that could not be read, e.g. deleted or unreadable mid-walk
+    failed: list[tuple[str, str]] = field(default_factory=list)
+    # files whose contents were already in the blob store, so nothing was copied
+    deduplicated: int = 0
+    bytes_copied: int = 0
+    # what the newly written blobs take up on disk (less than bytes_copied when compressed)
+    bytes_stored: int = 0
+    bytes_total: int = 0
+    elapsed: float = 0.0
+    # which copy strategies (reflink, copy_file_range, ...) did the work, and how fast
+    copy_stats: CopyStats = field(default_factory=CopyStats)
+
+@dataclass
+class PasteJob:
+    # One planned paste: the vault entry, where its contents are (None for a pack) and where it goes
+    name: str
+    entry: sqlite3.Row
+    src: Path | None
+    dst: Path
+    # "new", "overwrite", "rename", "skip", or "conflict" until an "ask" is answered
+    action: str
+
+@dataclass
+class PasteReport:
+    # (vault name, destination path) for every file pasted
+    pasted: list[tuple[str, Path]] = field(default_factory=list)
+    # names whose destination already existed, whatever the policy did about it
+    conflicts: list[str] = field(default_factory=list)
+    # names left alone because of the conflict policy
+    skipped: list[str] = field(default_factory=list)
+    renamed: int = 0
+    # names not in the vault, or whose contents are gone
+    missing: list[str] = field(default_factory=list)
+    # (name, error) for copies that failed
+    failed: list[tuple[str, str]] = field(default_factory=list)
+    manifest: Path | None = None
+    elapsed: float = 0.0
+    copy_stats: CopyStats = field(default_factory=CopyStats)
+
+@dataclass
+class MigrateReport:
+    # flat pre-blob-store files moved into the blob store
+    converted: int = 0
+    # blobs moved to the current fan-out
+    moved: int = 0
+    # flat files left behind by an interrupted run, removed now that their blob is recorded
+    leftovers: int = 0
+    # legacy entries whose flat file was already gone
+    missing: list[str] = field(default_factory=list)
 
 def init_vault(cfg: Config) -> MetaStore:
     """
@@ -10,72 +125,765 @@ def init_vault(cfg: Config) -> MetaStore:
     ensure_dir(cfg.vault_dir)
     return MetaStore(cfg.db_path)
 
-def add_file(cfg: Config, meta: MetaStore, src: Path) -> None:
+def vault_path(cfg: Config, meta: MetaStore, name: str) -> Path | None:
+    """
+    Resolve a vault entry to the file on disk that holds its contents.
+    """
+    return entry_path(cfg.vault_dir, meta.get_entry(name))
+
+def blob_store(cfg: Config, meta: MetaStore) -> BlobStore:
     """
-    Copy a file into the vault and update metadata.
+    The blob store, laid out with the vault's current fan-out (changed by `locky migrate`).
     """
+    return BlobStore(cfg.vault_dir, int(meta.get_setting("fanout", str(DEFAULT_FANOUT))))
 
-    #checks if the source really exists, or if this path is a regular file 
-    # if not return this as error and turn into string source  
+def add_file(cfg: Config, meta: MetaStore, src: Path) -> str | None:
+    """
+    Store a file's contents in the blob store and point its name at them.
+    Returns the vault name, or None if the user chose not to overwrite.
+    """
+
+    #checks if the source really exists, or if this path is a regular file
+    # if not return this as error and turn into string source
     if not src.exists() or not src.is_file():
         raise FileNotFoundError(str(src))
 
+    name = src.name
+    digest = hash_file(src)
+    # Another `locky add` of the same name waits until this one is done, so each sees what
+    # the other stored (and the overwrite question is about the real current contents)
+    with entry_locks(cfg.vault_dir, "names").hold(name):
+        # Overwriting keeps the old contents as a version (see `locky history`)
+        current = meta.get_digest(name)
+        if current == digest:
+            # Same name, same bytes: nothing to copy, just refresh the metadata
+            st = src.stat()
+            meta.upsert(name, st.st_size, digest, int(st.st_mtime))
+            return name
+        if _name_taken(cfg, meta, name):
+            #if the name is taken we get prompted to yes or no
+            overwrite = prompt_yes_no(f"File{name} already exisits in vault.Overwrite ?")
+            #if the person chooses not to overwrite it we just return
+            if not overwrite:
+                return None
 
-    dst = cfg.vault_dir/ src.name
-    overwrite = True
-    if dst.exists():
-        #if the destination exists we get prompted to yes or no
-        overwrite = prompt_yes_no(f"File{src.name} already exisits in vault.Overwrite ?")
-        #if the person chooses not to overwrite it we just return
-        if not overwrite:
-            return 
-    
-    #this will copy the file and update the metadata that we have 
-    copy_file(src,dst)
-    meta.upsert(dst.name,dst.stat().st_size)
+        #only copy when no other entry already stored identical content
+        blobs = blob_store(cfg, meta)
+        stored = _store_blob(
+            blobs, src, name, digest,
+            compression=cfg.compression, highlight_cmd=_highlight_cmd(cfg), chunked=current is not None,
+        )
+        legacy = _legacy_file(cfg, meta, name)
+        _commit(meta, blobs, [stored])
 
+        # The old flat copy of a legacy entry is replaced by the blob
+        if legacy is not None:
+            legacy.unlink(missing_ok=True)
+        if current is not None:
+            _chunk_history(cfg, meta, [name])
+    _collect_garbage(cfg, meta)
+    return name
 
 
-def paste_files(cfg: Config, filenames: list[str], cwd: Path) -> list[str]:
+def iter_sources(args: Iterable[str]) -> Iterator[tuple[Path, str]]:
     """
-    Copy selected vault files into cwd.
+    Expand files, directories and glob patterns into (source path, vault name) pairs, lazily.
+    Files inside a directory keep their path relative to the directory's parent, e.g. "proj/src/a.py".
     """
-    #create a list of string
-    pasted = []
-    #loop through filenames list which im geussing it our list
-    for name in filenames:
-        #tries copying the files from the vault to the cwd
-        src = cfg.vault_dir / name
-        #if does not exist check and moves to next one 
-        if not src.exists() or not src.is_file():
+    for arg in args:
+        if glob.has_magic(arg):
+            matches = (Path(m) for m in glob.iglob(arg, recursive=True))
+        else:
+            matches = iter([Path(arg)])
+        for match in matches:
+            if match.is_dir():
+                # Names come from the paths as walked, so a symlink in the tree is stored under
+                # its own name wherever it points; only reading the file follows it
+                root = Path(os.path.abspath(match)).name
+                for f in iter_files(match):
+                    yield f, (Path(root) / f.relative_to(match)).as_posix()
+            else:
+                yield match, match.name
+
+
+def add_many(
+    cfg: Config,
+    meta: MetaStore,
+    sources: Iterable[tuple[Path, str]],
+    policy: str = "skip",
+    workers: int = 8,
+    batch_size: int = 500,
+    on_progress: Callable[[int], None] | None = None,
+    compression: str | None = None,
+) -> AddReport:
+    """
+    Add a stream of (source path, vault name) pairs. Hashing and copying run on a bounded
+    thread pool; metadata rows are committed in batches of batch_size.
+    compression overrides cfg.compression (see core.compression.COMPRESSION_MODES).
+    """
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    if policy not in CONFLICT_POLICIES:
+        raise ValueError(f"unknown conflict policy: {policy}")
+    compression = compression or cfg.compression
+    if compression not in COMPRESSION_MODES:
+        raise ValueError(f"unknown compression mode: {compression}")
+    report = AddReport()
+    started = time.perf_counter()
+    blobs = blob_store(cfg, meta)
+    highlight_cmd = _highlight_cmd(cfg)
+    claimed: set[str] = set()  # names handed out in this run
+    pending: dict = {}  # in-flight copies: future -> vault name
+    batch: list[StoredFile] = []
+    superseded: dict[str, Path] = {}  # flat files of overwritten legacy entries, by name
+    versioned: set[str] = set()  # overwritten names whose old contents become a version
+    # Each name is held from its conflict check until its row is committed, so another
+    # `locky add` of the same name sees what this one stored (see add_file)
+    names = entry_locks(cfg.vault_dir, "names")
+    held: dict[str, ExitStack] = {}
+    flying: Counter[str] = Counter()  # names with a copy still in flight
+
+    def take(name: str) -> None:
+        # Hold name. Waiting for it while holding others could deadlock two processes that
+        # want each other's names, so when it is busy everything so far is committed first
+        if name in held:
+            return
+        hold = ExitStack()
+        try:
+            hold.enter_context(names.hold(name, wait=False))
+        except BlockingIOError:
+            drain(0)
+            commit()
+            hold.enter_context(names.hold(name))
+        held[name] = hold
+
+    def release(name: str) -> None:
+        if name not in claimed and name in held:
+            held.pop(name).close()
+
+    def commit() -> None:
+        # Commit the stored batch and let go of its names once their old contents are settled
+        if not batch:
+            return
+        _commit(meta, blobs, batch)
+        done = [s.name for s in batch]
+        batch.clear()
+        # Flat copies of overwritten pre-blob-store entries are now superseded by blobs
+        for name in done:
+            legacy = superseded.pop(name, None)
+            if legacy is not None:
+                legacy.unlink(missing_ok=True)
+        _chunk_history(cfg, meta, [name for name in done if name in versioned])
+        versioned.difference_update(done)
+        for name in done:
+            if name in held and not flying[name]:
+                held.pop(name).close()
+
+    def drain(block_until: int) -> None:
+        # Collect finished copies until at most block_until are still in flight
+        while len(pending) > block_until:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name = pending.pop(fut)
+                flying[name] -= 1
+                try:
+                    stored = fut.result()
+                except OSError as e:
+                    # One unreadable file must not sink the rest of the batch
+                    report.failed.append((name, str(e)))
+                    if name in held and not flying[name] and all(s.name != name for s in batch):
+                        held.pop(name).close()
+                    continue
+                batch.append(stored)
+                report.added.append((stored.name, stored.src))
+                report.bytes_total += stored.size
+                if stored.strategy is not None:
+                    report.bytes_copied += stored.size
+                    report.bytes_stored += stored.stored_size + stored.chunk_bytes
+                else:
+                    report.deduplicated += 1
+                if on_progress is not None:
+                    on_progress(len(report.added))
+        if len(batch) >= batch_size:
+            commit()
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for src, name in sources:
+                if not src.is_file():
+                    continue
+                keep_old = False
+                take(name)
+                if name in claimed or _name_taken(cfg, meta, name):
+                    if policy == "rename":
+                        asked = name
+                        release(asked)
+                        name = _free_name(cfg, meta, asked, claimed)
+                        take(name)
+                        # Another process may have stored the free name while we waited for it
+                        while _name_taken(cfg, meta, name):
+                            release(name)
+                            name = _free_name(cfg, meta, asked, claimed)
+                            take(name)
+                    elif policy == "skip" or (
+                        policy == "ask"
+                        and not prompt_yes_no(f"File{name} already exisits in vault.Overwrite ?")
+                    ):
+                        report.skipped.append(name)
+                        release(name)
+                        continue
+                    legacy = _legacy_file(cfg, meta, name)
+                    if legacy is not None:
+                        superseded[name] = legacy
+                    elif meta.get_digest(name) is not None:
+                        versioned.add(name)
+                        keep_old = True
+                claimed.add(name)
+                flying[name] += 1
+                pending[pool.submit(
+                    _store_blob, blobs, src, name, None, report.copy_stats, compression, highlight_cmd,
+                    keep_old,
+                )] = name
+                # Keep a bounded number of files in flight so huge trees stream through
+                drain(workers * 2)
+            drain(0)
+        commit()
+    finally:
+        for hold in held.values():
+            hold.close()
+    _collect_garbage(cfg, meta)
+    report.elapsed = time.perf_counter() - started
+    return report
+
+
+def _store_blob(
+    blobs: BlobStore,
+    src: Path,
+    name: str,
+    digest: str | None = None,
+    stats: CopyStats | None = None,
+    compression: str = "off",
+    highlight_cmd: list[str] | None = None,
+    chunked: bool = False,
+) -> StoredFile:
+    # Worker: hash a file and copy (or compress) it into the blob store unless the content is already there.
+    # A new version of a large file (chunked) is stored as chunks, sharing most of them with the old one.
+    if digest is None:
+        with trace.span("add.hash", file=name):
+            digest = hash_file(src)
+    st = src.stat()
+    size = st.st_size
+    chunked = chunked and size >= VERSIONED_MIN
+    fresh = None
+    with trace.span("add.copy", file=name, bytes=size):
+        if chunked:
+            fresh = blobs.put_chunked(src, digest, stats)
+            strategy = None if fresh is None else CHUNKED
+        else:
+            strategy = blobs.put(src, digest, stats, choose_codec(src, size, compression))
+    with trace.span("add.sample", file=name):
+        sample = _search_sample(src)
+    stored = StoredFile(src, name, size, digest, strategy, sample, int(st.st_mtime))
+    if strategy is not None:
+        stored.codec = strategy if strategy in CODECS or strategy == CHUNKED else None
+        stored.stored_size = blobs.path(digest, stored.codec).stat().st_size
+        stored.path = blobs.relpath(digest, stored.codec)
+        if fresh is not None:
+            stored.chunks = read_manifest(blobs.path(digest, CHUNKED))[1]
+            stored.chunk_bytes = fresh
+        with trace.span("add.preview", file=name):
+            stored.preview, stored.highlighted = _preview_snippet(src, name, highlight_cmd)
+    return stored
+
+
+def _preview_snippet(src: Path, name: str, highlight_cmd: list[str] | None) -> tuple[Snippet, bytes | None]:
+    # What the preview pane will show for this content, worked out once at add time
+    with open(src, "rb") as f:
+        snippet = read_snippet(f, count_all=True)
+    highlighted = None
+    if highlight_cmd is not None and snippet.kind == "text":
+        from core.preview import highlight
+        highlighted = highlight(highlight_cmd, name, snippet.head)
+    return snippet, highlighted
+
+
+def _highlight_cmd(cfg: Config) -> list[str] | None:
+    # bat, when highlighted previews are wanted and it is installed
+    if not cfg.preview_highlight:
+        return None
+    from core.preview import pick_preview_cmd
+    cmd = pick_preview_cmd()
+    return None if cmd[0] == "cat" else cmd
+
+
+def _commit(meta: MetaStore, blobs: BlobStore, batch: list[StoredFile]) -> None:
+    # Write one batch of stored files to the metadata store
+    with trace.span("add.commit", rows=len(batch)):
+        meta.upsert_many(
+            ((s.name, s.size, s.digest, s.mtime) for s in batch),
+            [(s.digest, s.size, s.path, s.codec, s.stored_size) for s in batch if s.path is not None],
+            [(s.digest, s.chunks) for s in batch if s.chunks is not None],
+        )
+        meta.set_search_samples((s.name, s.sample) for s in batch if s.sample)
+        _save_previews(meta, batch)
+    _heal(meta, blobs, batch)
+
+
+def _heal(meta: MetaStore, blobs: BlobStore, batch: list[StoredFile]) -> None:
+    # Content this batch found already stored (or wrote) may have lost its last other reference
+    # in another process, whose garbage collection then deleted it before our commit. Collection
+    # deletes files inside the transaction that drops their rows, so now that our rows are in,
+    # the disk tells for sure; whatever went missing is stored again from its source.
+    rows = meta.get_blobs({s.digest for s in batch})
+    redo: dict[str, StoredFile] = {}
+    for s in batch:
+        if s.digest not in redo and not blobs.intact(rows.get(s.digest)):
+            redo[s.digest] = s
+    if not redo:
+        return
+    with trace.span("add.heal", rows=len(redo)):
+        again = []
+        for digest, s in redo.items():
+            with blobs.lock(digest):
+                # Clear out whatever is left of the old copy so the blob is written whole
+                blobs.delete(digest)
+                blobs.delete(digest, blobs.relpath(digest, CHUNKED))
+                again.append(_store_blob(blobs, s.src, s.name, digest, chunked=s.codec == CHUNKED))
+        meta.upsert_many(
+            [],
+            [(s.digest, s.size, s.path, s.codec, s.stored_size) for s in again if s.path is not None],
+            [(s.digest, s.chunks) for s in again if s.chunks is not None],
+        )
+
+
+def _chunk_history(cfg: Config, meta: MetaStore, names: list[str]) -> None:
+    # The version an overwrite just kept goes to chunks too when the new contents did, so the
+    # two share everything they have in common (older versions were chunked when they were kept)
+    blobs = blob_store(cfg, meta)
+    for name in names:
+        entry, past = meta.get_entry(name), meta.versions(name)
+        if entry is None or entry["codec"] != CHUNKED or not past:
+            continue
+        old = past[-1]
+        if old["codec"] == CHUNKED or old["path"] is None or old["size_bytes"] < VERSIONED_MIN:
+            continue
+        with trace.span("add.rechunk", file=name, bytes=old["size_bytes"]), blobs.lock(old["digest"]):
+            try:
+                relpath, stored_bytes, pieces = blobs.rechunk(old["digest"], old["path"], old["codec"])
+            except FileNotFoundError:
+                continue  # another process removed the name (and its history) meanwhile
+            if not meta.set_chunked(old["digest"], relpath, stored_bytes, pieces):
+                (cfg.vault_dir / relpath).unlink(missing_ok=True)
+                continue
+            # Chunks found already stored may have been collected by another process before our
+            # rows went in (as in _heal); the old file is still here to write them again from
+            row = meta.get_blobs([old["digest"]]).get(old["digest"])
+            if row is not None and not blobs.intact(row):
+                blobs.rechunk(old["digest"], old["path"], old["codec"])
+        (cfg.vault_dir / old["path"]).unlink(missing_ok=True)
+
+
+def _save_previews(meta: MetaStore, batch: list[StoredFile]) -> None:
+    meta.set_previews(
+        (s.digest, s.preview.head, s.preview.kind, s.preview.line_count, s.preview.truncated, s.highlighted)
+        for s in batch if s.preview is not None
+    )
+
+
+def _search_sample(src: Path) -> str:
+    # The first few KB of text, for full-text search; binary files get no sample
+    return read_sample(src, SEARCH_SAMPLE_BYTES).text
+
+
+def _name_taken(cfg: Config, meta: MetaStore, name: str) -> bool:
+    return meta.get_entry(name) is not None
+
+
+def _legacy_file(cfg: Config, meta: MetaStore, name: str) -> Path | None:
+    # Entries added before the blob store existed have no digest and live flat in the vault directory
+    entry = meta.get_entry(name)
+    if entry is None or entry["digest"] is not None:
+        return None
+    legacy = cfg.vault_dir / name
+    return legacy if legacy.is_file() else None
+
+
+def _free_name(cfg: Config, meta: MetaStore, name: str, claimed: set[str]) -> str:
+    # "notes.txt" -> "notes (1).txt", "notes (2).txt", ... until one is unused
+    path = PurePosixPath(name)
+    n = 1
+    while True:
+        candidate = str(path.with_name(f"{path.stem} ({n}){path.suffix}"))
+        if candidate not in claimed and not _name_taken(cfg, meta, candidate):
+            return candidate
+        n += 1
+
+
+def paste_files(
+    cfg: Config,
+    meta: MetaStore,
+    filenames: list[str],
+    cwd: Path,
+    mode: str = "copy",
+    stats: CopyStats | None = None,
+    pack: Pack | None = None,
+) -> list[str]:
+    """
+    Copy (or link, see PASTE_MODES) selected vault files into cwd, asking once before
+    overwriting files already there. Returns the names pasted; see paste_many for the rest.
+    With pack (see core.pack.open_pack), meta is the pack's metadata and the contents are
+    copied straight out of the memory-mapped pack instead of the vault.
+    """
+    report = paste_many(cfg, meta, filenames, cwd, mode, "ask", workers=1, pack=pack, manifest=False, stats=stats)
+    return [name for name, _ in report.pasted]
+
+
+def paste_many(
+    cfg: Config,
+    meta: MetaStore,
+    filenames: Iterable[str],
+    dest: Path,
+    mode: str = "copy",
+    policy: str = "skip",
+    workers: int = 8,
+    pack: Pack | None = None,
+    manifest: bool = True,
+    stats: CopyStats | None = None,
+) -> PasteReport:
+    """
+    Paste a batch of vault files into dest, keeping their relative paths ("proj/src/a.py").
+    The whole batch is planned first (one stat per destination), files already at dest are
+    handled by policy (see PASTE_POLICIES; "ask" asks once for all of them), then the copies
+    run on a pool of workers. With manifest, dest/.locky-paste.json records what went where.
+    Copy strategies are tallied in stats (or the report's own CopyStats).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if mode not in PASTE_MODES:
+        raise ValueError(f"unknown paste mode: {mode}")
+    if policy not in PASTE_POLICIES:
+        raise ValueError(f"unknown conflict policy: {policy}")
+    started = time.perf_counter()
+    with trace.span("paste.plan"):
+        jobs, report = plan_paste(cfg, meta, filenames, dest, policy, pack)
+    if stats is not None:
+        report.copy_stats = stats
+    if policy == "ask" and report.conflicts:
+        listed = ", ".join(report.conflicts[:5]) + (", ..." if len(report.conflicts) > 5 else "")
+        overwrite = prompt_yes_no(f"{len(report.conflicts)} file(s) already exist in {dest} ({listed}).Overwrite?")
+        for job in jobs:
+            if job.action == "conflict":
+                job.action = "overwrite" if overwrite else "skip"
+    report.skipped.extend(job.name for job in jobs if job.action == "skip")
+    jobs = [job for job in jobs if job.action != "skip"]
+
+    def place(job: PasteJob) -> tuple[PasteJob, str | None]:
+        # Worker: put one file at its destination; errors are reported, not raised
+        try:
+            with trace.span("paste.place", file=job.name, mode=mode):
+                if pack is not None:
+                    with pack.open_entry(job.entry) as fin:
+                        place_stream(fin, job.dst, report.copy_stats)
+                else:
+                    place_file(job.src, job.dst, mode, report.copy_stats, job.entry["codec"])
+        except OSError as exc:
+            return job, str(exc)
+        return job, None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for job, error in pool.map(place, jobs):
+            if error is None:
+                report.pasted.append((job.name, job.dst))
+                if job.action == "rename":
+                    report.renamed += 1
+            else:
+                report.failed.append((job.name, error))
+    if manifest and report.pasted:
+        report.manifest = _write_paste_manifest(dest, jobs, report, pack.path if pack else cfg.vault_dir)
+    report.elapsed = time.perf_counter() - started
+    return report
+
+
+def plan_paste(
+    cfg: Config,
+    meta: MetaStore,
+    filenames: Iterable[str],
+    dest: Path,
+    policy: str = "skip",
+    pack: Pack | None = None,
+) -> tuple[list[PasteJob], PasteReport]:
+    """
+    Work out where each file goes and what happens to files already there, without copying
+    anything. Jobs whose destination exists get policy's action ("conflict" for "ask").
+    """
+    report = PasteReport()
+    jobs: list[PasteJob] = []
+    taken: set[Path] = set()  # destinations claimed by earlier jobs in this batch
+    for name in dict.fromkeys(filenames):  # drop repeats, keep order
+        entry = meta.get_entry(name)
+        src = None
+        if pack is not None:
+            present = pack.digest_of(entry) is not None
+        else:
+            src = entry_path(cfg.vault_dir, entry)
+            present = src is not None and src.is_file()
+        if not present:
+            report.missing.append(name)
             continue
-    
-        #constructs the destinaiton path, "/" is a way to join paths in pathlib, so anme is being joined to cwd
-        dst = cwd/ name
-        overwrite = True
-        #if already a destination asks user to overwrite
-        if dst.exists():
-            overwrite = prompt_yes_no(f"File{name} already exists in cwd.Overwrite?")
-        if not overwrite:
+        relative = PurePosixPath(name)
+        if relative.is_absolute() or ".." in relative.parts:
+            report.skipped.append(name)  # would land outside dest
             continue
+        dst = dest / relative
+        try:
+            existing = os.lstat(dst)
+        except FileNotFoundError:
+            existing = None
+        action = "new"
+        if existing is not None or dst in taken:
+            report.conflicts.append(name)
+            if policy == "rename":
+                dst, action = _free_dst(dst, taken), "rename"
+            elif policy == "newer":
+                # Judged by when the source file was last changed; entries from before that was
+                # recorded only have the time they were added
+                changed = entry["mtime"] if entry["mtime"] is not None else entry["added_at"]
+                newer = existing is None or changed > existing.st_mtime
+                action = "overwrite" if newer else "skip"
+            elif policy == "ask":
+                action = "conflict"
+            else:
+                action = policy
+        taken.add(dst)
+        jobs.append(PasteJob(name, entry, src, dst, action))
+    return jobs, report
 
-        copy_file(src,dst)
-        #add the files into the list and return it,keeps trackof what files been pasted
-        pasted.append(name)
-    
-    #return the list of pasted files
-    return pasted
+
+def _free_dst(dst: Path, taken: set[Path]) -> Path:
+    # "notes.txt" -> "notes (1).txt", "notes (2).txt", ... until nothing is there
+    n = 1
+    while True:
+        candidate = dst.with_name(f"{dst.stem} ({n}){dst.suffix}")
+        if candidate not in taken and not os.path.lexists(candidate):
+            return candidate
+        n += 1
+
+
+def _write_paste_manifest(dest: Path, jobs: list[PasteJob], report: PasteReport, source: Path) -> Path:
+    # JSON record of the paste, replaced atomically so a reader never sees half of it
+    import json
+
+    done = {name for name, _ in report.pasted}
+    doc = {
+        "pasted_at": int(time.time()),
+        "source": str(source),
+        "files": [
+            {
+                "name": job.name,
+                "path": job.dst.relative_to(dest).as_posix(),
+                "digest": job.entry["digest"],
+                "size": job.entry["size_bytes"],
+                "action": job.action,
+            }
+            for job in jobs if job.name in done
+        ],
+        "skipped": report.skipped,
+        "failed": [name for name, _ in report.failed],
+    }
+    path = dest / PASTE_MANIFEST
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(doc, indent=1), encoding="utf-8")
+    os.replace(tmp, path)
+    return path
+
+
+def place_file(
+    src: Path, dst: Path, mode: str = "copy", stats: CopyStats | None = None, codec: str | None = None
+) -> str:
+    """
+    Put a vault file at dst as a copy, hard link or symlink. Returns the strategy used.
+    Compressed and chunked blobs (codec set) always become a real copy.
+    """
+    ensure_dir(dst.parent)
+    # Never write through an existing file: it may itself be a hard link to a blob
+    if dst.exists() or dst.is_symlink():
+        dst.unlink()
+    started = time.perf_counter()
+    size = src.stat().st_size
+    if codec is not None:
+        # Links would hand out the compressed bytes (or a chunk manifest), so stream the
+        # original contents into a copy instead
+        with open_blob(src, codec) as fin, open(dst, "wb") as fout:
+            shutil.copyfileobj(fin, fout, 1 << 20)
+            size = fout.tell()
+        shutil.copystat(src, dst)
+        dst.chmod(stat.S_IMODE(dst.stat().st_mode) | stat.S_IWUSR)
+        strategy = "reassemble" if codec == CHUNKED else f"{codec} decompress"
+    elif mode == "symlink":
+        os.symlink(src.resolve(), dst)
+        strategy = "symlink"
+    elif mode == "link":
+        try:
+            os.link(src, dst)
+            strategy = "hardlink"
+        except OSError as exc:
+            # Other filesystem (or no hard links there): fall back to a real copy
+            if exc.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP):
+                raise
+            return place_file(src, dst, "copy", stats)
+    else:
+        strategy = copy_file(src, dst)
+        # Blobs are read-only; the pasted copy is the user's to edit
+        dst.chmod(stat.S_IMODE(dst.stat().st_mode) | stat.S_IWUSR)
+    if stats is not None:
+        stats.record(strategy, size, time.perf_counter() - started)
+    return strategy
+
+
+def restore_version(
+    cfg: Config, meta: MetaStore, name: str, version: int, dest_dir: Path, stats: CopyStats | None = None
+) -> Path | None:
+    """
+    Write version `version` of a vault file (see `locky history`; the current contents are the
+    newest version) to dest_dir, streaming it out of its blob or chunks.
+    Returns the restored file, or None if the user chose not to overwrite one already there.
+    """
+    row = meta.get_version(name, version)
+    if row is None:
+        entry, past = meta.get_entry(name), meta.versions(name)
+        latest = (past[-1]["version"] if past else 0) + 1
+        if entry is None or version != latest:
+            raise ValueError(f"no version {version} of {name}")
+        row = entry
+    src = entry_path(cfg.vault_dir, row)
+    if src is None or not src.is_file():
+        raise FileNotFoundError(f"contents of {name} version {version} are missing from the vault")
+    dst = dest_dir / name
+    if (dst.exists() or dst.is_symlink()) and not prompt_yes_no(f"File{name} already exists in {dest_dir}.Overwrite?"):
+        return None
+    with trace.span("restore.place", file=name, version=version):
+        place_file(src, dst, "copy", stats, row["codec"])
+    return dst
+
+
+def place_stream(fin: BinaryIO, dst: Path, stats: CopyStats | None = None) -> None:
+    # Write a stream (e.g. a blob inside a pack) to dst as a fresh, writable file
+    ensure_dir(dst.parent)
+    if dst.exists() or dst.is_symlink():
+        dst.unlink()
+    started = time.perf_counter()
+    with open(dst, "wb") as fout:
+        shutil.copyfileobj(fin, fout, 1 << 20)
+        size = fout.tell()
+    if stats is not None:
+        stats.record("unpack", size, time.perf_counter() - started)
 
 
 def remove_files(cfg: Config, meta: MetaStore, filenames: list[str]) -> list[str]:
     """
-    Delete selected files from the vault directory and metadata store.
+    Delete selected files from the metadata store, and their contents once nothing else shares them.
     """
     removed = []
     for name in filenames:
-        vault_file = cfg.vault_dir / name
-        if vault_file.exists():
-            vault_file.unlink()  # delete the actual file
-        meta.delete(name)        # remove from the database
+        legacy = _legacy_file(cfg, meta, name)
+        if legacy is not None:
+            legacy.unlink()  # delete a pre-blob-store file directly
         removed.append(name)
+    meta.delete_many(removed)    # remove from the database in one transaction
+    forget_files(cfg.vault_dir, meta, removed)
+    _collect_garbage(cfg, meta)
     return removed
+
+
+def migrate_vault(
+    cfg: Config, meta: MetaStore, fanout: int | None = None, batch_size: int = 500
+) -> MigrateReport:
+    """
+    Bring a vault to the current on-disk layout: flat files from before the blob store become blobs,
+    and (with fanout) every blob moves to a blobs/ tree with that many shard levels.
+    Every step is committed as it goes and re-checked on the next run, so an interrupted
+    migration is finished by simply running it again.
+    """
+    if fanout is not None:
+        if not 1 <= fanout <= MAX_FANOUT:
+            raise ValueError(f"fan-out must be between 1 and {MAX_FANOUT}")
+        # New adds go straight to the new layout while old blobs are being moved
+        meta.set_setting("fanout", str(fanout))
+    blobs = blob_store(cfg, meta)
+    report = MigrateReport()
+
+    # 1. Flat files: copy into the blob store, commit, then delete the flat copy
+    batch: list[StoredFile] = []
+
+    def commit_legacy() -> None:
+        meta.set_digests(
+            ((s.name, s.size, s.digest) for s in batch),
+            [(s.digest, s.size, s.path, s.codec, s.stored_size) for s in batch if s.path is not None],
+        )
+        meta.set_search_samples((s.name, s.sample) for s in batch if s.sample)
+        _save_previews(meta, batch)
+        _heal(meta, blobs, batch)
+        for stored in batch:
+            stored.src.unlink(missing_ok=True)
+        report.converted += len(batch)
+        batch.clear()
+
+    for name in meta.legacy_entries():
+        flat = _legacy_file(cfg, meta, name)
+        if flat is None:
+            report.missing.append(name)
+            continue
+        batch.append(_store_blob(blobs, flat, name, compression=cfg.compression))
+        if len(batch) >= batch_size:
+            commit_legacy()
+    if batch:
+        commit_legacy()
+    # A run interrupted between commit and delete leaves flat copies of now-blobbed entries
+    for entry in os.scandir(cfg.vault_dir):
+        if not entry.is_file(follow_symlinks=False) or entry.name.startswith(cfg.db_path.name):
+            continue
+        row = meta.get_entry(entry.name)
+        if row is not None and row["digest"] is not None and hash_file(Path(entry.path)) == row["digest"]:
+            os.unlink(entry.path)
+            report.leftovers += 1
+
+    # 2. Blobs: move each one whose recorded path is not where the current fan-out puts it
+    moved: list[tuple[str, str]] = []
+    for digest, relpath in meta.blob_paths():
+        chunked = relpath is not None and relpath.endswith(MANIFEST_SUFFIX)
+        target = blobs.relpath(digest, CHUNKED if chunked else None)
+        if relpath == target:
+            continue
+        src, dst = cfg.vault_dir / (relpath or target), cfg.vault_dir / target
+        if src.is_file():
+            ensure_dir(dst.parent)
+            os.replace(src, dst)
+        elif not dst.is_file():
+            continue  # nothing on disk at either place; leave the row alone
+        # else: moved by an interrupted run that never recorded it
+        moved.append((digest, target))
+        if len(moved) >= batch_size:
+            meta.set_blob_paths(moved)
+            report.moved += len(moved)
+            moved.clear()
+    if moved:
+        meta.set_blob_paths(moved)
+        report.moved += len(moved)
+    # Drop shard directories the move emptied
+    if blobs.root.is_dir():
+        for dirpath, _, _ in os.walk(blobs.root, topdown=False):
+            if dirpath != str(blobs.root):
+                try:
+                    os.rmdir(dirpath)
+                except OSError:
+                    pass  # still has blobs in it
+    return report
+
+
+def _collect_garbage(cfg: Config, meta: MetaStore) -> None:
+    # Delete blobs whose last reference just went away, then chunks no remaining blob lists.
+    # Files go while the metadata store is locked for the rows' removal, so another process
+    # reusing the same content either keeps it referenced in time or sees it gone (see _heal)
+    blobs = BlobStore(cfg.vault_dir)
+    meta.take_unreferenced_blobs(blobs.delete)
+    meta.take_unreferenced_chunks(lambda digest: (cfg.vault_dir / chunk_relpath(digest)).unlink(missing_ok=True))
@@ -0,0 +1,29 @@
+from __future__ import annotations
+import pytest
+from config import Config
+from core.vault import add_file, init_vault
+
+
+@pytest.fixture
+def cfg(tmp_path):
+    vault = tmp_path / "vault"
+    return Config(vault_dir=vault, db_path=vault / "metadata.sqlite3", paste_dir=tmp_path / "out")
+
+
+@pytest.fixture
+def meta(cfg):
+    store = init_vault(cfg)
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def add(cfg, meta, tmp_path):
+    # add(name, data) writes a source file with data and adds it to the vault
+    def add(name: str, data: bytes):
+        src = tmp_path / "src" / name
+        src.parent.mkdir(parents=True, exist_ok=True)
+        src.write_bytes(data)
+        add_file(cfg, meta, src)
+        return src
+    return add
@@ -48,3 +48,15 @@ def test_unknown_extension(tmp_file):
     f = tmp_file("myfile.xyz", "some content here")
     desc = describe_file_baseline(f)
     assert "xyz file" in desc
+
+
+def test_binary_file_is_not_decoded(tmp_path):
+    f = tmp_path / "photo.png"
+    f.write_bytes(b"\x89PNG\r\n\x1a\n\x00\x00" * 50)
+    desc = describe_file_baseline(f)
+    assert desc == "PNG image — binary content, 500 bytes"
+
+
+def test_line_count_covers_whole_file(tmp_file):
+    f = tmp_file("big.txt", "line\n" * 10_000)
+    assert "10000 lines" in describe_file_baseline(f, max_bytes=100)
@@ -0,0 +1,34 @@
+from __future__ import annotations
+from benchmarks.bench import bench_vault, compare_results
+from benchmarks.synth import parse_count, populate
+from core.metadata import MetaStore
+from core.vault import vault_path
+
+
+def test_parse_count():
+    assert [parse_count(s) for s in ("250", "1k", "10K", "1m")] == [250, 1_000, 10_000, 1_000_000]
+
+
+def test_populate_builds_a_working_vault(tmp_path):
+    vault = populate(tmp_path, 40, "small", dup_ratio=0.5, seed=1)
+    meta = MetaStore(vault.cfg.db_path)
+    assert sorted(meta.list_files()) == sorted(vault.names)
+    for name in vault.names[:5]:
+        assert vault_path(vault.cfg, meta, name).stat().st_size == meta.get_entry(name)["size_bytes"]
+    # duplicates share blobs
+    assert len(list((vault.cfg.vault_dir / "blobs").rglob("*/*"))) < 40
+
+
+def test_bench_vault_times_every_operation(monkeypatch):
+    monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+    ops = {r["op"] for r in bench_vault(20, "small", sample=4, latency=0.0, seed=0)}
+    assert {"list_files", "cmd_list", "add_file", "add_many", "paste_files", "remove_files",
+            "preview_render", "describe_many_stub", "locky_list_cold"} <= ops
+
+
+def test_compare_flags_only_real_slowdowns():
+    def doc(seconds):
+        return {"results": [{"size": 1000, "dist": "small", "op": op, "n": 1, "seconds": s}
+                            for op, s in seconds.items()]}
+    rows = compare_results(doc({"a": 1.0, "b": 1.0, "c": 0.001}), doc({"a": 1.1, "b": 2.0, "c": 0.003}), 0.2)
+    assert {r["op"]: r["regressed"] for r in rows} == {"a": False, "b": True, "c": False}
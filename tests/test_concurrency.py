@@ -0,0 +1,277 @@
+from __future__ import annotations
+import hashlib
+import multiprocessing
+import random
+import threading
+from pathlib import Path
+import pytest
+from config import Config
+from core.chunks import chunk_relpath
+from core.compression import open_blob
+from core.metadata import MetaStore
+from core.vault import add_file, add_many, init_vault, remove_files
+from utils.locks import entry_locks
+
+WORKERS = 4
+ROUNDS = 40
+# A few contents shared by every worker, so dedup and garbage collection race each other
+PAYLOADS = [f"shared payload {n}\n".encode() * (n + 1) for n in range(3)]
+NAMES = [f"shared-{n}.txt" for n in range(4)]
+TREE_FILES = 60
+
+
+def vault_config(root: Path) -> Config:
+    vault = root / "vault"
+    return Config(vault_dir=vault, db_path=vault / "metadata.sqlite3", paste_dir=root / "out")
+
+
+def worker(job, root: str, seed: int, *args) -> None:
+    # A crash in a child only shows as an exit code, so its traceback is kept for the test to report
+    try:
+        job(root, seed, *args)
+    except BaseException:
+        import traceback
+        (Path(root) / f"worker-{seed}.err").write_text(traceback.format_exc())
+        raise
+
+
+def work(root: str, seed: int) -> None:
+    # One `locky` process: adds, overwrites and removes names the others are using too
+    import builtins
+    builtins.input = lambda *a: "y"
+    rng = random.Random(seed)
+    root = Path(root)
+    src = root / f"src{seed}"
+    src.mkdir()
+    cfg = vault_config(root)
+    meta = init_vault(cfg)
+    big = rng.randbytes(3 << 19)
+    for n in range(ROUNDS):
+        op = rng.randrange(4)
+        if op == 0:
+            path = src / rng.choice(NAMES)
+            path.write_bytes(rng.choice(PAYLOADS))
+            add_file(cfg, meta, path)
+        elif op == 1:
+            batch = []
+            for k in range(5):
+                path = src / "batch" / f"{k}-{rng.choice(NAMES)}"
+                path.parent.mkdir(exist_ok=True)
+                path.write_bytes(rng.choice(PAYLOADS))
+                batch.append((path, rng.choice(NAMES + [f"own-{seed}-{k}.txt"])))
+            add_many(cfg, meta, batch, policy="overwrite", workers=2)
+        elif op == 2:
+            remove_files(cfg, meta, rng.sample(NAMES, 2))
+        else:
+            # A large file of this worker's own, growing: its versions go to chunks
+            big += rng.randbytes(5000)
+            path = src / f"big-{seed}.bin"
+            path.write_bytes(big)
+            add_file(cfg, meta, path)
+    meta.close()
+
+
+def add_tree(root: str, seed: int, start) -> None:
+    # One `locky add` of a directory whose names every other process adds too, twice over:
+    # renaming what collides, then overwriting
+    root = Path(root)
+    cfg = vault_config(root)
+    meta = init_vault(cfg)
+    src = root / f"tree{seed}"
+    src.mkdir()
+    start.wait()
+    for policy, tail in (("rename", ""), ("overwrite", " again")):
+        batch = []
+        for n in range(TREE_FILES):
+            path = src / f"{n}.txt"
+            path.write_text(f"{seed} {n}{tail}\n")
+            batch.append((path, f"tree/{n}.txt"))
+        add_many(cfg, meta, batch, policy=policy, workers=2, batch_size=25)
+    meta.close()
+
+
+def test_processes_adding_the_same_names_lose_nothing(tmp_path):
+    init_vault(vault_config(tmp_path)).close()
+    ctx = multiprocessing.get_context("spawn")
+    start = ctx.Barrier(WORKERS)
+    procs = [ctx.Process(target=worker, args=(add_tree, str(tmp_path), seed, start)) for seed in range(WORKERS)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(120)
+    errors = "\n".join(f.read_text() for f in sorted(tmp_path.glob("worker-*.err")))
+    assert [p.exitcode for p in procs] == [0] * WORKERS, errors
+
+    def digest(text: str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    renamed = {digest(f"{seed} {n}\n") for seed in range(WORKERS) for n in range(TREE_FILES)}
+    overwritten = {digest(f"{seed} {n} again\n") for seed in range(WORKERS) for n in range(TREE_FILES)}
+    with MetaStore(vault_config(tmp_path).db_path) as meta:
+        con = meta._connect()
+        files = [r[0] for r in con.execute("SELECT digest FROM files")]
+        versions = [r[0] for r in con.execute("SELECT digest FROM versions")]
+    # Every rename found a name of its own, and every overwrite kept what it replaced
+    assert len(files) == len(set(files)) == WORKERS * TREE_FILES
+    assert sorted(files + versions) == sorted(renamed | overwritten)
+
+
+def test_processes_adding_and_removing_keep_the_vault_consistent(tmp_path):
+    init_vault(vault_config(tmp_path)).close()
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=worker, args=(work, str(tmp_path), seed)) for seed in range(WORKERS)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(120)
+    errors = "\n".join(f.read_text() for f in sorted(tmp_path.glob("worker-*.err")))
+    assert [p.exitcode for p in procs] == [0] * WORKERS, errors
+
+    cfg = vault_config(tmp_path)
+    vault = cfg.vault_dir
+    with MetaStore(cfg.db_path) as meta:
+        con = meta._connect()
+        referenced = {}
+        for (digest,) in con.execute("SELECT digest FROM files UNION ALL SELECT digest FROM versions"):
+            referenced[digest] = referenced.get(digest, 0) + 1
+        blobs = {r["digest"]: r for r in con.execute("SELECT * FROM blobs")}
+        # Every reference has its blob, counted right, on disk, with the right contents
+        assert set(blobs) == set(referenced)
+        for digest, row in blobs.items():
+            assert row["refcount"] == referenced[digest]
+            with open_blob(vault / row["path"], row["codec"]) as f:
+                assert hashlib.sha256(f.read()).hexdigest() == digest
+        chunk_refs = {}
+        for (chunk,) in con.execute("SELECT chunk FROM blob_chunks"):
+            chunk_refs[chunk] = chunk_refs.get(chunk, 0) + 1
+        chunks = dict(con.execute("SELECT digest, refcount FROM chunks").fetchall())
+        assert chunks == chunk_refs
+    # Nothing half-written or left behind on disk
+    on_disk = {p.relative_to(vault).as_posix() for p in vault.glob("blobs/**/*") if p.is_file()}
+    assert on_disk == {row["path"] for row in blobs.values()}
+    chunk_files = {p.relative_to(vault).as_posix() for p in vault.glob("chunks/**/*") if p.is_file()}
+    assert chunk_files == {chunk_relpath(digest) for digest in chunks}
+    assert chunks, "the large files should have gone to chunks"
+
+
+def test_content_collected_by_another_process_mid_add_is_stored_again(tmp_path, monkeypatch):
+    cfg = vault_config(tmp_path)
+    meta = init_vault(cfg)
+    first = tmp_path / "a.txt"
+    first.write_bytes(b"same bytes")
+    add_file(cfg, meta, first)
+    second = tmp_path / "b.txt"
+    second.write_bytes(b"same bytes")
+    import core.vault as vault
+    sample = vault._search_sample
+
+    def meanwhile(src):
+        # After b.txt found the blob already stored, another process drops a.txt and collects it
+        if src == second:
+            with MetaStore(cfg.db_path) as other:
+                remove_files(cfg, other, ["a.txt"])
+        return sample(src)
+
+    monkeypatch.setattr(vault, "_search_sample", meanwhile)
+    add_file(cfg, meta, second)
+    assert vault.vault_path(cfg, meta, "b.txt").read_bytes() == b"same bytes"
+    meta.close()
+
+
+def test_chunks_collected_by_another_process_mid_rechunk_are_stored_again(tmp_path, monkeypatch):
+    monkeypatch.setattr("builtins.input", lambda *a: "y")
+    cfg = vault_config(tmp_path)
+    meta = init_vault(cfg)
+    src = tmp_path / "big.bin"
+    kept = random.Random(3).randbytes(3 << 19)
+    src.write_bytes(kept)
+    add_file(cfg, meta, src)
+    src.write_bytes(kept + b"tail")
+    set_chunked = meta.set_chunked
+
+    def meanwhile(digest, path, stored_bytes, pieces):
+        # Between rechunking the kept version and recording it, another process's collection
+        # deletes a chunk the rechunk found already on disk
+        (cfg.vault_dir / chunk_relpath(pieces[0][0])).unlink()
+        return set_chunked(digest, path, stored_bytes, pieces)
+
+    monkeypatch.setattr(meta, "set_chunked", meanwhile)
+    add_file(cfg, meta, src)
+    (version,) = meta.versions("big.bin")
+    assert version["codec"] == "chunks"
+    with open_blob(cfg.vault_dir / version["path"], version["codec"]) as f:
+        assert f.read() == kept
+    meta.close()
+
+
+def test_entry_locks_keep_threads_apart_and_nest(tmp_path):
+    locks = entry_locks(tmp_path)
+    inside, overlaps = [0], []
+
+    def hold() -> None:
+        for _ in range(200):
+            with locks.hold("same"):
+                with locks.hold("same"):
+                    inside[0] += 1
+                    overlaps.append(inside[0])
+                    inside[0] -= 1
+
+    threads = [threading.Thread(target=hold) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert set(overlaps) == {1}
+    assert (tmp_path / ".locky-lock").is_file()
+
+
+def test_writes_retry_while_another_process_holds_the_database(tmp_path, monkeypatch):
+    import core.metadata as metadata
+    db = tmp_path / "metadata.sqlite3"
+    with MetaStore(db) as first, MetaStore(db) as second:
+        # Give up on the busy handler at once, so only the retries can save the write
+        second._con.execute("PRAGMA busy_timeout=0")
+        monkeypatch.setattr(metadata, "BUSY_BACKOFF", 0.01)
+        first._con.execute("BEGIN IMMEDIATE")
+        threading.Timer(0.05, first._con.commit).start()
+        second.set_setting("fanout", "2")
+        assert first.get_setting("fanout") == "2"
+        second._con.execute("PRAGMA busy_timeout=0")
+        monkeypatch.setattr(metadata, "BUSY_RETRIES", 0)
+        first._con.execute("BEGIN IMMEDIATE")
+        with pytest.raises(metadata.sqlite3.OperationalError):
+            second.set_setting("fanout", "3")
+        first._con.rollback()
+
+
+def test_stores_opening_an_old_database_at_once_upgrade_it_once(tmp_path):
+    import sqlite3
+    db = tmp_path / "old.sqlite3"
+    con = sqlite3.connect(db)
+    con.execute("CREATE TABLE files (filename TEXT PRIMARY KEY, added_at INTEGER NOT NULL, size_bytes INTEGER NOT NULL, description TEXT)")
+    con.execute("INSERT INTO files VALUES ('a.txt', 0, 5, 'first')")
+    con.commit()
+    con.close()
+    ready = threading.Barrier(8)
+    opened, errors = [], []
+
+    def open_store() -> None:
+        ready.wait()
+        try:
+            store = MetaStore(db)
+        except Exception as exc:
+            errors.append(exc)
+            return
+        opened.append((store.has_search, store.has_trigram))
+        store.close()
+
+    threads = [threading.Thread(target=open_store) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    # Nobody lost the race to create the search indexes and went without them
+    assert len(set(opened)) == 1
+    with MetaStore(db) as meta:
+        assert [r["filename"] for r in meta.search("first")] == ["a.txt"]
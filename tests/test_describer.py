@@ -0,0 +1,226 @@
+from __future__ import annotations
+import asyncio
+import json
+import re
+import pytest
+from pathlib import Path
+from core.metadata import MetaStore
+from core.ai_desc import parse_batch_reply
+from core.describer import describe_and_store, describe_many
+
+
+class FakeRateLimit(Exception):
+    status_code = 429
+
+
+class StubMessages:
+    def __init__(self, fail_first: int = 0, error: Exception | None = None, reply=None):
+        self.calls = 0
+        self.batches = []
+        # reply(names) -> text overrides the JSON answer to batched prompts
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.fail_first = fail_first
+        self.error = error
+        self.reply = reply
+
+    async def create(self, model, max_tokens, messages):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if self.error is not None:
+                raise self.error
+            if self.calls <= self.fail_first:
+                raise FakeRateLimit()
+            prompt = messages[0]["content"]
+            names = re.findall(r'<file name="(.*?)">', prompt)
+            if names:
+                self.batches.append(names)
+                text = self.reply(names) if self.reply else json.dumps({n: f"about {n}" for n in names})
+            else:
+                text = f" about {prompt.split('File name: ')[1].split(chr(10))[0]} "
+            return type("Msg", (), {"content": [type("Block", (), {"text": text})()]})()
+        finally:
+            self.in_flight -= 1
+
+
+class StubClient:
+    def __init__(self, **kwargs):
+        self.messages = StubMessages(**kwargs)
+
+
+@pytest.fixture
+def meta(tmp_path):
+    return MetaStore(tmp_path / "test.sqlite3")
+
+
+@pytest.fixture
+def files(tmp_path):
+    out = []
+    for i in range(20):
+        f = tmp_path / f"f{i}.txt"
+        f.write_text(f"content {i}")
+        out.append((f, f"f{i}.txt"))
+    return out
+
+
+def test_describes_and_stores_all(meta, files):
+    client = StubClient()
+    results = describe_many(meta, files, concurrency=4, batch_size=3, client=client)
+    assert len(results) == 20
+    assert meta.get_description("f7.txt") == "about f7.txt"
+
+
+def test_small_files_share_requests(meta, files):
+    client = StubClient()
+    describe_many(meta, files, concurrency=4, client=client, batch_files=8)
+    assert client.messages.calls == 3
+    assert sorted(len(b) for b in client.messages.batches) == [4, 8, 8]
+    assert meta.get_description("f19.txt") == "about f19.txt"
+
+
+def test_files_the_batch_reply_misses_fall_back_to_baseline(meta, files):
+    # Fenced JSON with chatter around it, one file left out and one answer blank
+    def reply(names):
+        answers = {n: f"about {n}" for n in names[2:]}
+        answers[names[1]] = " "
+        return "Here you go:\n```json\n" + json.dumps(answers) + "\n```"
+
+    for _, name in files[:5]:
+        meta.upsert(name, 1, f"digest-{name}")
+    client = StubClient(reply=reply)
+    describe_many(meta, files[:5], concurrency=1, client=client)
+    [batch] = client.messages.batches
+    assert meta.get_description(batch[0]).startswith("Text file")
+    assert meta.get_description(batch[1]).startswith("Text file")
+    assert meta.get_description(batch[2]) == f"about {batch[2]}"
+    # Only real API answers are cached
+    assert meta.cache_stats()["entries"] == 3
+
+
+def test_large_files_get_their_own_request(meta, files, tmp_path):
+    big = tmp_path / "big.txt"
+    big.write_text("word " * 2000)
+    client = StubClient()
+    describe_many(meta, [*files[:3], (big, "big.txt")], concurrency=1, client=client)
+    assert client.messages.calls == 2
+    assert meta.get_description("big.txt") == "about big.txt"
+
+
+def test_batch_reply_parsing_is_forgiving():
+    names = ["a.txt", "dir/b.txt", "c.txt"]
+    assert parse_batch_reply('{"a.txt": "An A", "other": "x"}', names) == {"a.txt": "An A"}
+    assert parse_batch_reply('{"dir/b.txt": {"description": "A B"}}', names) == {"dir/b.txt": "A B"}
+    # A reply cut off mid-object still yields the pairs that made it
+    assert parse_batch_reply('{"a.txt": "An \\"A\\"", "c.txt": "cut o', names) == {"a.txt": 'An "A"'}
+    assert parse_batch_reply("I can't help with that.", names) == {}
+
+
+def test_concurrency_is_bounded(meta, files):
+    client = StubClient()
+    describe_many(meta, files, concurrency=4, client=client, batch_files=1)
+    assert 1 < client.messages.max_in_flight <= 4
+
+
+def test_retries_rate_limits(meta, files, monkeypatch):
+    monkeypatch.setattr("core.describer._backoff_delay", lambda exc, attempt: 0)
+    client = StubClient(fail_first=3)
+    describe_many(meta, files[:1], concurrency=1, client=client)
+    assert client.messages.calls == 4
+    assert meta.get_description("f0.txt") == "about f0.txt"
+
+
+def test_non_retryable_error_falls_back_to_baseline(meta, files):
+    client = StubClient(error=ValueError("bad request"))
+    describe_many(meta, files[:1], client=client)
+    assert client.messages.calls == 1
+    assert meta.get_description("f0.txt").startswith("Text file")
+
+
+def test_without_key_uses_baseline(meta, files, monkeypatch):
+    monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+    describe_many(meta, files[:2])
+    assert meta.get_description("f1.txt") == "Text file (1 line) — content 1"
+
+
+def test_describe_and_store_reuses_cached_description(meta, tmp_path, monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+    calls = []
+    monkeypatch.setattr("core.describer.request_description", lambda path: calls.append(path) or "from api")
+    for name in ("one.txt", "two.txt"):
+        f = tmp_path / name
+        f.write_text("same bytes")
+        meta.upsert(name, 10, "digest-same")
+        assert describe_and_store(meta, f, name) == "from api"
+    assert len(calls) == 1
+    assert meta.get_description("two.txt") == "from api"
+
+
+def test_failed_api_call_is_not_cached(meta, tmp_path, monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+
+    def boom(path):
+        raise RuntimeError("network down")
+
+    monkeypatch.setattr("core.describer.request_description", boom)
+    f = tmp_path / "a.txt"
+    f.write_text("hello")
+    meta.upsert("a.txt", 5, "d1")
+    describe_and_store(meta, f, "a.txt")
+    assert meta.cache_stats()["entries"] == 0
+
+
+def test_binary_content_is_labelled_by_each_files_own_extension(meta, tmp_path, monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+    monkeypatch.setattr("core.describer.request_description", lambda path: pytest.fail("binary sent to the API"))
+    for name in ("img.png", "img.zip"):
+        f = tmp_path / name
+        f.write_bytes(b"\x00\x01binary\x00" * 10)
+        meta.upsert(name, 90, "digest-binary")
+        describe_and_store(meta, f, name)
+    assert meta.get_description("img.png").startswith("PNG image")
+    assert meta.get_description("img.zip").startswith("ZIP archive")
+    # The same goes for the batched path, copies in one run included
+    items = []
+    for name in ("a.png", "a.zip"):
+        f = tmp_path / name
+        f.write_bytes(b"\x00other binary\x00" * 10)
+        meta.upsert(name, 140, "digest-other")
+        items.append((f, name))
+    client = StubClient()
+    describe_many(meta, items, client=client)
+    assert client.messages.calls == 0
+    assert meta.get_description("a.png").startswith("PNG image")
+    assert meta.get_description("a.zip").startswith("ZIP archive")
+
+
+def test_describe_many_calls_once_per_content(meta, files):
+    for _, name in files:
+        meta.upsert(name, 1, "shared-digest")
+    client = StubClient()
+    describe_many(meta, files, concurrency=4, client=client)
+    assert client.messages.calls == 1
+    assert len({meta.get_description(name) for _, name in files}) == 1
+
+
+def test_duplicate_small_files_do_not_stall_the_batch(meta, tmp_path):
+    # The second copy turns up while the first is still being read, before it joins a batch
+    items = []
+    for name in ("one.txt", "two.txt"):
+        f = tmp_path / name
+        f.write_text("same small bytes")
+        meta.upsert(name, 16, "digest-same")
+        items.append((f, name))
+    client = StubClient()
+
+    async def run():
+        from core.describer import _describe_many
+        return await asyncio.wait_for(
+            _describe_many(meta, items, client, 2, 50, 0, 100, 20), timeout=5
+        )
+
+    results = asyncio.run(run())
+    assert results == {"one.txt": "about one.txt", "two.txt": "about one.txt"}
+    assert client.messages.calls == 1
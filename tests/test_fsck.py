@@ -0,0 +1,114 @@
+from __future__ import annotations
+import os
+import random
+import pytest
+from core.chunks import chunk_relpath
+from core.fsck import check_vault
+from core.vault import add_many, vault_path
+
+
+@pytest.fixture(autouse=True)
+def settled(monkeypatch):
+    # Nothing in these tests is an add in progress, so orphans need no time to settle
+    monkeypatch.setattr("core.fsck.ORPHAN_GRACE", -60)
+
+
+def rot(path, at: int = 0) -> None:
+    # Flip one byte in place, keeping size and mtime, as a failing disk would
+    st = path.stat()
+    os.chmod(path, 0o644)
+    with open(path, "r+b") as f:
+        f.seek(at)
+        byte = f.read(1)
+        f.seek(at)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def test_healthy_vault_is_hashed_once_then_skipped(cfg, meta, add, tmp_path):
+    add("a.txt", b"alpha")
+    add("b.txt", b"bravo" * 100)
+    first = check_vault(cfg, meta)
+    assert first.clean
+    assert (first.checked, first.hashed, first.cached) == (2, 2, 0)
+    assert first.bytes_hashed == 505
+    second = check_vault(cfg, meta)
+    assert (second.hashed, second.cached) == (0, 2)
+    assert check_vault(cfg, meta, full=True).hashed == 2
+
+
+def test_bit_rot_is_found_by_a_full_check(cfg, meta, add, tmp_path):
+    add("a.txt", b"alpha")
+    add("b.txt", b"bravo")
+    check_vault(cfg, meta)
+    rot(vault_path(cfg, meta, "a.txt"))
+    # Same inode, size and mtime: only hashing again can tell
+    assert check_vault(cfg, meta).damaged == []
+    report = check_vault(cfg, meta, full=True)
+    assert report.damaged == ["a.txt"]
+    assert not report.clean
+    # Damage is left for the user: repair does not drop the entry
+    check_vault(cfg, meta, repair=True, full=True)
+    assert meta.get_entry("a.txt") is not None
+
+
+def test_missing_contents_are_dropped_on_repair(cfg, meta, add, tmp_path):
+    add("a.txt", b"alpha")
+    add("b.txt", b"bravo")
+    vault_path(cfg, meta, "a.txt").unlink()
+    report = check_vault(cfg, meta)
+    assert report.missing == ["a.txt"]
+    repaired = check_vault(cfg, meta, repair=True)
+    assert repaired.removed == ["a.txt"]
+    assert meta.list_files() == ["b.txt"]
+    assert check_vault(cfg, meta).clean
+
+
+def test_missing_chunk_takes_its_blob_and_versions(cfg, meta, add, tmp_path, monkeypatch):
+    monkeypatch.setattr("builtins.input", lambda *a: "y")
+    big = random.Random(7).randbytes(2 << 20)
+    add("big.bin", big)
+    add("big.bin", big + b"tail")
+    with meta._connect() as con:
+        chunk = con.execute("SELECT chunk FROM blob_chunks ORDER BY seq LIMIT 1").fetchone()[0]
+    (cfg.vault_dir / chunk_relpath(chunk)).unlink()
+    report = check_vault(cfg, meta)
+    # The first chunk is shared by both versions
+    assert report.missing == ["big.bin", "big.bin@1"]
+
+
+def test_orphans_and_strays_are_reconciled(cfg, meta, add, tmp_path, monkeypatch):
+    monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+    add("a.txt", b"alpha")
+    orphan = cfg.vault_dir / "blobs" / "ff" / ("ff" * 32)
+    orphan.parent.mkdir(parents=True, exist_ok=True)
+    orphan.write_bytes(b"left behind")
+    (cfg.vault_dir / "dropped.txt").write_text("put here by hand")
+    (cfg.vault_dir / "docs").mkdir()
+    (cfg.vault_dir / "docs" / "a.txt").write_text("nested")
+    report = check_vault(cfg, meta)
+    assert report.orphans == [f"blobs/ff/{'ff' * 32}"]
+    assert report.strays == ["docs/a.txt", "dropped.txt"]
+
+    repaired = check_vault(cfg, meta, repair=True)
+    assert repaired.deleted == 1 and not orphan.exists()
+    assert sorted(repaired.adopted) == [("docs/a.txt", "docs/a.txt"), ("dropped.txt", "dropped.txt")]
+    assert vault_path(cfg, meta, "dropped.txt").read_text() == "put here by hand"
+    # Adopted entries are described like any other add
+    assert meta.get_description("dropped.txt") == "Text file (1 line) — put here by hand"
+    assert not (cfg.vault_dir / "dropped.txt").exists()
+    assert check_vault(cfg, meta).clean
+
+
+def test_size_drift_is_corrected(cfg, meta, tmp_path):
+    src = tmp_path / "log.txt"
+    src.write_bytes(b"a compressible line\n" * 500)
+    add_many(cfg, meta, [(src, "log.txt")], compression="zlib")
+    with meta._connect() as con:
+        con.execute("UPDATE files SET size_bytes=1 WHERE filename='log.txt'")
+    report = check_vault(cfg, meta)
+    assert report.size_drift == ["log.txt"]
+    # Compressed blobs are hashed by their original contents
+    assert report.damaged == []
+    check_vault(cfg, meta, repair=True)
+    assert meta.get_entry("log.txt")["size_bytes"] == 10_000
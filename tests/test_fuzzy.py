@@ -0,0 +1,110 @@
+from __future__ import annotations
+import pytest
+from config import Config
+from core.fuzzy import FuzzyMatcher
+from core.metadata import MetaStore
+
+
+@pytest.fixture
+def meta(tmp_path):
+    store = MetaStore(tmp_path / "test.sqlite3")
+    store.upsert_many([(name, 1, None) for name in (
+        "notes/budget_2024.csv", "server_cache.py", "deploy/server.yml", "paste_files.py", "readme.md",
+    )])
+    store.set_description("readme.md", "How to deploy the cache server")
+    return store
+
+
+def names(matches):
+    return [m.name for m in matches]
+
+
+def test_substring_matches_names_before_descriptions(meta):
+    found = FuzzyMatcher(meta).search("server")
+    assert names(found) == ["server_cache.py", "deploy/server.yml", "readme.md"]
+    assert [m.in_name for m in found] == [True, True, False]
+
+
+def test_every_word_must_match(meta):
+    assert names(FuzzyMatcher(meta).search("cache serv")) == ["server_cache.py", "readme.md"]
+
+
+def test_typing_more_refines_the_previous_candidates(meta):
+    matcher = FuzzyMatcher(meta)
+    matcher.search("ser")
+    assert matcher.last_source == "index"
+    assert names(matcher.search("server_c")) == ["server_cache.py"]
+    assert matcher.last_source == "refine"
+
+
+def test_typing_a_query_finds_what_asking_it_directly_does(meta):
+    meta.upsert_many([("report.txt", 1, None), ("invoice-2024.pdf", 1, None)])
+    meta.set_description("report.txt", "quarterly invoice summary")
+
+    def typed(query):
+        # One keystroke at a time, the way the picker asks
+        matcher = FuzzyMatcher(meta)
+        for n in range(1, len(query) + 1):
+            found = matcher.search(query[:n])
+        return names(found)
+
+    assert typed("invo") == ["invoice-2024.pdf", "report.txt"]
+    for query in ("invo", "depl", "serv cach"):
+        assert typed(query) == names(FuzzyMatcher(meta).search(query)), query
+
+
+def test_short_queries_scan_names(meta):
+    matcher = FuzzyMatcher(meta)
+    assert names(matcher.search("bu")) == ["notes/budget_2024.csv"]
+    assert matcher.last_source == "scan"
+
+
+def test_falls_back_to_subsequence_matching(meta):
+    matcher = FuzzyMatcher(meta)
+    assert names(matcher.search("pstfl")) == ["paste_files.py"]
+    assert matcher.last_source == "fuzzy"
+    assert matcher.search("qqqq") == []
+
+
+def test_incomplete_candidate_sets_are_not_refined(meta):
+    matcher = FuzzyMatcher(meta, candidate_limit=1)
+    matcher.search("ser")
+    matcher.search("serve")
+    assert matcher.last_source == "index"
+
+
+def test_trigram_index_follows_adds_descriptions_and_deletes(meta):
+    matcher = FuzzyMatcher(meta)
+    meta.upsert("zebra.txt", 1)
+    assert names(matcher.search("zebra")) == ["zebra.txt"]
+    meta.set_description("notes/budget_2024.csv", "quarterly numbers")
+    assert names(matcher.search("quarterly")) == ["notes/budget_2024.csv"]
+    meta.delete("zebra.txt")
+    assert matcher.search("zebra") == []
+
+
+def test_trigram_index_backfills_existing_rows(tmp_path):
+    db = tmp_path / "db.sqlite3"
+    first = MetaStore(db)
+    first.upsert("report.pdf", 1)
+    first._connect().execute("DROP TABLE files_trigram")
+    first.close()
+    assert names(FuzzyMatcher(MetaStore(db)).search("epor")) == ["report.pdf"]
+
+
+def test_paste_match_pastes_best_hits_without_a_picker(tmp_path, monkeypatch, capsys):
+    from cli import cmd_paste
+    from core.vault import PASTE_MANIFEST, add_file, init_vault
+
+    cfg = Config(vault_dir=tmp_path / "vault", db_path=tmp_path / "vault" / "db.sqlite3",
+                 paste_dir=tmp_path / "out")
+    store = init_vault(cfg)
+    for name in ("alpha_notes.txt", "beta_notes.txt"):
+        src = tmp_path / name
+        src.write_text(name)
+        add_file(cfg, store, src)
+    monkeypatch.setattr("ui.fzf_ui.pick_files", lambda *a: pytest.fail("picker opened"))
+    cmd_paste(cfg, store, ["--match", "beta"])
+    assert [p.name for p in cfg.paste_dir.iterdir() if p.name != PASTE_MANIFEST] == ["beta_notes.txt"]
+    cmd_paste(cfg, store, ["--match", "nothing-like-this"])
+    assert "No matches" in capsys.readouterr().out
@@ -48,3 +48,165 @@ def test_delete_removes_file(meta):
 def test_delete_nonexistent_is_safe(meta):
     # Deleting something that doesn't exist should not raise
     meta.delete("ghost.txt")
+
+
+def test_refcount_follows_files(meta):
+    meta.upsert("a.txt", 10, "d1")
+    meta.upsert("b.txt", 10, "d1")
+    meta.delete("a.txt")
+    assert meta.take_unreferenced() == []
+    meta.delete("b.txt")
+    assert meta.take_unreferenced() == ["d1"]
+    assert not meta.has_blob("d1")
+
+
+def test_repointing_a_name_keeps_old_blob_as_a_version(meta):
+    meta.upsert("a.txt", 10, "d1")
+    meta.upsert("a.txt", 12, "d2")
+    assert meta.get_digest("a.txt") == "d2"
+    assert meta.take_unreferenced() == []
+    assert [(v["version"], v["digest"]) for v in meta.versions("a.txt")] == [(1, "d1")]
+    # Removing the name releases every version with it
+    meta.delete("a.txt")
+    assert sorted(meta.take_unreferenced()) == ["d1", "d2"]
+
+
+def test_old_database_gains_digest_column(tmp_path):
+    import sqlite3
+    db = tmp_path / "old.sqlite3"
+    con = sqlite3.connect(db)
+    con.execute("CREATE TABLE files (filename TEXT PRIMARY KEY, added_at INTEGER NOT NULL, size_bytes INTEGER NOT NULL, description TEXT)")
+    con.execute("INSERT INTO files VALUES ('old.txt', 0, 5, 'legacy')")
+    con.commit()
+    con.close()
+    meta = MetaStore(db)
+    assert meta.get_digest("old.txt") is None
+    assert meta.get_description("old.txt") == "legacy"
+
+
+def test_old_blob_rows_get_their_path_backfilled(tmp_path):
+    import sqlite3
+    db = tmp_path / "old.sqlite3"
+    con = sqlite3.connect(db)
+    con.execute("CREATE TABLE blobs (digest TEXT PRIMARY KEY, size_bytes INTEGER NOT NULL, refcount INTEGER NOT NULL DEFAULT 0)")
+    con.execute("INSERT INTO blobs VALUES ('abcdef', 5, 1)")
+    con.commit()
+    con.close()
+    meta = MetaStore(db)
+    assert meta.blob_paths() == [("abcdef", "blobs/ab/abcdef")]
+
+
+def test_list_with_metadata_streams_rows(meta):
+    meta.upsert_many([("b.txt", 2, None), ("a.txt", 1, None)])
+    meta.set_description("a.txt", "first")
+    rows = [(r["filename"], r["size_bytes"], r["description"]) for r in meta.list_with_metadata()]
+    assert rows == [("a.txt", 1, "first"), ("b.txt", 2, None)]
+
+
+def test_old_database_is_migrated_once(tmp_path):
+    import sqlite3
+    from core.metadata import SCHEMA_VERSION
+    db = tmp_path / "old.sqlite3"
+    con = sqlite3.connect(db)
+    con.execute("CREATE TABLE files (filename TEXT PRIMARY KEY, added_at INTEGER NOT NULL, size_bytes INTEGER NOT NULL, description TEXT, digest TEXT)")
+    con.execute("CREATE TABLE previews (digest TEXT PRIMARY KEY, head BLOB NOT NULL, kind TEXT NOT NULL, line_count INTEGER, truncated INTEGER NOT NULL, highlighted BLOB)")
+    con.execute("INSERT INTO files VALUES ('a.py', 0, 5, NULL, 'd1')")
+    con.execute("INSERT INTO previews VALUES ('d1', x'', 'text', 12, 0, NULL)")
+    con.commit()
+    con.close()
+    with MetaStore(db) as meta:
+        [row] = meta.list_entries()
+        assert (row["kind"], row["line_count"], row["mtime"]) == ("text", 12, None)
+        assert meta._connect().execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+
+
+def test_list_entries_sorts_filters_and_pages(meta):
+    meta.upsert_many([("a.txt", 10, "d1", 111), ("b.png", 3000, "d2"), ("c.txt", 500, "d3")])
+    # Kind and line count come with the contents' preview, whenever it is stored
+    meta.set_previews([("d1", b"", "text", 1, False, None), ("d2", b"", "png", None, False, None)])
+    meta.upsert("c.txt", 500, "d1")
+    with meta._connect() as con:
+        con.executemany("UPDATE files SET added_at=? WHERE filename=?", [(100, "a.txt"), (300, "b.png"), (200, "c.txt")])
+
+    def names(**kw):
+        return [r["filename"] for r in meta.list_entries(**kw)]
+
+    assert names() == ["a.txt", "b.png", "c.txt"]
+    assert names(sort="size") == ["b.png", "c.txt", "a.txt"]
+    assert names(sort="added", since=150) == ["b.png", "c.txt"]
+    assert names(kind="text") == ["a.txt", "c.txt"]
+    assert names(larger_than=100, sort="size", limit=1, offset=1) == ["c.txt"]
+    assert meta.get_entry("a.txt")["mtime"] == 111
+
+
+def test_list_command_streams_json(meta, tmp_path, capsys):
+    import json
+    from cli import cmd_list
+    from config import Config
+    meta.upsert_many([("a.txt", 10, None), ("b.txt", 2 << 20, None)])
+    cfg = Config(tmp_path, tmp_path / "test.sqlite3", tmp_path / "out")
+    cmd_list(cfg, meta, ["--json", "--larger-than", "1M"])
+    [row] = json.loads(capsys.readouterr().out)
+    assert (row["filename"], row["size_bytes"]) == ("b.txt", 2 << 20)
+    cmd_list(cfg, meta, ["--json", "--type", "pdf"])
+    assert json.loads(capsys.readouterr().out) == []
+
+
+def test_delete_many(meta):
+    meta.upsert_many([("a.txt", 1, None), ("b.txt", 1, None), ("c.txt", 1, None)])
+    meta.delete_many(["a.txt", "c.txt"])
+    assert meta.list_files() == ["b.txt"]
+
+
+def test_uses_wal_journal(meta):
+    mode = meta._connect().execute("PRAGMA journal_mode").fetchone()[0]
+    assert mode == "wal"
+
+
+def test_description_cache_hits_and_misses(meta):
+    assert meta.cached_description("k1") is None
+    meta.cache_descriptions([("k1", "cached desc")], max_entries=10)
+    assert meta.cached_description("k1") == "cached desc"
+    stats = meta.cache_stats()
+    assert (stats["entries"], stats["hits"], stats["misses"]) == (1, 1, 1)
+
+
+def test_description_cache_evicts_least_recently_used(meta):
+    meta.cache_descriptions([("old", "a")], max_entries=2)
+    meta._connect().execute("UPDATE desc_cache SET last_used = 0 WHERE cache_key='old'")
+    meta.cache_descriptions([("new1", "b"), ("new2", "c")], max_entries=2)
+    assert meta.cached_description("old") is None
+    assert meta.cache_stats()["entries"] == 2
+
+
+def test_search_ranks_name_matches_first(meta):
+    meta.upsert_many([("budget.csv", 1, None), ("notes.txt", 1, None)])
+    meta.set_description("notes.txt", "Meeting notes about the budget")
+    results = meta.search("budget")
+    assert [r["filename"] for r in results] == ["budget.csv", "notes.txt"]
+    assert "[budget]" in results[1]["snippet"]
+
+
+def test_search_covers_samples_and_prefixes(meta):
+    meta.upsert("main.py", 1)
+    meta.set_search_samples([("main.py", "import argparse\ndef parse_arguments(): ...")])
+    assert [r["filename"] for r in meta.search("argpa")] == ["main.py"]
+
+
+def test_search_index_follows_deletes_and_new_descriptions(meta):
+    meta.upsert("a.txt", 1)
+    meta.set_description("a.txt", "old words")
+    meta.set_description("a.txt", "fresh words")
+    assert meta.search("old") == []
+    assert len(meta.search("fresh")) == 1
+    meta.delete("a.txt")
+    assert meta.search("fresh") == []
+
+
+def test_search_index_backfills_existing_rows(tmp_path):
+    db = tmp_path / "db.sqlite3"
+    first = MetaStore(db)
+    first.upsert("report.pdf", 1)
+    first._connect().execute("DROP TABLE files_fts")
+    first.close()
+    assert [r["filename"] for r in MetaStore(db).search("report")] == ["report.pdf"]
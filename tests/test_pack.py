@@ -0,0 +1,150 @@
+from __future__ import annotations
+import io
+import random
+import pytest
+from config import Config
+from core.pack import Pack, export_vault, import_pack, open_pack
+from core.preview import render
+from core.vault import add_file, add_many, init_vault, paste_files, restore_version, vault_path
+
+
+@pytest.fixture
+def other(tmp_path):
+    # A second, empty vault to import into
+    vault = tmp_path / "other"
+    other_cfg = Config(vault_dir=vault, db_path=vault / "metadata.sqlite3", paste_dir=tmp_path / "out2")
+    store = init_vault(other_cfg)
+    yield other_cfg, store
+    store.close()
+
+
+def export(cfg, meta, tmp_path):
+    path = tmp_path / "vault.pack"
+    with open(path, "wb") as f:
+        export_vault(cfg, meta, f)
+    return path
+
+
+class PipeOnly:
+    # Something to write to that cannot seek or tell, like stdout into a pipe
+    def __init__(self) -> None:
+        self.buf = io.BytesIO()
+
+    def write(self, data) -> int:
+        return self.buf.write(data)
+
+
+def test_round_trip_keeps_contents_and_metadata(cfg, meta, add, other, tmp_path):
+    add("notes.txt", b"remember the milk\n")
+    add("data.bin", bytes(range(256)) * 10)
+    meta.set_description("notes.txt", "shopping list")
+    added_at = meta.get_entry("notes.txt")["added_at"]
+    pack = export(cfg, meta, tmp_path)
+    other_cfg, other_meta = other
+    report = import_pack(other_cfg, other_meta, pack)
+    assert sorted(report.added) == ["data.bin", "notes.txt"]
+    assert report.blobs_written == 2
+    entry = other_meta.get_entry("notes.txt")
+    assert (entry["description"], entry["added_at"]) == ("shopping list", added_at)
+    assert vault_path(other_cfg, other_meta, "data.bin").read_bytes() == bytes(range(256)) * 10
+    # Search samples and previews come along, so nothing has to be re-read
+    assert [r["filename"] for r in other_meta.search("milk")] == ["notes.txt"]
+    assert other_meta.get_preview("notes.txt")["head"] == b"remember the milk\n"
+
+
+def test_export_streams_to_an_unseekable_target(cfg, meta, add, tmp_path):
+    add("a.txt", b"alpha")
+    pipe = PipeOnly()
+    export_vault(cfg, meta, pipe)
+    packed = tmp_path / "piped.pack"
+    packed.write_bytes(pipe.buf.getvalue())
+    with Pack(packed) as pack:
+        [(digest, _)] = pack.blobs.items()
+        assert pack.open(digest).read() == b"alpha"
+
+
+def test_compressed_blobs_stay_compressed(cfg, meta, other, tmp_path):
+    data = b"a very repetitive line\n" * 2000
+    src = tmp_path / "src" / "log.txt"
+    src.parent.mkdir()
+    src.write_bytes(data)
+    add_many(cfg, meta, [(src, "log.txt")], compression="zlib")
+    pack = export(cfg, meta, tmp_path)
+    with Pack(pack) as opened:
+        [[_, length, codec, size]] = opened.blobs.values()
+    assert (codec, size) == ("zlib", len(data))
+    assert length < len(data) // 4
+    other_cfg, other_meta = other
+    import_pack(other_cfg, other_meta, pack)
+    assert other_meta.get_entry("log.txt")["codec"] == "zlib"
+    paste_files(other_cfg, other_meta, ["log.txt"], tmp_path / "pasted")
+    assert (tmp_path / "pasted" / "log.txt").read_bytes() == data
+
+
+def test_versions_and_flat_files_are_packed(cfg, meta, add, other, tmp_path, monkeypatch):
+    monkeypatch.setattr("builtins.input", lambda *a: "y")
+    big = random.Random(1).randbytes(2 << 20)
+    add("big.bin", big)
+    add("big.bin", big + b"more")
+    (cfg.vault_dir / "old.txt").write_text("from before blobs")
+    meta.upsert("old.txt", 17)
+    pack = export(cfg, meta, tmp_path)
+    other_cfg, other_meta = other
+    report = import_pack(other_cfg, other_meta, pack)
+    assert sorted(report.added) == ["big.bin", "old.txt"]
+    assert vault_path(other_cfg, other_meta, "old.txt").read_text() == "from before blobs"
+    restored = restore_version(other_cfg, other_meta, "big.bin", 1, tmp_path / "restore")
+    assert restored.read_bytes() == big
+
+
+def test_conflicts_skip_or_overwrite(cfg, meta, add, other, tmp_path):
+    add("a.txt", b"from the pack")
+    pack = export(cfg, meta, tmp_path)
+    other_cfg, other_meta = other
+    mine = tmp_path / "mine" / "a.txt"
+    mine.parent.mkdir()
+    mine.write_bytes(b"mine")
+    add_file(other_cfg, other_meta, mine)
+    assert import_pack(other_cfg, other_meta, pack).skipped == ["a.txt"]
+    assert vault_path(other_cfg, other_meta, "a.txt").read_bytes() == b"mine"
+    import_pack(other_cfg, other_meta, pack, policy="overwrite")
+    assert vault_path(other_cfg, other_meta, "a.txt").read_bytes() == b"from the pack"
+    # What the vault had is kept as a version
+    assert [v["version"] for v in other_meta.versions("a.txt")] == [1]
+
+
+def test_damaged_blob_is_not_imported(cfg, meta, add, other, tmp_path):
+    add("a.txt", b"alpha")
+    add("b.txt", b"bravo")
+    pack = export(cfg, meta, tmp_path)
+    data = bytearray(pack.read_bytes())
+    at = data.index(b"bravo")
+    data[at:at + 5] = b"BRAVO"
+    pack.write_bytes(bytes(data))
+    other_cfg, other_meta = other
+    report = import_pack(other_cfg, other_meta, pack, batch_size=1)
+    assert report.added == ["a.txt"]
+    assert report.missing == ["b.txt"]
+    assert other_meta.get_entry("b.txt") is None
+
+
+def test_incomplete_pack_is_refused(cfg, meta, add, tmp_path):
+    add("a.txt", b"alpha")
+    pack = export(cfg, meta, tmp_path)
+    pack.write_bytes(pack.read_bytes()[:-10])
+    with pytest.raises(ValueError):
+        Pack(pack)
+
+
+def test_paste_and_preview_straight_from_a_pack(cfg, meta, add, tmp_path):
+    add("hello.py", b"print('hello')\n")
+    pack_path = export(cfg, meta, tmp_path)
+    with open_pack(pack_path) as (pack, pack_meta):
+        pasted = paste_files(cfg, pack_meta, ["hello.py"], tmp_path / "pasted", pack=pack)
+        # No stored snippet: the preview reads the head out of the pack
+        with pack_meta._connect() as con:
+            con.execute("DELETE FROM previews")
+        out = render(pack_meta, cfg.vault_dir, "hello.py", ["cat"], pack=pack)
+    assert pasted == ["hello.py"]
+    assert (tmp_path / "pasted" / "hello.py").read_bytes() == b"print('hello')\n"
+    assert b"print('hello')" in out
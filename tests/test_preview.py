@@ -0,0 +1,133 @@
+from __future__ import annotations
+import subprocess
+import sys
+import pytest
+from pathlib import Path
+from config import Config
+from core.preview_server import PreviewServer
+from core.vault import init_vault, add_file
+from ui.fzf_ui import PREVIEW_CLIENT
+
+
+@pytest.fixture
+def cfg(tmp_path):
+    vault_dir = tmp_path / "vault"
+    return Config(vault_dir=vault_dir, db_path=vault_dir / "metadata.sqlite3", paste_dir=tmp_path / "paste")
+
+
+@pytest.fixture
+def vault(cfg, tmp_path):
+    meta = init_vault(cfg)
+    f = tmp_path / "hello.py"
+    f.write_text("print('hello')\n")
+    add_file(cfg, meta, f)
+    meta.set_description("hello.py", "Greets the world")
+    return meta
+
+
+@pytest.fixture
+def server(cfg, vault):
+    srv = PreviewServer(cfg.db_path, cfg.vault_dir)
+    srv.preview_cmd = ["cat"]  # keep output independent of whether bat is installed
+    with srv:
+        yield srv
+
+
+def _client(server, name):
+    return subprocess.run(
+        [sys.executable, "-S", str(PREVIEW_CLIENT), str(server.socket_path), name],
+        capture_output=True, check=True,
+    ).stdout.decode()
+
+
+def test_client_prints_preview_from_server(server):
+    out = _client(server, "hello.py")
+    assert "Description: Greets the world" in out
+    assert "print('hello')" in out
+
+
+def test_missing_file_preview(server):
+    assert "(file not found in vault)" in _client(server, "ghost.txt")
+
+
+def test_previews_are_cached_until_description_changes(server, vault):
+    first = server.preview("hello.py")
+    assert server.preview("hello.py") is first
+    vault.set_description("hello.py", "Updated")
+    assert b"Updated" in server.preview("hello.py")
+
+
+def test_cache_is_bounded(server):
+    server.cache_entries = 2
+    for name in ("a", "b", "c"):
+        server.preview(name)
+    assert len(server._cache) == 2
+
+
+def test_stop_removes_socket(cfg, vault):
+    srv = PreviewServer(cfg.db_path, cfg.vault_dir).start()
+    path = srv.socket_path
+    assert path.exists()
+    srv.stop()
+    assert not path.exists()
+
+
+def test_compressed_blob_preview_is_decompressed(cfg, tmp_path):
+    from dataclasses import replace
+    from core.preview import render
+
+    zcfg = replace(cfg, compression="zlib")
+    meta = init_vault(zcfg)
+    f = tmp_path / "app.log"
+    f.write_text("".join(f"line {i}\n" for i in range(5000)))
+    add_file(zcfg, meta, f)
+    assert meta.get_entry("app.log")["codec"] == "zlib"
+    out = render(meta, cfg.vault_dir, "app.log", ["cat"], max_lines=3)
+    assert out.endswith(b"line 0\nline 1\nline 2\n")
+
+
+def test_preview_is_served_from_the_stored_snippet(cfg, vault):
+    from core.preview import render
+    from core.vault import vault_path
+
+    row = vault.get_preview("hello.py")
+    assert row["head"] == b"print('hello')\n" and row["kind"] == "text" and row["line_count"] == 1
+    # the blob is not even opened once the snippet is stored
+    vault_path(cfg, vault, "hello.py").unlink()
+    out = render(vault, cfg.vault_dir, "hello.py", ["cat"])
+    assert out.endswith(b"print('hello')\n") and b"1 lines" in out
+
+
+def test_missing_snippet_is_read_from_the_head_and_kept(cfg, vault):
+    from core.preview import render
+
+    vault._con.execute("DELETE FROM previews")
+    out = render(vault, cfg.vault_dir, "hello.py", ["sh", "-c", "tr a-z A-Z", "x"])
+    assert out.endswith(b"PRINT('HELLO')\n")
+    assert vault.get_preview("hello.py")["head"] == b"print('hello')\n"
+
+
+def test_long_and_binary_files_get_bounded_previews(cfg, vault, tmp_path):
+    from core.preview import render
+    from core.sampler import PREVIEW_LINES
+
+    big = tmp_path / "big.txt"
+    big.write_text("".join(f"row {i}\n" for i in range(50_000)))
+    png = tmp_path / "pic.png"
+    png.write_bytes(b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 10)
+    add_file(cfg, vault, big)
+    add_file(cfg, vault, png)
+    row = vault.get_preview("big.txt")
+    assert row["line_count"] == 50_000 and row["truncated"]
+    assert len(row["head"].splitlines()) == PREVIEW_LINES
+    out = render(vault, cfg.vault_dir, "big.txt", ["cat"])
+    assert b"50,000 lines" in out and out.endswith(f"[... first {PREVIEW_LINES} lines shown]\n".encode())
+    assert b"(PNG image, no text preview)" in render(vault, cfg.vault_dir, "pic.png", ["cat"])
+
+
+def test_snippets_are_dropped_with_their_blob(cfg, vault):
+    from core.vault import remove_files
+
+    digest = vault.get_digest("hello.py")
+    remove_files(cfg, vault, ["hello.py"])
+    assert vault._con.execute("SELECT 1 FROM previews WHERE digest=?", (digest,)).fetchone() is None
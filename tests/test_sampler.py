@@ -0,0 +1,54 @@
+from __future__ import annotations
+import pytest
+from pathlib import Path
+from core.sampler import GAP, count_lines, is_binary, read_sample
+
+
+def test_is_binary():
+    assert is_binary(b"PK\x03\x04\x00\x00")
+    assert is_binary(bytes(range(1, 32)) * 10)
+    assert not is_binary("héllo wörld\n\ttabbed".encode())
+    assert not is_binary(b"")
+
+
+def test_small_file_read_whole(tmp_path):
+    f = tmp_path / "a.txt"
+    f.write_text("hello\nworld\n")
+    sample = read_sample(f, 100)
+    assert (sample.text, sample.is_binary, sample.size, sample.truncated) == ("hello\nworld\n", False, 12, False)
+
+
+def test_reads_only_max_bytes_of_huge_file(tmp_path):
+    f = tmp_path / "huge.log"
+    with open(f, "wb") as out:
+        out.write(b"start\n")
+        out.truncate(4 * 1024 ** 3)  # sparse 4 GB file: nothing is allocated unless read
+    sample = read_sample(f, 1000)
+    assert len(sample.text) <= 1000
+    assert sample.truncated and sample.size == 4 * 1024 ** 3
+
+
+def test_spread_sample_covers_head_middle_and_tail(tmp_path):
+    f = tmp_path / "big.txt"
+    f.write_text("HEAD" + "." * 10_000 + "MIDDLE" + "." * 10_000 + "TAIL")
+    sample = read_sample(f, 300, spread=True)
+    head, middle, tail = sample.text.split(GAP)
+    assert head.startswith("HEAD")
+    assert "MIDDLE" in middle
+    assert tail.endswith("TAIL")
+
+
+def test_binary_file_has_no_text(tmp_path):
+    f = tmp_path / "img.png"
+    f.write_bytes(b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR" * 100)
+    sample = read_sample(f, spread=True)
+    assert sample.is_binary and sample.text == ""
+
+
+@pytest.mark.parametrize("content, expected", [
+    ("", 0), ("one", 1), ("one\n", 1), ("a\nb\nc", 3), ("a\n\n\n", 3),
+])
+def test_count_lines_matches_splitlines(tmp_path, content, expected):
+    f = tmp_path / "f.txt"
+    f.write_text(content)
+    assert count_lines(f) == expected == len(content.splitlines())
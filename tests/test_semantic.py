@@ -0,0 +1,95 @@
+from __future__ import annotations
+import pytest
+from core.metadata import MetaStore
+
+pytest.importorskip("numpy")
+
+from core.semantic import SemanticIndex, features, index_files, forget_files
+
+
+@pytest.fixture
+def meta(tmp_path):
+    return MetaStore(tmp_path / "vault" / "metadata.sqlite3")
+
+
+@pytest.fixture
+def index(tmp_path, meta):
+    return SemanticIndex(tmp_path / "vault", meta)
+
+
+def _add(meta, name, desc):
+    meta.upsert(name, 1)
+    meta.set_description(name, desc)
+
+
+def test_features_are_stable():
+    assert features("Quarterly sales report") == features("quarterly SALES report")
+
+
+def test_query_ranks_related_description_first(meta, index):
+    _add(meta, "sales.csv", "A CSV file containing quarterly sales figures by region")
+    _add(meta, "grades.py", "A Python script that calculates student grades")
+    _add(meta, "todo.md", "Markdown checklist of chores for the weekend")
+    index.rebuild()
+    assert index.query("sales by region", k=1)[0][0] == "sales.csv"
+    assert index.query("python grading script", k=1)[0][0] == "grades.py"
+
+
+def test_incremental_add_and_remove_reuse_rows(tmp_path, meta, index):
+    _add(meta, "a.txt", "notes about astronomy and telescopes")
+    index.rebuild()
+    _add(meta, "b.txt", "recipe for sourdough bread")
+    index_files(tmp_path / "vault", meta, ["b.txt"])
+    assert index.query("sourdough", k=1)[0][0] == "b.txt"
+
+    forget_files(tmp_path / "vault", meta, ["b.txt"])
+    assert [name for name, _ in index.query("sourdough")] == []
+    _add(meta, "c.txt", "guide to growing tomatoes")
+    index_files(tmp_path / "vault", meta, ["c.txt"])
+    # the freed row is reused instead of growing the matrix
+    assert meta.semantic_names([1]) == {1: "c.txt"}
+
+
+def test_index_files_is_noop_until_built(tmp_path, meta):
+    _add(meta, "a.txt", "anything")
+    index_files(tmp_path / "vault", meta, ["a.txt"])
+    assert not (tmp_path / "vault" / "semantic").exists()
+
+
+def test_imported_files_join_the_index(tmp_path, monkeypatch):
+    from cli import cmd_export, cmd_import
+    from config import Config
+    from core.vault import add_file, init_vault
+
+    def vault(name):
+        root = tmp_path / name
+        cfg = Config(vault_dir=root, db_path=root / "metadata.sqlite3", paste_dir=tmp_path / "out")
+        return cfg, init_vault(cfg)
+
+    src_cfg, src_meta = vault("from")
+    f = tmp_path / "bread.txt"
+    f.write_text("flour water salt")
+    add_file(src_cfg, src_meta, f)
+    src_meta.set_description("bread.txt", "recipe for sourdough bread")
+    cmd_export(src_cfg, src_meta, [str(tmp_path / "v.pack")])
+
+    cfg, meta = vault("to")
+    _add(meta, "a.txt", "notes about astronomy and telescopes")
+    SemanticIndex(cfg.vault_dir, meta).rebuild()
+    cmd_import(cfg, meta, [str(tmp_path / "v.pack")])
+    assert SemanticIndex(cfg.vault_dir, meta).query("sourdough", k=1)[0][0] == "bread.txt"
+
+
+def test_strays_adopted_by_fsck_join_the_index(tmp_path):
+    from config import Config
+    from core.fsck import check_vault
+    from core.vault import init_vault
+
+    root = tmp_path / "v"
+    cfg = Config(vault_dir=root, db_path=root / "metadata.sqlite3", paste_dir=tmp_path / "out")
+    meta = init_vault(cfg)
+    _add(meta, "a.txt", "notes about astronomy and telescopes")
+    SemanticIndex(root, meta).rebuild()
+    (root / "sourdough_recipe.txt").write_text("flour water salt")
+    check_vault(cfg, meta, repair=True)
+    assert SemanticIndex(root, meta).query("sourdough recipe", k=1)[0][0] == "sourdough_recipe.txt"
@@ -0,0 +1,49 @@
+from __future__ import annotations
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO = Path(__file__).resolve().parent.parent
+
+# Total import time allowed for `locky list`, interpreter startup included (python -X importtime).
+# Today it is well under 100 ms; importing the Anthropic SDK alone costs over a second.
+COLD_START_BUDGET_MS = 300
+# Modules that only the AI, semantic-search or fzf paths may load
+HEAVY_MODULES = ("anthropic", "httpx", "pydantic", "numpy", "socketserver", "asyncio")
+
+
+def _run_list(tmp_path) -> tuple[set[str], float]:
+    # Run `locky list` in a fresh interpreter and return (imported modules, total import ms)
+    env = dict(os.environ, TEMPVAULT_DIR=str(tmp_path / "vault"), PYTHONPATH=str(REPO))
+    env.pop("ANTHROPIC_API_KEY", None)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c",
+         "import sys; sys.argv = ['locky', 'list']; import cli; cli.main()"],
+        capture_output=True, text=True, env=env, cwd=REPO, check=True,
+    )
+    modules = set()
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        modules.add(name.strip())
+        # Top-level imports have a single space before the name; their cumulative times add up
+        if not name.startswith("  "):
+            total_us += int(cumulative)
+    return modules, total_us / 1000
+
+
+def test_list_does_not_load_heavy_modules(tmp_path):
+    modules, _ = _run_list(tmp_path)
+    loaded = {m for m in modules if m.split(".")[0] in HEAVY_MODULES}
+    assert not loaded, f"`locky list` imported {sorted(loaded)}"
+
+
+def test_list_cold_start_budget(tmp_path):
+    _run_list(tmp_path)  # warm the bytecode cache
+    _, total_ms = min((_run_list(tmp_path) for _ in range(3)), key=lambda r: r[1])
+    assert total_ms < COLD_START_BUDGET_MS, f"import time {total_ms:.0f} ms > {COLD_START_BUDGET_MS} ms"
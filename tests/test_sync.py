@@ -0,0 +1,155 @@
+from __future__ import annotations
+import os
+import random
+import pytest
+from config import Config
+from core import sync
+from core.metadata import MetaStore
+from core.sync import sync_vault
+from core.vault import migrate_vault, remove_files, vault_path
+from utils.delta import delta_copy
+
+
+def mirrored(cfg, mirror, name):
+    # The contents the mirror holds for name, read the way a vault opened there would
+    with MetaStore(mirror / cfg.db_path.name) as store:
+        return vault_path(Config(mirror, mirror / cfg.db_path.name, mirror), store, name).read_bytes()
+
+
+def test_first_sync_copies_everything_and_mirror_opens_as_a_vault(cfg, meta, add, tmp_path):
+    add("a.txt", b"alpha")
+    add("b.txt", b"beta")
+    report = sync_vault(cfg, meta, tmp_path / "mirror")
+    assert report.copied == 3  # two blobs and the database
+    assert mirrored(cfg, tmp_path / "mirror", "b.txt") == b"beta"
+
+
+def test_resync_only_sends_what_changed(cfg, meta, add, tmp_path):
+    add("a.txt", b"alpha")
+    sync_vault(cfg, meta, tmp_path / "mirror")
+    add("c.txt", b"gamma")
+    report = sync_vault(cfg, meta, tmp_path / "mirror")
+    assert report.unchanged == 1
+    assert report.copied + report.patched == 2  # the new blob and the database
+    assert mirrored(cfg, tmp_path / "mirror", "c.txt") == b"gamma"
+
+
+def test_removed_entries_leave_the_mirror(cfg, meta, add, tmp_path):
+    add("a.txt", b"alpha")
+    sync_vault(cfg, meta, tmp_path / "mirror")
+    blob = tmp_path / "mirror" / meta.get_entry("a.txt")["path"]
+    remove_files(cfg, meta, ["a.txt"])
+    report = sync_vault(cfg, meta, tmp_path / "mirror")
+    assert report.deleted == 1
+    assert not blob.exists()
+    assert not (tmp_path / "mirror" / sync.PENDING_DELETES).exists()
+
+
+def test_changed_large_file_is_sent_as_a_delta(cfg, meta, add, tmp_path, monkeypatch):
+    monkeypatch.setattr("builtins.input", lambda *a: "y")
+    data = bytearray(random.Random(1).randbytes(300_000))
+    add("big.bin", bytes(data))
+    sync_vault(cfg, meta, tmp_path / "mirror", delta_min=100_000)
+    data[150_000:150_010] = b"0123456789"
+    add("big.bin", bytes(data))
+    report = sync_vault(cfg, meta, tmp_path / "mirror", delta_min=100_000)
+    assert report.patched == 2  # the blob, from the one it replaced, and the database
+    assert report.bytes_sent < len(data) // 4
+    assert mirrored(cfg, tmp_path / "mirror", "big.bin") == bytes(data)
+
+
+def test_interrupted_sync_resumes(cfg, meta, add, tmp_path, monkeypatch):
+    for i in range(4):
+        add(f"f{i}.txt", f"file {i}".encode())
+    real_copy = sync.copy_file
+    calls = []
+
+    def flaky_copy(src, dst, stats=None):
+        calls.append(src)
+        if len(calls) == 3:
+            raise OSError("disk went away")
+        return real_copy(src, dst, stats)
+
+    monkeypatch.setattr(sync, "copy_file", flaky_copy)
+    with pytest.raises(OSError):
+        sync_vault(cfg, meta, tmp_path / "mirror")
+    monkeypatch.setattr(sync, "copy_file", real_copy)
+    report = sync_vault(cfg, meta, tmp_path / "mirror")
+    assert report.unchanged == 2
+    assert report.copied == 3  # the two blobs never sent, and the database
+    for i in range(4):
+        assert mirrored(cfg, tmp_path / "mirror", f"f{i}.txt") == f"file {i}".encode()
+
+
+def test_half_written_file_is_reused_on_retry(cfg, meta, add, tmp_path):
+    data = random.Random(2).randbytes(200_000)
+    add("big.bin", data)
+    relpath = meta.get_entry("big.bin")["path"]
+    part = tmp_path / "mirror" / (relpath + ".part")
+    part.parent.mkdir(parents=True)
+    part.write_bytes(data[:150_000])
+    report = sync_vault(cfg, meta, tmp_path / "mirror", delta_min=100_000)
+    assert report.patched == 1
+    database = report.bytes_total - len(data)  # copied whole: no older copy on the mirror
+    assert report.bytes_sent - database < 60_000
+    assert (tmp_path / "mirror" / relpath).read_bytes() == data
+    assert not part.exists()
+
+
+def test_reshard_moves_blobs_on_the_mirror(cfg, meta, add, tmp_path):
+    add("a.txt", b"alpha")
+    sync_vault(cfg, meta, tmp_path / "mirror")
+    migrate_vault(cfg, meta, fanout=2)
+    report = sync_vault(cfg, meta, tmp_path / "mirror")
+    assert report.moved == 1
+    assert mirrored(cfg, tmp_path / "mirror", "a.txt") == b"alpha"
+
+
+def test_changed_flat_file_is_resent(cfg, meta, tmp_path):
+    (cfg.vault_dir / "old.txt").write_text("v1")
+    meta.upsert("old.txt", 2)
+    sync_vault(cfg, meta, tmp_path / "mirror")
+    (cfg.vault_dir / "old.txt").write_text("v2!")
+    os.utime(cfg.vault_dir / "old.txt", ns=(1, 1))
+    sync_vault(cfg, meta, tmp_path / "mirror")
+    assert (tmp_path / "mirror" / "old.txt").read_text() == "v2!"
+
+
+def test_verify_restores_files_deleted_from_the_mirror(cfg, meta, add, tmp_path):
+    add("a.txt", b"alpha")
+    sync_vault(cfg, meta, tmp_path / "mirror")
+    (tmp_path / "mirror" / meta.get_entry("a.txt")["path"]).unlink()
+    assert sync_vault(cfg, meta, tmp_path / "mirror", verify=True).copied == 2
+    assert mirrored(cfg, tmp_path / "mirror", "a.txt") == b"alpha"
+
+
+def test_verify_resends_files_damaged_on_the_mirror(cfg, meta, add, tmp_path):
+    add("a.txt", b"alpha")
+    sync_vault(cfg, meta, tmp_path / "mirror")
+    blob = tmp_path / "mirror" / meta.get_entry("a.txt")["path"]
+    os.chmod(blob, 0o644)
+    blob.write_bytes(b"alphA")  # same size, different bytes
+    assert sync_vault(cfg, meta, tmp_path / "mirror").unchanged == 1
+    report = sync_vault(cfg, meta, tmp_path / "mirror", verify=True)
+    assert (report.copied, report.unchanged) == (2, 0)
+    assert mirrored(cfg, tmp_path / "mirror", "a.txt") == b"alpha"
+    assert sync_vault(cfg, meta, tmp_path / "mirror", verify=True).unchanged == 1
+
+
+def test_mirror_inside_vault_is_refused(cfg, meta):
+    with pytest.raises(ValueError):
+        sync_vault(cfg, meta, cfg.vault_dir / "mirror")
+
+
+def test_delta_copy_handles_insertions_and_unrelated_files(tmp_path):
+    rng = random.Random(3)
+    basis = bytearray(rng.randbytes(100_000))
+    (tmp_path / "basis").write_bytes(basis)
+    changed = basis[:40_000] + b"inserted!" + basis[40_000:90_000] + basis[91_000:]
+    (tmp_path / "src").write_bytes(changed)
+    literal = delta_copy(tmp_path / "src", tmp_path / "basis", tmp_path / "out", block=4096)
+    assert (tmp_path / "out").read_bytes() == changed
+    assert literal < 4 * 4096  # the blocks around each edit, and the short tail
+    (tmp_path / "src").write_bytes(rng.randbytes(50_000))
+    assert delta_copy(tmp_path / "src", tmp_path / "basis", tmp_path / "out") == 50_000
+    assert (tmp_path / "out").read_bytes() == (tmp_path / "src").read_bytes()
@@ -0,0 +1,47 @@
+from __future__ import annotations
+import json
+import pytest
+from core.metadata import MetaStore
+from utils import trace
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    yield
+    trace.finish()
+
+
+def test_disabled_spans_are_a_shared_noop():
+    assert not trace.ENABLED
+    assert trace.span("a") is trace.span("b", file="x")
+    trace.add("bytes.read", 10)
+    assert trace._counters == {}
+
+
+def test_summary_covers_spans_counters_and_sql(tmp_path, capsys):
+    trace.enable()
+    meta = MetaStore(tmp_path / "t.sqlite3")
+    with trace.span("outer"):
+        meta.upsert("a.txt", 1, "d1")
+    trace.add("bytes.read", 2_000_000)
+    assert trace._spans["outer"][0] == 1 and trace._spans["meta.upsert"][0] == 1
+    assert trace._counters["sql.statements"] > 0
+    trace.finish()
+    err = capsys.readouterr().err
+    assert "meta.upsert" in err and "2.00 MB" in err
+    assert not trace.ENABLED
+
+
+def test_jsonl_trace(tmp_path):
+    out = tmp_path / "trace.jsonl"
+    trace.enable(str(out))
+    with trace.span("add.copy", file="a.txt"):
+        pass
+    with pytest.raises(ValueError):
+        with trace.span("boom"):
+            raise ValueError
+    trace.finish()
+    events = [json.loads(line) for line in out.read_text().splitlines()]
+    assert events[0]["span"] == "add.copy" and events[0]["file"] == "a.txt"
+    assert events[1]["error"] is True
+    assert "counters" in events[-1]
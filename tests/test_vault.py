@@ -3,7 +3,12 @@ import pytest
 from pathlib import Path
 from config import Config
 from core.metadata import MetaStore
-from core.vault import init_vault, add_file, paste_files, remove_files
+from core.blobs import BlobStore
+from core.vault import (
+    PASTE_MANIFEST, init_vault, add_file, add_many, iter_sources, migrate_vault, paste_files, paste_many,
+    remove_files, vault_path,
+)
+from utils.file_utils import CopyStats, copy_file, hash_file
 
 
 @pytest.fixture
@@ -31,7 +36,18 @@ def sample_file(tmp_path):
 
 def test_add_file_copies_to_vault(cfg, meta, sample_file):
     add_file(cfg, meta, sample_file)
-    assert (cfg.vault_dir / "hello.txt").exists()
+    blob = BlobStore(cfg.vault_dir).path(hash_file(sample_file))
+    assert blob.read_text() == "hello from locky"
+    assert vault_path(cfg, meta, "hello.txt") == blob
+
+
+def test_identical_content_is_stored_once(cfg, meta, sample_file, tmp_path):
+    twin = tmp_path / "twin.txt"
+    twin.write_text("hello from locky")
+    add_file(cfg, meta, sample_file)
+    add_file(cfg, meta, twin)
+    assert meta.get_digest("hello.txt") == meta.get_digest("twin.txt")
+    assert len(list((cfg.vault_dir / "blobs").rglob("*"))) == 2  # one shard dir + one blob
 
 
 def test_add_file_registers_in_metadata(cfg, meta, sample_file):
@@ -47,25 +63,365 @@ def test_add_file_not_found_raises(cfg, meta, tmp_path):
 def test_paste_files_copies_to_dest(cfg, meta, sample_file):
     add_file(cfg, meta, sample_file)
     cfg.paste_dir.mkdir(parents=True, exist_ok=True)
-    pasted = paste_files(cfg, ["hello.txt"], cfg.paste_dir)
+    pasted = paste_files(cfg, meta, ["hello.txt"], cfg.paste_dir)
     assert pasted == ["hello.txt"]
-    assert (cfg.paste_dir / "hello.txt").exists()
+    assert (cfg.paste_dir / "hello.txt").read_text() == "hello from locky"
+
+
+def test_pasted_copy_is_writable_and_independent(cfg, meta, sample_file):
+    add_file(cfg, meta, sample_file)
+    blob = vault_path(cfg, meta, "hello.txt")
+    paste_files(cfg, meta, ["hello.txt"], cfg.paste_dir)
+    (cfg.paste_dir / "hello.txt").write_text("edited")
+    assert blob.read_text() == "hello from locky"
+
+
+def test_paste_link_modes_point_at_the_blob(cfg, meta, sample_file):
+    add_file(cfg, meta, sample_file)
+    blob = vault_path(cfg, meta, "hello.txt")
+    stats = CopyStats()
+    paste_files(cfg, meta, ["hello.txt"], cfg.paste_dir / "hard", "link", stats)
+    paste_files(cfg, meta, ["hello.txt"], cfg.paste_dir / "soft", "symlink", stats)
+    assert (cfg.paste_dir / "hard" / "hello.txt").stat().st_ino == blob.stat().st_ino
+    assert (cfg.paste_dir / "soft" / "hello.txt").resolve() == blob.resolve()
+    assert stats.strategies == {"hardlink": 1, "symlink": 1}
+
+
+def test_overwriting_a_linked_paste_never_touches_the_blob(cfg, meta, sample_file, tmp_path, monkeypatch):
+    monkeypatch.setattr("core.vault.prompt_yes_no", lambda _: True)
+    add_file(cfg, meta, sample_file)
+    paste_files(cfg, meta, ["hello.txt"], cfg.paste_dir, "link")
+    blob = vault_path(cfg, meta, "hello.txt")
+    # a copy pasted over the hard link replaces it rather than writing through it
+    paste_files(cfg, meta, ["hello.txt"], cfg.paste_dir)
+    assert blob.read_text() == "hello from locky"
+    assert (cfg.paste_dir / "hello.txt").stat().st_ino != blob.stat().st_ino
+
+
+def test_copy_file_reports_strategy_and_keeps_contents(tmp_path):
+    src = tmp_path / "big.bin"
+    src.write_bytes(bytes(range(256)) * 4096)
+    stats = CopyStats()
+    strategy = copy_file(src, tmp_path / "out" / "big.bin", stats)
+    assert strategy in ("reflink", "copy_file_range", "sendfile", "buffered")
+    assert (tmp_path / "out" / "big.bin").read_bytes() == src.read_bytes()
+    assert stats.strategies[strategy] == 1 and stats.bytes == src.stat().st_size
+
+
+def test_copy_file_falls_back_when_kernel_copy_is_unsupported(tmp_path, monkeypatch):
+    import errno, fcntl, os
+
+    def unsupported(*args, **kwargs):
+        raise OSError(errno.EXDEV, "cross-device")
+
+    monkeypatch.setattr(os, "copy_file_range", unsupported, raising=False)
+    monkeypatch.setattr(os, "sendfile", unsupported, raising=False)
+    monkeypatch.setattr(fcntl, "ioctl", unsupported)
+    src = tmp_path / "a.txt"
+    src.write_text("x" * 100_000)
+    strategy = copy_file(src, tmp_path / "b.txt")
+    assert strategy == "buffered"
+    assert (tmp_path / "b.txt").read_text() == "x" * 100_000
+
+
+def test_blobs_are_read_only(cfg, meta, sample_file):
+    add_file(cfg, meta, sample_file)
+    assert not vault_path(cfg, meta, "hello.txt").stat().st_mode & 0o222
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    f = tmp_path / "server.log"
+    f.write_text("".join(f"2024-01-01 12:00:{i % 60:02d} INFO request {i} ok\n" for i in range(20000)))
+    return f
+
+
+@pytest.mark.parametrize("mode", ["zlib", "lzma"])
+def test_compressed_add_and_paste_round_trip(cfg, meta, log_file, mode):
+    report = add_many(cfg, meta, [(log_file, "server.log")], compression=mode)
+    assert meta.get_entry("server.log")["codec"] == mode
+    assert report.bytes_stored < report.bytes_copied / 5
+    assert meta.get_entry("server.log")["size_bytes"] == log_file.stat().st_size
+    pasted = paste_files(cfg, meta, ["server.log"], cfg.paste_dir, "link")
+    assert pasted == ["server.log"]
+    # links would expose the compressed bytes, so compressed blobs are always decompressed
+    assert (cfg.paste_dir / "server.log").read_bytes() == log_file.read_bytes()
+
+
+def test_auto_compression_skips_incompressible_and_precompressed(cfg, meta, log_file, tmp_path):
+    import os
+    noise = tmp_path / "noise.bin"
+    noise.write_bytes(os.urandom(200_000))
+    photo = tmp_path / "photo.png"
+    photo.write_bytes(b"\0" * 200_000)
+    add_many(cfg, meta, [(noise, "noise.bin"), (photo, "photo.png"), (log_file, "server.log")], compression="auto")
+    assert meta.get_entry("noise.bin")["codec"] is None
+    assert meta.get_entry("photo.png")["codec"] is None
+    assert meta.get_entry("server.log")["codec"] in ("zlib", "lzma")
+
+
+def test_uncompressed_and_compressed_copies_of_same_content_share_a_blob(cfg, meta, log_file, tmp_path):
+    twin = tmp_path / "twin.log"
+    twin.write_bytes(log_file.read_bytes())
+    add_many(cfg, meta, [(log_file, "server.log")])
+    report = add_many(cfg, meta, [(twin, "twin.log")], compression="zlib")
+    assert report.deduplicated == 1
+    assert meta.get_entry("twin.log")["codec"] is None
 
 
 def test_paste_skips_missing_vault_file(cfg, meta):
     cfg.paste_dir.mkdir(parents=True, exist_ok=True)
-    pasted = paste_files(cfg, ["ghost.txt"], cfg.paste_dir)
+    pasted = paste_files(cfg, meta, ["ghost.txt"], cfg.paste_dir)
     assert pasted == []
 
 
 def test_remove_files_deletes_from_vault_and_meta(cfg, meta, sample_file):
     add_file(cfg, meta, sample_file)
+    blob = vault_path(cfg, meta, "hello.txt")
     remove_files(cfg, meta, ["hello.txt"])
-    assert not (cfg.vault_dir / "hello.txt").exists()
+    assert not blob.exists()
     assert "hello.txt" not in meta.list_files()
 
 
+def test_remove_keeps_blob_while_still_referenced(cfg, meta, sample_file, tmp_path):
+    twin = tmp_path / "twin.txt"
+    twin.write_text("hello from locky")
+    add_file(cfg, meta, sample_file)
+    add_file(cfg, meta, twin)
+    blob = vault_path(cfg, meta, "twin.txt")
+    remove_files(cfg, meta, ["hello.txt"])
+    assert blob.exists()
+    remove_files(cfg, meta, ["twin.txt"])
+    assert not blob.exists()
+
+
+def test_legacy_flat_file_still_resolves(cfg, meta):
+    # Vaults created before the blob store keep files directly in vault_dir
+    (cfg.vault_dir / "old.txt").write_text("legacy")
+    meta.upsert("old.txt", 6)
+    assert vault_path(cfg, meta, "old.txt") == cfg.vault_dir / "old.txt"
+    remove_files(cfg, meta, ["old.txt"])
+    assert not (cfg.vault_dir / "old.txt").exists()
+
+
+def test_migrate_moves_flat_files_into_blob_store(cfg, meta):
+    (cfg.vault_dir / "old.txt").write_text("legacy")
+    meta.upsert("old.txt", 6)
+    meta.set_description("old.txt", "kept")
+    added_at = meta.get_entry("old.txt")["added_at"]
+    report = migrate_vault(cfg, meta)
+    assert report.converted == 1
+    assert not (cfg.vault_dir / "old.txt").exists()
+    entry = meta.get_entry("old.txt")
+    assert entry["digest"] is not None and entry["description"] == "kept" and entry["added_at"] == added_at
+    assert vault_path(cfg, meta, "old.txt").read_text() == "legacy"
+    # a second run has nothing left to do
+    assert migrate_vault(cfg, meta).converted == 0
+
+
+def test_migrate_finishes_an_interrupted_run(cfg, meta, sample_file):
+    (cfg.vault_dir / "old.txt").write_text("legacy")
+    meta.upsert("old.txt", 6)
+    migrate_vault(cfg, meta)
+    # pretend the last run died after committing but before deleting the flat copy
+    (cfg.vault_dir / "old.txt").write_text("legacy")
+    assert migrate_vault(cfg, meta).leftovers == 1
+    assert not (cfg.vault_dir / "old.txt").exists()
+
+
+def test_migrate_reshards_blobs_and_new_adds_follow(cfg, meta, sample_file, tmp_path):
+    add_file(cfg, meta, sample_file)
+    old = vault_path(cfg, meta, "hello.txt")
+    report = migrate_vault(cfg, meta, fanout=2)
+    assert report.moved == 1
+    new = vault_path(cfg, meta, "hello.txt")
+    digest = meta.get_digest("hello.txt")
+    assert new == cfg.vault_dir / "blobs" / digest[:2] / digest[2:4] / digest
+    assert new.read_text() == "hello from locky" and not old.exists()
+    assert [p.name for p in old.parent.iterdir()] == [digest[2:4]]
+    other = tmp_path / "other.txt"
+    other.write_text("second")
+    add_file(cfg, meta, other)
+    d2 = meta.get_digest("other.txt")
+    assert vault_path(cfg, meta, "other.txt") == cfg.vault_dir / "blobs" / d2[:2] / d2[2:4] / d2
+    remove_files(cfg, meta, ["hello.txt"])
+    assert not new.exists()
+
+
+def test_migrate_records_blobs_moved_by_an_interrupted_run(cfg, meta, sample_file):
+    add_file(cfg, meta, sample_file)
+    old = vault_path(cfg, meta, "hello.txt")
+    digest = meta.get_digest("hello.txt")
+    # the file made it to the new place but the run died before recording it
+    target = cfg.vault_dir / "blobs" / digest[:2] / digest[2:4] / digest
+    target.parent.mkdir(parents=True)
+    old.rename(target)
+    migrate_vault(cfg, meta, fanout=2)
+    assert vault_path(cfg, meta, "hello.txt") == target
+
+
 def test_remove_nonexistent_file_is_safe(cfg, meta):
     # Should not raise even if the file was never added
     removed = remove_files(cfg, meta, ["ghost.txt"])
     assert removed == ["ghost.txt"]
+
+
+@pytest.fixture
+def project(tmp_path):
+    root = tmp_path / "proj"
+    (root / "sub").mkdir(parents=True)
+    (root / "a.txt").write_text("alpha")
+    (root / "sub" / "b.py").write_text("print('b')")
+    (root / "sub" / "copy.txt").write_text("alpha")
+    return root
+
+
+def test_iter_sources_walks_directories(project):
+    names = sorted(name for _, name in iter_sources([str(project)]))
+    assert names == ["proj/a.txt", "proj/sub/b.py", "proj/sub/copy.txt"]
+
+
+def test_iter_sources_names_symlinks_by_their_own_path(project, tmp_path):
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    (outside / "t.txt").write_text("elsewhere")
+    (project / "link.txt").symlink_to(outside / "t.txt")
+    (project / "sub" / "alias.txt").symlink_to(project / "a.txt")
+    sources = dict((name, src) for src, name in iter_sources([str(project)]))
+    assert sorted(sources) == [
+        "proj/a.txt", "proj/link.txt", "proj/sub/alias.txt", "proj/sub/b.py", "proj/sub/copy.txt",
+    ]
+    assert sources["proj/link.txt"].read_text() == "elsewhere"
+
+
+def test_iter_sources_expands_globs(project):
+    names = sorted(name for _, name in iter_sources([str(project / "sub" / "*.py")]))
+    assert names == ["b.py"]
+
+
+def test_add_many_stores_tree_and_dedupes(cfg, meta, project):
+    report = add_many(cfg, meta, iter_sources([str(project)]), batch_size=2)
+    assert len(report.added) == 3
+    assert report.deduplicated == 1
+    assert meta.list_files() == ["proj/a.txt", "proj/sub/b.py", "proj/sub/copy.txt"]
+
+
+def test_add_many_reports_unreadable_files_and_keeps_the_rest(cfg, meta, project, monkeypatch):
+    import core.vault as vault
+    hash_file = vault.hash_file
+
+    def unreadable(path):
+        # Permissions can't stop root, so the file fails to open the way it would for a user
+        if path.name == "b.py":
+            raise PermissionError(13, "Permission denied", str(path))
+        return hash_file(path)
+
+    monkeypatch.setattr(vault, "hash_file", unreadable)
+    report = add_many(cfg, meta, iter_sources([str(project)]), batch_size=1)
+    assert [name for name, _ in report.failed] == ["proj/sub/b.py"]
+    assert "Permission denied" in report.failed[0][1]
+    assert sorted(name for name, _ in report.added) == ["proj/a.txt", "proj/sub/copy.txt"]
+    assert meta.list_files() == ["proj/a.txt", "proj/sub/copy.txt"]
+
+
+def test_add_many_skip_policy(cfg, meta, project):
+    add_many(cfg, meta, iter_sources([str(project)]))
+    report = add_many(cfg, meta, iter_sources([str(project)]), policy="skip")
+    assert report.added == []
+    assert len(report.skipped) == 3
+
+
+def test_add_many_rename_policy(cfg, meta, project):
+    add_many(cfg, meta, [(project / "a.txt", "a.txt")])
+    report = add_many(cfg, meta, [(project / "sub" / "b.py", "a.txt")], policy="rename")
+    assert [name for name, _ in report.added] == ["a (1).txt"]
+    assert meta.list_files() == ["a (1).txt", "a.txt"]
+
+
+def test_add_many_overwrite_policy_keeps_old_blob_until_removed(cfg, meta, project):
+    add_many(cfg, meta, [(project / "a.txt", "a.txt")])
+    old_blob = vault_path(cfg, meta, "a.txt")
+    add_many(cfg, meta, [(project / "sub" / "b.py", "a.txt")], policy="overwrite")
+    assert vault_path(cfg, meta, "a.txt").read_text() == "print('b')"
+    # The old contents stay on as version 1 until the name is removed
+    assert old_blob.exists()
+    remove_files(cfg, meta, ["a.txt"])
+    assert not old_blob.exists()
+
+
+@pytest.fixture
+def tree(cfg, meta, tmp_path):
+    # A small project added with its relative paths
+    root = tmp_path / "proj"
+    (root / "src").mkdir(parents=True)
+    (root / "README.md").write_text("readme")
+    (root / "src" / "main.py").write_text("print('main')")
+    add_many(cfg, meta, iter_sources([str(root)]))
+    return ["proj/README.md", "proj/src/main.py"]
+
+
+def test_paste_many_keeps_subpaths_and_writes_a_manifest(cfg, meta, tree, tmp_path):
+    import json
+    dest = tmp_path / "elsewhere"
+    report = paste_many(cfg, meta, tree + ["ghost.txt"], dest, workers=4)
+    assert (dest / "proj" / "src" / "main.py").read_text() == "print('main')"
+    assert report.missing == ["ghost.txt"]
+    doc = json.loads((dest / PASTE_MANIFEST).read_text())
+    assert sorted(f["path"] for f in doc["files"]) == tree
+
+
+def test_paste_policies_for_existing_files(cfg, meta, tree, tmp_path):
+    import os
+    dest = tmp_path / "dest"
+    (dest / "proj" / "src").mkdir(parents=True)
+    (dest / "proj" / "README.md").write_text("mine")
+    (dest / "proj" / "src" / "main.py").write_text("mine")
+    report = paste_many(cfg, meta, tree, dest, policy="skip")
+    assert report.conflicts == tree and report.skipped == tree and report.pasted == []
+    report = paste_many(cfg, meta, tree, dest, policy="rename")
+    assert (dest / "proj" / "README (1).md").read_text() == "readme"
+    assert (dest / "proj" / "README.md").read_text() == "mine"
+    # newer: only files older than the vault entry are replaced
+    os.utime(dest / "proj" / "README.md", (0, 0))
+    report = paste_many(cfg, meta, tree, dest, policy="newer")
+    assert [name for name, _ in report.pasted] == ["proj/README.md"]
+    assert (dest / "proj" / "src" / "main.py").read_text() == "mine"
+    paste_many(cfg, meta, tree, dest, policy="overwrite")
+    assert (dest / "proj" / "src" / "main.py").read_text() == "print('main')"
+
+
+def test_paste_newer_goes_by_the_source_files_mtime(cfg, meta, tmp_path):
+    import os
+    src = tmp_path / "old.txt"
+    src.write_text("from the vault")
+    os.utime(src, (1_000_000, 1_000_000))  # an old file, added just now
+    add_file(cfg, meta, src)
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    (dest / "old.txt").write_text("edited since")
+    os.utime(dest / "old.txt", (2_000_000, 2_000_000))
+    report = paste_many(cfg, meta, ["old.txt"], dest, policy="newer")
+    assert report.pasted == [] and report.skipped == ["old.txt"]
+    os.utime(dest / "old.txt", (500_000, 500_000))
+    report = paste_many(cfg, meta, ["old.txt"], dest, policy="newer")
+    assert (dest / "old.txt").read_text() == "from the vault"
+
+
+def test_paste_asks_once_for_the_whole_batch(cfg, meta, tree, tmp_path, monkeypatch):
+    questions = []
+    monkeypatch.setattr("core.vault.prompt_yes_no", lambda msg: questions.append(msg) or False)
+    paste_many(cfg, meta, tree, tmp_path / "dest", manifest=False)
+    report = paste_many(cfg, meta, tree, tmp_path / "dest", policy="ask")
+    assert len(questions) == 1
+    assert report.skipped == tree
+
+
+def test_bulk_add_without_a_terminal_skips_instead_of_asking(cfg, meta, project, monkeypatch):
+    from cli import cmd_add
+
+    monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+    monkeypatch.setattr("sys.stdin.isatty", lambda: False)
+    monkeypatch.setattr("builtins.input", lambda *a: pytest.fail("prompted"))
+    cmd_add(cfg, meta, [str(project)])
+    cmd_add(cfg, meta, [str(project)])
+    assert meta.list_files() == ["proj/a.txt", "proj/sub/b.py", "proj/sub/copy.txt"]
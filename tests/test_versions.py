@@ -0,0 +1,121 @@
+from __future__ import annotations
+import random
+import pytest
+from config import Config
+from core import chunks
+from core.chunks import CHUNKED, cut_points, read_manifest
+from core.compression import open_blob
+from core.metadata import MetaStore
+from core.sync import sync_vault
+from core.vault import add_file, add_many, remove_files, restore_version, vault_path
+
+
+@pytest.fixture(autouse=True)
+def always_overwrite(monkeypatch):
+    monkeypatch.setattr("builtins.input", lambda *a: "y")
+
+
+def chunk_bytes(cfg) -> int:
+    return sum(p.stat().st_size for p in (cfg.vault_dir / "chunks").rglob("*") if p.is_file())
+
+
+def test_overwrite_keeps_previous_versions(cfg, meta, add, tmp_path):
+    for text in (b"one", b"two", b"three"):
+        add("notes.txt", text)
+    assert [v["version"] for v in meta.versions("notes.txt")] == [1, 2]
+    restored = restore_version(cfg, meta, "notes.txt", 1, tmp_path / "restore")
+    assert restored.read_bytes() == b"one"
+    # The current contents are the newest version
+    assert restore_version(cfg, meta, "notes.txt", 3, tmp_path / "restore").read_bytes() == b"three"
+    with pytest.raises(ValueError):
+        restore_version(cfg, meta, "notes.txt", 4, tmp_path / "restore")
+
+
+def test_readding_same_contents_makes_no_version(cfg, meta, add, tmp_path):
+    add("a.txt", b"same")
+    add("a.txt", b"same")
+    assert meta.versions("a.txt") == []
+
+
+def test_growing_large_file_versions_share_chunks(cfg, meta, add, tmp_path):
+    rng = random.Random(7)
+    data = rng.randbytes(3 << 20)
+    add("app.log", data)
+    versions = [data]
+    for _ in range(3):
+        data += rng.randbytes(100_000)
+        versions.append(data)
+        add("app.log", data)
+    # Four versions of ~3 MB in little more than one copy: only the tail chunks differ
+    assert chunk_bytes(cfg) < len(data) + 2 * chunks.MAX_CHUNK
+    assert not any(p.is_file() for p in (cfg.vault_dir / "blobs").rglob("*") if p.suffix != ".chunks")
+    for n, expected in enumerate(versions, 1):
+        assert restore_version(cfg, meta, "app.log", n, tmp_path / f"v{n}").read_bytes() == expected
+
+
+def test_bulk_overwrite_also_keeps_versions(cfg, meta, tmp_path):
+    data = random.Random(8).randbytes(2 << 20)
+    src = tmp_path / "src" / "big.bin"
+    src.parent.mkdir()
+    src.write_bytes(data)
+    add_many(cfg, meta, [(src, "big.bin")], policy="overwrite")
+    src.write_bytes(data[:1 << 20] + b"edited" + data[1 << 20:])
+    add_many(cfg, meta, [(src, "big.bin")], policy="overwrite")
+    assert meta.get_entry("big.bin")["codec"] == CHUNKED
+    assert meta.versions("big.bin")[0]["codec"] == CHUNKED
+    assert restore_version(cfg, meta, "big.bin", 1, tmp_path / "restore").read_bytes() == data
+
+
+def test_removing_a_file_releases_its_versions_and_chunks(cfg, meta, add, tmp_path):
+    data = random.Random(9).randbytes(2 << 20)
+    add("big.bin", data)
+    add("big.bin", data + b"more")
+    assert chunk_bytes(cfg) > 0
+    remove_files(cfg, meta, ["big.bin"])
+    assert chunk_bytes(cfg) == 0
+    assert not any(p.is_file() for p in (cfg.vault_dir / "blobs").rglob("*"))
+
+
+def test_cut_points_are_the_same_without_numpy(monkeypatch):
+    pytest.importorskip("numpy")
+    data = random.Random(10).randbytes(3 << 20)
+    with_numpy = list(cut_points(data, len(data)))
+    monkeypatch.setattr(chunks, "_load_numpy", lambda: None)
+    assert list(cut_points(data, len(data))) == with_numpy
+    assert with_numpy[-1] == len(data)
+    sizes = [b - a for a, b in zip([0, *with_numpy], with_numpy)]
+    assert all(chunks.MIN_CHUNK <= s <= chunks.MAX_CHUNK for s in sizes[:-1])
+
+
+def test_sync_mirrors_versions_and_chunks(cfg, meta, add, tmp_path):
+    data = random.Random(11).randbytes(2 << 20)
+    add("big.bin", data)
+    add("big.bin", data + b"tail")
+    mirror = tmp_path / "mirror"
+    sync_vault(cfg, meta, mirror)
+    mirror_cfg = Config(mirror, mirror / cfg.db_path.name, tmp_path / "out")
+    with MetaStore(mirror_cfg.db_path) as store:
+        manifest = vault_path(mirror_cfg, store, "big.bin")
+        _, pieces = read_manifest(manifest)
+        assert pieces
+        with open_blob(manifest, CHUNKED) as f:
+            assert f.read() == data + b"tail"
+        old = restore_version(mirror_cfg, store, "big.bin", 1, tmp_path / "restore")
+        assert old.read_bytes() == data
+
+
+def test_history_numbers_are_the_ones_restore_takes(cfg, meta, tmp_path, capsys):
+    from cli import cmd_history
+
+    src = tmp_path / "notes.txt"
+    for text in ("one", "two", "three"):
+        src.write_text(text)
+        add_file(cfg, meta, src)
+    # A gap in the stored numbers, as fsck --repair leaves when a version's contents are gone
+    meta.drop_versions([("notes.txt", 1)])
+    cmd_history(cfg, meta, ["notes.txt"])
+    out = capsys.readouterr().out
+    assert "notes.txt@2" in out and "notes.txt@3" in out and "notes.txt@1" not in out
+    assert "3 bytes" in out and "MB" not in out
+    restored = restore_version(cfg, meta, "notes.txt", 3, tmp_path / "restore")
+    assert restored.read_text() == "three"
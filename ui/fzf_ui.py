@@ -1,8 +1,17 @@
 from __future__ import annotations
+import shlex
 import shutil
+import socket
 import subprocess
+import sys
+from contextlib import nullcontext
 from pathlib import Path
 
+from core.preview_server import PreviewServer
+
+# The preview client is run by path, with -S, so fzf doesn't pay for site-packages on every keystroke
+PREVIEW_CLIENT = Path(__file__).resolve().parent.parent / "core" / "preview_client.py"
+
 def check_fzf() -> bool:
     # Check if the 'fzf' fuzzy finder tool is installed and available in PATH
     return shutil.which("fzf") is not None
@@ -31,26 +40,48 @@ def pick_file_to_add(start_dir: Path) -> Path | None:
     return Path(selected) if selected else None
 
 
-def pick_files(filenames: list[str], db_path: Path, vault_dir: Path) -> list[str]:
-    # If fzf is not installed, print an error and return an empty list
+def pick_files(filenames: list[str], db_path: Path, vault_dir: Path, pack: Path | None = None) -> list[str]:
+    # pack: browsing a pack read-only (db_path is then its unpacked metadata, see core.pack)
+    # Without fzf, fall back to the built-in picker (no preview pane); failing that, give up
     if not check_fzf():
+        from ui import picker
+
+        if picker.available() and sys.stdin.isatty():
+            return picker.pick(db_path)
         print("Error: fzf is not installed")
         return []
 
-    # Build the command to launch fzf with multi-select and file preview
-    cmd = [
-        "fzf",  # fuzzy finder tool
-        "--multi",  # allow selecting multiple files
-        "--preview", f"python -m core.preview {db_path} {vault_dir} {{}}",  # show file preview using your preview module
-        "--preview-window", "right:50%:wrap",  # preview pane on the right, wrap lines
-    ]
+    # Previews come from a server that lives exactly as long as this fzf session;
+    # without Unix sockets, fall back to running the preview module per keystroke
+    server = PreviewServer(db_path, vault_dir, pack_path=pack) if hasattr(socket, "AF_UNIX") else None
+    with server or nullcontext():
+        if server is not None:
+            preview = (
+                f"{shlex.quote(sys.executable)} -S {shlex.quote(str(PREVIEW_CLIENT))} "
+                f"{shlex.quote(str(server.socket_path))} {{}}"
+            )
+        else:
+            preview = (
+                f"{shlex.quote(sys.executable)} -m core.preview "
+                f"{shlex.quote(str(db_path))} {shlex.quote(str(vault_dir))} {{}}"
+            )
+            if pack is not None:
+                preview += f" {shlex.quote(str(pack))}"
+
+        # Build the command to launch fzf with multi-select and file preview
+        cmd = [
+            "fzf",  # fuzzy finder tool
+            "--multi",  # allow selecting multiple files
+            "--preview", preview,  # show file preview through the preview server
+            "--preview-window", "right:50%:wrap",  # preview pane on the right, wrap lines
+        ]
 
-    # Run the fzf command as a subprocess, sending the filenames as input
-    result = subprocess.run(
-        cmd,
-        input="\n".join(filenames).encode(),  # provide the file list as input (one per line)
-        capture_output=True,  # capture the output so we can process it
-    )
+        # Run the fzf command as a subprocess, sending the filenames as input
+        result = subprocess.run(
+            cmd,
+            input="\n".join(filenames).encode(),  # provide the file list as input (one per line)
+            capture_output=True,  # capture the output so we can process it
+        )
 
     # If fzf was cancelled or interrupted, return an empty list
     if result.returncode in (1, 130):
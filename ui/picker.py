@@ -0,0 +1,84 @@
+from __future__ import annotations
+from pathlib import Path
+
+from core.fuzzy import FuzzyMatcher
+from core.metadata import MetaStore
+
+# Built-in picker for when fzf isn't installed: type to filter, Up/Down to move,
+# Tab to mark several entries, Enter to accept, Esc to cancel.
+
+
+def available() -> bool:
+    # curses is missing on some platforms (plain Windows Python)
+    try:
+        import curses  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def pick(db_path: Path, prompt: str = "> ") -> list[str]:
+    import curses
+
+    meta = MetaStore(db_path)
+    try:
+        return curses.wrapper(_loop, FuzzyMatcher(meta), prompt)
+    finally:
+        meta.close()
+
+
+def _loop(screen, matcher: FuzzyMatcher, prompt: str) -> list[str]:
+    import curses
+
+    curses.curs_set(1)
+    query = ""
+    cursor = 0
+    marked: list[str] = []
+    matches = matcher.search(query, limit=curses.LINES)
+    while True:
+        height, width = screen.getmaxyx()
+        rows = max(1, height - 2)
+        screen.erase()
+        for y, match in enumerate(matches[:rows]):
+            mark = "*" if match.name in marked else " "
+            line = f"{mark} {match.name}"
+            if match.description:
+                line += f"  —  {match.description}"
+            attr = curses.A_REVERSE if y == cursor else curses.A_NORMAL
+            screen.addnstr(y, 0, line, width - 1, attr)
+        status = f"{len(matches)} shown, {len(marked)} marked"
+        screen.addnstr(height - 2, 0, status, width - 1, curses.A_DIM)
+        screen.addnstr(height - 1, 0, prompt + query, width - 1)
+        screen.refresh()
+
+        key = screen.get_wch()
+        if key == "\x1b":
+            return []
+        if key in ("\n", "\r", curses.KEY_ENTER):
+            if marked:
+                return marked
+            return [matches[cursor].name] if matches else []
+        if key == "\t":
+            if matches:
+                name = matches[cursor].name
+                if name in marked:
+                    marked.remove(name)
+                else:
+                    marked.append(name)
+                cursor = min(cursor + 1, len(matches) - 1)
+            continue
+        if key == curses.KEY_UP:
+            cursor = max(cursor - 1, 0)
+            continue
+        if key == curses.KEY_DOWN:
+            cursor = min(cursor + 1, max(len(matches[:rows]) - 1, 0))
+            continue
+        if key in (curses.KEY_BACKSPACE, "\x7f", "\b"):
+            query = query[:-1]
+        elif isinstance(key, str) and key.isprintable():
+            query += key
+        else:
+            continue
+        # Each keystroke is one incremental search; extending the query refines in memory
+        matches = matcher.search(query, limit=rows)
+        cursor = 0
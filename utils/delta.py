@@ -0,0 +1,114 @@
+from __future__ import annotations
+import hashlib
+import math
+import mmap
+import os
+import zlib
+from pathlib import Path
+
+#rsync-style delta copies: rebuild a new version of a file next to an old one ("the basis") by
+#reusing every block of the basis that still appears somewhere in the new file and reading
+#only the rest from the source. Blocks are found with a rolling Adler-32 (so a block is spotted
+#at any offset, not just where it used to be) and confirmed with BLAKE2b.
+
+#Adler-32 modulus; zlib.adler32 gives the checksum of a fresh window, rolling updates follow it
+_MOD = 65521
+BLOCK_MIN = 4096
+BLOCK_MAX = 1 << 17
+#Total bytes the scan may advance one at a time (pure Python) before it only tries block
+#boundaries; keeps a file with nothing in common with its basis from crawling
+SLIDE_BUDGET = 1 << 20
+#Literal runs are written out in pieces this big
+_CHUNK = 1 << 20
+
+
+#sqrt of the file size (as rsync does), in whole 4 KiB pages so database pages line up
+def block_size(size: int) -> int:
+    pages = -(-math.isqrt(max(size, 1)) // BLOCK_MIN)
+    return max(BLOCK_MIN, min(BLOCK_MAX, pages * BLOCK_MIN))
+
+
+def _strong(data) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+#weak checksum -> [(block index, strong checksum)] for every full block of the basis
+def signatures(basis: Path, block: int) -> dict[int, list[tuple[int, bytes]]]:
+    sigs: dict[int, list[tuple[int, bytes]]] = {}
+    with open(basis, "rb") as f:
+        index = 0
+        for data in iter(lambda: f.read(block), b""):
+            if len(data) < block:
+                break
+            sigs.setdefault(zlib.adler32(data), []).append((index, _strong(data)))
+            index += 1
+    return sigs
+
+
+#writes src's contents to dst, copying whatever it can from basis; returns how many bytes had
+#to come from src (the rest was read from basis)
+def delta_copy(src: Path, basis: Path, dst: Path, block: int | None = None) -> int:
+    size = os.path.getsize(src)
+    block = block or block_size(size)
+    sigs = signatures(basis, block)
+    with open(src, "rb") as fsrc, open(basis, "rb") as fbasis, open(dst, "wb") as out:
+        if size == 0:
+            return 0
+        with mmap.mmap(fsrc.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return _rebuild(data, size, block, sigs, fbasis, out)
+
+
+def _rebuild(data, size: int, block: int, sigs: dict, basis, out) -> int:
+    literal = 0
+    budget = SLIDE_BUDGET
+
+    def find(at: int, weak: int) -> int | None:
+        # Index of the basis block equal to data[at:at + block], if any
+        candidates = sigs.get(weak)
+        if candidates:
+            strong = _strong(data[at:at + block])
+            for index, digest in candidates:
+                if digest == strong:
+                    return index
+        return None
+
+    def emit_literal(start: int, end: int) -> None:
+        nonlocal literal
+        for at in range(start, end, _CHUNK):
+            out.write(data[at:min(end, at + _CHUNK)])
+        literal += end - start
+
+    pos = lit_start = 0
+    weak = None
+    while pos + block <= size:
+        fresh = weak is None
+        if fresh:
+            weak = zlib.adler32(data[pos:pos + block])
+        index = find(pos, weak)
+        if index is not None:
+            emit_literal(lit_start, pos)
+            basis.seek(index * block)
+            out.write(basis.read(block))
+            pos = lit_start = pos + block
+            weak = None
+            continue
+        # A miss. If the next block boundary matches, this block was changed in place
+        # (the usual case for database pages): skip over it rather than sliding through it
+        ahead = pos + block
+        if fresh and ahead + block <= size:
+            weak_ahead = zlib.adler32(data[ahead:ahead + block])
+            if find(ahead, weak_ahead) is not None:
+                pos, weak = ahead, weak_ahead
+                continue
+        if budget > 0 and ahead < size:
+            # Slide the window one byte: drop data[pos], take in data[pos + block]
+            dropped, added = data[pos], data[ahead]
+            a = ((weak & 0xFFFF) - dropped + added) % _MOD
+            b = ((weak >> 16) - block * dropped + a - 1) % _MOD
+            weak = (b << 16) | a
+            pos += 1
+            budget -= 1
+        else:
+            pos, weak = ahead, None
+    emit_literal(lit_start, size)
+    return literal
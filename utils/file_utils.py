@@ -1,6 +1,15 @@
 from __future__ import annotations
+import errno
+import hashlib
+import os
 import shutil
+import threading
+import time
+from collections import Counter
 from pathlib import Path
+from typing import Iterator
+
+from utils import trace
 
 #This file contains utility functions for file management, such as creating directories and prompting the user for yes/no input
 
@@ -13,7 +22,146 @@ def prompt_yes_no(message:str)-> bool:
     answer = input((f"{message}(y/n):")).strip().lower()
     return answer =="y"
 
-#utilizes the shutil libray to copy a file from src to dst, ensuring that the destination directory exists before copying
-def copy_file(src: Path, dst: Path) -> None:
+#Linux ioctl that makes dst share src's extents (btrfs, XFS, bcachefs...): an instant, zero-byte copy
+FICLONE = 0x40049409
+#errors that mean "this kernel/filesystem can't do that", so the next strategy should be tried
+_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF, errno.EPERM}
+
+
+class CopyStats:
+    #tallies which copy strategy was used and how fast, safe to share between worker threads
+    def __init__(self) -> None:
+        self.strategies: Counter[str] = Counter()
+        self.bytes = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, strategy: str, nbytes: int, seconds: float) -> None:
+        with self._lock:
+            self.strategies[strategy] += 1
+            self.bytes += nbytes
+            self.seconds += seconds
+
+    def summary(self) -> str:
+        #e.g. "reflink x12, copy_file_range x3 — 1.2 GB at 850.0 MB/s"
+        if not self.strategies:
+            return "nothing copied"
+        used = ", ".join(f"{name} x{count}" for name, count in self.strategies.most_common())
+        if self.seconds <= 0:
+            return f"{used} — {self.bytes / 1e6:.1f} MB"
+        return f"{used} — {self.bytes / 1e6:.1f} MB at {self.bytes / self.seconds / 1e6:.1f} MB/s"
+
+
+#copies src to dst (data plus permissions/timestamps, like shutil.copy2) with the cheapest
+#strategy the filesystem supports: reflink, then copy_file_range, then sendfile, then a
+#buffered copy. Returns the name of the strategy that worked.
+def copy_file(src: Path, dst: Path, stats: CopyStats | None = None) -> str:
     ensure_dir(dst.parent)
-    shutil.copy2(src, dst)
\ No newline at end of file
+    started = time.perf_counter()
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        strategy = _copy_data(fsrc.fileno(), fdst.fileno(), size)
+        if strategy == "buffered":
+            shutil.copyfileobj(fsrc, fdst, 1 << 20)
+    shutil.copystat(src, dst)
+    if stats is not None:
+        stats.record(strategy, size, time.perf_counter() - started)
+    if trace.ENABLED:
+        trace.add("bytes.copied", size)
+    return strategy
+
+
+def _copy_data(src_fd: int, dst_fd: int, size: int) -> str:
+    #tries the in-kernel strategies in order; "buffered" means the caller must copy in userspace
+    try:
+        import fcntl
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return "reflink"
+    except (ImportError, OSError):
+        pass
+
+    steps = []
+    if hasattr(os, "copy_file_range"):
+        steps.append(("copy_file_range", _copy_range_step))
+    if hasattr(os, "sendfile"):
+        steps.append(("sendfile", _sendfile_step))
+    for name, step in steps:
+        offset = 0
+        try:
+            while offset < size:
+                sent = step(src_fd, dst_fd, offset, min(size - offset, 1 << 30))
+                if sent == 0:
+                    break
+                offset += sent
+            return name
+        except OSError as exc:
+            if exc.errno not in _UNSUPPORTED:
+                raise
+            #start over cleanly with the next strategy
+            os.ftruncate(dst_fd, 0)
+            os.lseek(dst_fd, 0, os.SEEK_SET)
+    return "buffered"
+
+
+def _copy_range_step(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+    return os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+
+
+def _sendfile_step(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+#streams the file through SHA-256 in fixed-size blocks so big files never have to fit in memory
+def hash_file(path: Path, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+        if trace.ENABLED:
+            trace.add("bytes.hashed", f.tell())
+    return h.hexdigest()
+
+
+#moves a finished temp file over dst for good: its data is flushed to disk before the rename and
+#the rename itself right after, so a crash leaves either nothing or the whole file at dst
+def replace_durably(tmp: Path | str, dst: Path) -> None:
+    fd = os.open(tmp, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp, dst)
+    fsync_dir(dst.parent)
+
+
+def fsync_dir(path: Path) -> None:
+    #makes renames into a directory durable; not every platform can open a directory for that
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+#walks a directory tree lazily with os.scandir, yielding regular files as they are found
+#directory symlinks are not followed so a link loop can't trap the walk
+def iter_files(root: Path) -> Iterator[Path]:
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = sorted(os.scandir(current), key=lambda e: e.name)
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(Path(entry.path))
+            elif entry.is_file():
+                yield Path(entry.path)
+        #push in reverse so directories come out in name order
+        stack.extend(reversed(subdirs))
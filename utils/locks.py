@@ -0,0 +1,108 @@
+from __future__ import annotations
+import errno
+import os
+import threading
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # not on Windows: locks then only keep this process's threads apart
+    fcntl = None
+
+#Advisory locks on vault entries (a blob digest, a chunk, a name), shared by every process that
+#opens the vault. Each key hashes to one byte of a single lock file and is locked with a POSIX
+#byte-range lock, so unrelated entries never wait on each other and no lock files pile up.
+#Two keys that land on the same byte just share a lock, which is harmless.
+#Each kind of key (blob contents, vault names) has its own range of bytes. Code holding a name
+#may go on to lock contents, never the other way round, and code holding several names takes
+#further ones without waiting (see add_many), so two processes can't deadlock.
+#
+#POSIX locks belong to the process, not the thread (and closing any descriptor of the file drops
+#them all), so each process keeps one descriptor per lock file open for good, and a thread lock
+#per byte keeps its own threads apart.
+
+LOCK_FILE = ".locky-lock"
+STRIPES = 4096
+KINDS = ("blobs", "names")
+
+
+class EntryLocks:
+    def __init__(self, path: Path, base: int = 0) -> None:
+        self.path = path
+        self.base = base
+        self._fd: int | None = None
+        self._opened = False
+        self._lock = threading.Lock()
+        # stripe -> [thread lock, how deep its owner has it]
+        self._stripes: dict[int, list] = {}
+
+    @contextmanager
+    def hold(self, key: str, wait: bool = True) -> Iterator[None]:
+        #exclusive hold on key; the same thread may take a key it already holds.
+        #With wait=False a key held elsewhere raises BlockingIOError instead of waiting for it
+        stripe = zlib.crc32(key.encode()) % STRIPES
+        with self._lock:
+            slot = self._stripes.get(stripe)
+            if slot is None:
+                slot = self._stripes[stripe] = [threading.RLock(), 0]
+            fd = self._open()
+        if not slot[0].acquire(wait):
+            raise BlockingIOError(errno.EAGAIN, f"entry is locked: {key}")
+        try:
+            if slot[1] == 0 and fd is not None:
+                try:
+                    fcntl.lockf(fd, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB, 1, self.base + stripe)
+                except OSError as e:
+                    if e.errno not in (errno.EACCES, errno.EAGAIN):
+                        raise
+                    raise BlockingIOError(errno.EAGAIN, f"entry is locked: {key}") from None
+            slot[1] += 1
+            try:
+                yield
+            finally:
+                slot[1] -= 1
+                if slot[1] == 0 and fd is not None:
+                    fcntl.lockf(fd, fcntl.LOCK_UN, 1, self.base + stripe)
+        finally:
+            slot[0].release()
+
+    def _open(self) -> int | None:
+        #the lock file, opened once; a read-only vault just gets thread locks
+        if not self._opened:
+            self._opened = True
+            if fcntl is not None:
+                try:
+                    self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                except FileNotFoundError:
+                    self._opened = False  # no vault directory yet; try again next time
+                except OSError:
+                    self._fd = None
+        return self._fd
+
+
+_registry: dict[tuple[Path, str], EntryLocks] = {}
+_registry_lock = threading.Lock()
+
+
+def entry_locks(vault_dir: Path, kind: str = "blobs") -> EntryLocks:
+    #the one EntryLocks of this process for a vault's keys of one kind
+    path = (vault_dir / LOCK_FILE).absolute()
+    with _registry_lock:
+        locks = _registry.get((path, kind))
+        if locks is None:
+            locks = _registry[path, kind] = EntryLocks(path, KINDS.index(kind) * STRIPES)
+        return locks
+
+
+def _forget_after_fork() -> None:
+    #a forked child owns none of its parent's locks (and may have copied a held thread lock)
+    global _registry_lock
+    _registry.clear()
+    _registry_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_after_fork)
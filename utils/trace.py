@@ -0,0 +1,148 @@
+from __future__ import annotations
+import atexit
+import os
+import sys
+import threading
+import time
+
+#Opt-in timing for finding where a command spends its time:
+#  LOCKY_TRACE=1 (or `locky --trace ...`)            summary table on stderr when the command exits
+#  LOCKY_TRACE=trace.jsonl (or --trace=trace.jsonl)  one JSON line per span, plus counters at the end
+#When tracing is off, span() hands back a shared do-nothing context manager and add() returns at once,
+#so instrumented code pays one global lookup per call. Hot loops check ENABLED themselves.
+
+ENABLED = False
+
+_lock = threading.Lock()
+_spans: dict[str, list[float]] = {}   # name -> [calls, total seconds, max seconds]
+_counters: dict[str, int] = {}
+_jsonl = None
+_t0 = 0.0
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+
+_NOOP = _NoSpan()
+
+
+class _Span:
+    __slots__ = ("name", "attrs", "start")
+
+    def __init__(self, name: str, attrs: dict) -> None:
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        end = time.perf_counter()
+        _record(self.name, self.start, end, self.attrs, exc_type is not None)
+
+
+#times a block: `with trace.span("add.copy", file=name): ...`
+def span(name: str, **attrs):
+    if not ENABLED:
+        return _NOOP
+    return _Span(name, attrs)
+
+
+#bumps a counter such as bytes.read or sql.statements
+def add(name: str, n: int = 1) -> None:
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+#sqlite3 trace callback (see MetaStore): counts every statement the connection runs
+def sql(statement: str) -> None:
+    add("sql.statements")
+
+
+#turns tracing on; target is "1"/"summary" for the table, anything else is a JSON-lines file path
+def enable(target: str = "1") -> None:
+    global ENABLED, _jsonl, _t0
+    if ENABLED:
+        return
+    if target not in ("1", "summary", "true", "yes"):
+        _jsonl = open(target, "a", encoding="utf-8")
+    _t0 = time.perf_counter()
+    ENABLED = True
+    atexit.register(finish)
+
+
+#turns tracing on if LOCKY_TRACE asks for it
+def enable_from_env() -> None:
+    target = os.environ.get("LOCKY_TRACE", "")
+    if target and target.lower() not in ("0", "false", "no", "off"):
+        enable(target)
+
+
+#writes the summary table (or the closing counters line of a JSONL trace) and resets
+def finish() -> None:
+    global ENABLED, _jsonl
+    if not ENABLED:
+        return
+    ENABLED = False
+    wall = time.perf_counter() - _t0
+    if _jsonl is not None:
+        _emit({"counters": dict(_counters), "wall_ms": round(wall * 1000, 3)})
+        _jsonl.close()
+        _jsonl = None
+    else:
+        sys.stderr.write(summary(wall))
+    _spans.clear()
+    _counters.clear()
+
+
+def summary(wall: float | None = None) -> str:
+    lines = [f"{'span':<28}{'calls':>8}{'total ms':>12}{'mean ms':>10}{'max ms':>10}"]
+    for name, (calls, total, worst) in sorted(_spans.items(), key=lambda kv: -kv[1][1]):
+        lines.append(f"{name:<28}{int(calls):>8}{total * 1000:>12.2f}{total / calls * 1000:>10.3f}{worst * 1000:>10.3f}")
+    for name, value in sorted(_counters.items()):
+        shown = f"{value / 1e6:.2f} MB" if name.startswith("bytes.") else str(value)
+        lines.append(f"{name:<28}{shown:>40}")
+    if wall is not None:
+        lines.append(f"{'wall':<28}{wall * 1000:>38.2f}ms")
+    return "\n".join(lines) + "\n"
+
+
+def _record(name: str, start: float, end: float, attrs: dict, failed: bool) -> None:
+    took = end - start
+    with _lock:
+        stats = _spans.get(name)
+        if stats is None:
+            _spans[name] = [1, took, took]
+        else:
+            stats[0] += 1
+            stats[1] += took
+            if took > stats[2]:
+                stats[2] = took
+    if _jsonl is not None:
+        event = {
+            "span": name,
+            "start_ms": round((start - _t0) * 1000, 3),
+            "ms": round(took * 1000, 3),
+            "thread": threading.get_ident(),
+        }
+        if failed:
+            event["error"] = True
+        event.update(attrs)
+        _emit(event)
+
+
+def _emit(event: dict) -> None:
+    import json
+    line = json.dumps(event, default=str)
+    with _lock:
+        _jsonl.write(line + "\n")